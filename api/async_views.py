@@ -0,0 +1,44 @@
+"""Async versions of the pipeline endpoints, mounted under /api/async/.
+
+They read through the async lookup cache (lookup_cache.aget_metadata) so under
+an ASGI server (titerpipeline/asgi.py) a request waiting on the db doesn't hold a
+worker thread. The writes go through sync_to_async since they need a transaction
+and share upsert_read_paths() with the sync endpoints.
+"""
+from asgiref.sync import sync_to_async
+from ninja import Router
+
+from api.schemas import PathSchema, PathBatchSchema, SampleIdBatchSchema
+from api.services import cell_type_results, lookup_cell_types, upsert_read_paths
+from main import lookup_cache
+
+router = Router()
+
+
+@router.post("/receive-paths/")
+async def receive_paths(request, payload: PathSchema):
+    result = (await sync_to_async(upsert_read_paths)([payload]))[0]
+    return {"success": result["success"], "message": result["message"]}
+
+
+@router.get("/get-cell-type/")
+async def get_cell_type(request, sample_id: str):
+    metadata = await lookup_cache.aget_metadata(sample_id)
+    if metadata is None:
+        return {"success": False, "message": "Sample ID not found"}
+
+    cell_type = metadata.get("Cell_Line", "Unknown")
+    return {"success": True, "sample_id": sample_id, "cell_type": cell_type}
+
+
+@router.post("/receive-paths/batch/")
+async def receive_paths_batch(request, payload: PathBatchSchema):
+    results = await sync_to_async(upsert_read_paths)(payload.paths)
+    saved = sum(1 for result in results if result["success"])
+    return {"success": saved == len(results), "saved": saved, "results": results}
+
+
+@router.post("/get-cell-type/batch/")
+async def get_cell_type_batch(request, payload: SampleIdBatchSchema):
+    cell_types = await sync_to_async(lookup_cell_types)(payload.sample_ids)
+    return {"results": cell_type_results(payload.sample_ids, cell_types)}
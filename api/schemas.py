@@ -0,0 +1,17 @@
+from typing import List
+from ninja import Schema
+
+
+class PathSchema(Schema):
+    sample_id: str
+    read1_path: str
+    read2_path: str
+
+class PathBatchSchema(Schema):
+    paths: List[PathSchema]
+
+class SampleIdBatchSchema(Schema):
+    sample_ids: List[str]
+
+class FastqScanSchema(Schema):
+    full: bool = False
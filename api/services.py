@@ -0,0 +1,77 @@
+"""Db work behind the pipeline API endpoints, shared by the single and batch handlers."""
+from collections import Counter
+
+from django.db import transaction
+
+from main.facets import adjust_facets, read_pair_facet_values
+from main import lookup_cache
+from main.filters import filter_results
+from main.models import Sample, Read_Pair
+
+# plate number given to read pairs the pipeline reports before the sheets import created them
+UNKNOWN_PLATE_NUMBER = 0
+
+
+def resolve_samples(sample_ids):
+    """{sample_id: Sample pk} for the given sample ids, with one IN query"""
+    return dict(Sample.objects.filter(sample_id__in=set(sample_ids)).values_list('sample_id', 'id'))
+
+
+def upsert_read_paths(records):
+    """Save the read paths of many samples at once.
+
+    `records` is a list of objects with sample_id, read1_path and read2_path. The first read pair
+    (lowest id) of each sample is updated, samples without one get a new read pair. Returns one
+    result dict per record, in the same order.
+    """
+    samples = resolve_samples(record.sample_id for record in records)
+
+    existing = {}
+    for pair in Read_Pair.objects.filter(sample_id__in=samples.values()).order_by('-id'):
+        existing[pair.sample_id_id] = pair  # ordered by -id so the lowest id wins
+
+    to_create, to_update, results = {}, {}, []
+    for record in records:
+        sample_pk = samples.get(record.sample_id)
+        if sample_pk is None:
+            results.append({"sample_id": record.sample_id, "success": False, "message": "Sample ID not found!"})
+            continue
+
+        pair = existing.get(sample_pk) or to_create.get(sample_pk)
+        if pair is None:
+            pair = Read_Pair(sample_id_id=sample_pk, plate_number=UNKNOWN_PLATE_NUMBER)
+            to_create[sample_pk] = pair
+        elif pair.pk:
+            to_update[pair.pk] = pair
+        pair.read1_path = record.read1_path
+        pair.read2_path = record.read2_path
+        results.append({"sample_id": record.sample_id, "success": True, "message": "Paths received and saved!"})
+
+    with transaction.atomic():
+        Read_Pair.objects.bulk_create(to_create.values())
+        Read_Pair.objects.bulk_update(to_update.values(), ['read1_path', 'read2_path'])
+
+        # bulk writes skip the signals in main/signals.py, new read pairs add to the plate number facet
+        new_facets = Counter(value for pair in to_create.values() for value in read_pair_facet_values(pair))
+        for facet_value, count in new_facets.items():
+            adjust_facets([facet_value], count)
+    if to_create:
+        filter_results.clear()
+    return results
+
+
+def lookup_cell_types(sample_ids):
+    """{sample_id: cell line} for the sample ids that have metadata, through the lookup cache"""
+    return {sample_id: metadata.get("Cell_Line", "Unknown")
+            for sample_id, metadata in lookup_cache.get_many_metadata(sample_ids).items()}
+
+
+def cell_type_results(sample_ids, cell_types):
+    """Per-item response for the batch get-cell-type endpoints, in request order"""
+    results = []
+    for sample_id in sample_ids:
+        if sample_id in cell_types:
+            results.append({"success": True, "sample_id": sample_id, "cell_type": cell_types[sample_id]})
+        else:
+            results.append({"success": False, "sample_id": sample_id, "message": "Sample ID not found"})
+    return results
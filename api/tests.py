@@ -1,3 +1,244 @@
-from django.test import TestCase
-
-# Create your tests here.
+import json
+import threading
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+
+from api.write_queue import WriteCoalescer
+from jobs.models import Job
+from main import lookup_cache
+from main.importer import BulkImporter
+from main.models import CacheGeneration, FastqFile, Read_Pair, Sample_Metadata, Titer
+from main.testing import sheet_row
+
+
+class BatchEndpointTests(TestCase):
+    def setUp(self):
+        lookup_cache.clear()
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2", **{"Cell Line": "Aa23"})])
+        Read_Pair.objects.filter(sample_id__sample_id="S2").delete()
+
+    def post(self, url, payload):
+        return self.client.post(url, json.dumps(payload), content_type="application/json").json()
+
+    def test_receive_paths_batch_updates_and_creates_read_pairs(self):
+        paths = [
+            {"sample_id": "S1", "read1_path": "/runs/1/S1_R1.fastq.gz", "read2_path": "/runs/1/S1_R2.fastq.gz"},
+            {"sample_id": "S2", "read1_path": "/runs/1/S2_R1.fastq.gz", "read2_path": "/runs/1/S2_R2.fastq.gz"},
+            {"sample_id": "NOPE", "read1_path": "a", "read2_path": "b"},
+        ]
+        with self.assertNumQueries(9):  # same count for any number of paths
+            body = self.post("/api/receive-paths/batch/", {"paths": paths})
+
+        self.assertEqual(body["saved"], 2)
+        self.assertEqual([r["success"] for r in body["results"]], [True, True, False])
+        self.assertEqual(Read_Pair.objects.get(sample_id__sample_id="S1").read1_path, "/runs/1/S1_R1.fastq.gz")
+        self.assertEqual(Read_Pair.objects.get(sample_id__sample_id="S2").plate_number, 0)
+        self.assertEqual(Read_Pair.objects.count(), 2)
+
+    def test_receive_paths_updates_the_first_read_pair(self):
+        first = Read_Pair.objects.get(sample_id__sample_id="S1")
+        second = Read_Pair.objects.create(sample_id=first.sample_id, plate_number=2, read1_path="a", read2_path="b")
+        body = self.post("/api/receive-paths/", {"sample_id": "S1", "read1_path": "/r1.fastq.gz", "read2_path": "/r2.fastq.gz"})
+
+        self.assertEqual(body, {"success": True, "message": "Paths received and saved!"})
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.read1_path, second.read1_path), ("/r1.fastq.gz", "a"))
+        self.assertEqual(self.post("/api/receive-paths/", {"sample_id": "NOPE", "read1_path": "a", "read2_path": "b"}),
+                         {"success": False, "message": "Sample ID not found!"})
+
+    def test_get_cell_type_batch(self):
+        with self.assertNumQueries(2):  # generation counter, metadata
+            body = self.post("/api/get-cell-type/batch/", {"sample_ids": ["S2", "S1", "NOPE"]})
+
+        self.assertEqual([r.get("cell_type") for r in body["results"]], ["Aa23", "JW18", None])
+        self.assertFalse(body["results"][2]["success"])
+
+
+class AsyncEndpointTests(TestCase):
+    def setUp(self):
+        lookup_cache.clear()
+        BulkImporter().run([sheet_row("S1")])
+
+    async def test_async_get_cell_type(self):
+        response = await self.async_client.get("/api/async/get-cell-type/", {"sample_id": "S1"})
+
+        self.assertEqual(response.json(), {"success": True, "sample_id": "S1", "cell_type": "JW18"})
+
+    async def test_async_receive_paths(self):
+        payload = {"sample_id": "S1", "read1_path": "/r1.fastq.gz", "read2_path": "/r2.fastq.gz"}
+        response = await self.async_client.post("/api/async/receive-paths/", json.dumps(payload),
+                                                content_type="application/json")
+
+        self.assertTrue(response.json()["success"])
+        pair = await Read_Pair.objects.aget(sample_id__sample_id="S1")
+        self.assertEqual(pair.read1_path, "/r1.fastq.gz")
+
+
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        lookup_cache.clear()
+        lookup_cache.reset_stats()
+        BulkImporter().run([sheet_row("S1")])
+
+    def test_get_cell_type_reads_through_the_cache(self):
+        self.client.get("/api/get-cell-type/", {"sample_id": "S1"})
+        with self.assertNumQueries(1):  # just the generation counter
+            body = self.client.get("/api/get-cell-type/", {"sample_id": "S1"}).json()
+
+        self.assertEqual(body["cell_type"], "JW18")
+        self.assertEqual(self.client.get("/api/cache-stats/").json()["hits"], 1)
+
+    def test_saves_and_imports_invalidate(self):
+        self.assertEqual(lookup_cache.get_metadata("S1")["Cell_Line"], "JW18")
+
+        meta = Sample_Metadata.objects.get()
+        meta.metadata = dict(meta.metadata, Cell_Line="S2")
+        meta.save()
+        self.assertEqual(lookup_cache.get_metadata("S1")["Cell_Line"], "S2")
+
+        BulkImporter().run([sheet_row("S1", **{"Cell Line": "Aa23"})])
+        self.assertEqual(lookup_cache.get_metadata("S1")["Cell_Line"], "Aa23")
+
+    def test_invalidation_reaches_other_processes(self):
+        self.assertEqual(lookup_cache.get_metadata("S1")["Cell_Line"], "JW18")
+        # another process changes the row and bumps the generation, this process's cache isn't touched
+        Sample_Metadata.objects.filter(sample_id__sample_id="S1").update(metadata={"Cell_Line": "Aa23"})
+        CacheGeneration.bump(lookup_cache.GENERATION)
+
+        self.assertEqual(lookup_cache.get_metadata("S1")["Cell_Line"], "Aa23")
+        self.assertEqual(lookup_cache.stats()["misses"], 2)
+
+
+class TiterBulkEndpointTests(TestCase):
+    def setUp(self):
+        BulkImporter().run([sheet_row("S1")])
+
+    def test_upload_tsv(self):
+        body = "sample\twri_titer\ttotal_reads\nS1\t0.5\t100\nNOPE\t1\t1\n"
+        response = self.client.post("/api/titers/bulk/?sequencing_run=run_9", body,
+                                    content_type="text/tab-separated-values").json()
+
+        self.assertEqual((response["saved"], response["skipped"]), (1, 1))
+        self.assertEqual(Titer.objects.get().sequencing_run, "run_9")
+
+
+class FastqEndpointTests(TestCase):
+    def setUp(self):
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2")])
+        Read_Pair.objects.filter(sample_id__sample_id="S1").update(read1_path="/runs/1/S1_R1.fastq.gz",
+                                                                   read2_path="/runs/1/S1_R2.fastq.gz")
+        FastqFile.objects.create(path="/runs/1/S1_R1.fastq.gz", name="S1_R1.fastq.gz", size=1000, mtime=1.0,
+                                 read_count_estimate=25, scanned_at="2026-01-01T00:00:00Z")
+
+    def post(self, url, payload):
+        return self.client.post(url, json.dumps(payload), content_type="application/json")
+
+    def test_verify_reports_indexed_files(self):
+        with self.assertNumQueries(2):
+            body = self.post("/api/fastq/verify/", {"sample_ids": ["S1", "NOPE"]}).json()
+
+        s1, nope = body["results"]
+        self.assertFalse(s1["complete"])
+        self.assertEqual(s1["read_pairs"][0]["read1"]["read_count_estimate"], 25)
+        self.assertFalse(s1["read_pairs"][0]["read2"]["found"])
+        self.assertFalse(nope["success"])
+
+    def test_scan_is_queued_as_a_job(self):
+        self.assertEqual(self.post("/api/fastq/scan/", {}).status_code, 401)
+        self.client.force_login(User.objects.create_user("tester"))
+        self.assertEqual(self.post("/api/fastq/scan/", {}).status_code, 403)
+        self.client.force_login(User.objects.create_user("admin", is_staff=True))
+        self.assertEqual(self.post("/api/fastq/scan/", {}).status_code, 400)
+
+        with override_settings(SEQUENCING_DIRS=["/runs"]):
+            first = self.post("/api/fastq/scan/", {}).json()
+            second = self.post("/api/fastq/scan/", {"full": True}).json()
+
+        self.assertEqual(first["job_id"], second["job_id"])  # already queued, not queued again
+        job = Job.objects.get()
+        self.assertEqual((job.kind, job.params), ("scan_fastq", {"full": True}))
+
+    def test_scan_needs_the_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.create_user("admin", is_staff=True))
+
+        with override_settings(SEQUENCING_DIRS=["/runs"]):
+            response = client.post("/api/fastq/scan/", "{}", content_type="application/json")
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Job.objects.exists())
+
+
+class WriteCoalescerTests(TestCase):
+    def test_concurrent_submits_are_flushed_together(self):
+        batches = []
+        release = threading.Event()
+
+        def flush(items):
+            release.wait(1)  # hold the first batch so the rest queue up behind it
+            batches.append(list(items))
+            return [item * 10 for item in items]
+
+        coalescer = WriteCoalescer(flush, max_batch=50, max_wait=0.05)
+        results = {}
+        threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, coalescer.submit(i))) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {i: i * 10 for i in range(20)})
+        self.assertEqual(sorted(item for batch in batches for item in batch), list(range(20)))
+        self.assertLess(len(batches), 20)
+
+    def test_flush_errors_reach_the_caller(self):
+        def flush(items):
+            raise RuntimeError("database is locked")
+
+        with self.assertRaisesMessage(RuntimeError, "database is locked"):
+            WriteCoalescer(flush).submit(1)
+
+    def test_a_bad_item_only_fails_its_own_caller(self):
+        flushed = []
+        release = threading.Event()
+
+        def flush(items):
+            release.wait(1)
+            flushed.append(list(items))
+            if -1 in items:
+                raise ValueError("violates unique_read_pair_per_sample")
+            return [item * 10 for item in items]
+
+        coalescer = WriteCoalescer(flush, max_batch=50, max_wait=0.05)
+        results = {}
+
+        def submit(i):
+            try:
+                results[i] = coalescer.submit(i)
+            except ValueError as e:
+                results[i] = str(e)
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in (1, 2, -1, 3)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {1: 10, 2: 20, 3: 30, -1: "violates unique_read_pair_per_sample"})
+        self.assertIn([-1], flushed)  # retried alone
+
+
+@override_settings(READ_PAIR_WRITE_COALESCING=True)
+class CoalescedReceivePathsTests(TransactionTestCase):
+    def test_receive_paths_is_saved_through_the_write_queue(self):
+        BulkImporter().run([sheet_row("S1")])
+        body = self.client.post("/api/receive-paths/", json.dumps(
+            {"sample_id": "S1", "read1_path": "/runs/2/S1_R1.fastq.gz", "read2_path": "/runs/2/S1_R2.fastq.gz"}),
+            content_type="application/json").json()
+
+        self.assertEqual(body, {"success": True, "message": "Paths received and saved!"})
+        self.assertEqual(Read_Pair.objects.get(sample_id__sample_id="S1").read1_path, "/runs/2/S1_R1.fastq.gz")
@@ -1,45 +1,134 @@
+from django.db import transaction
 from django.shortcuts import render
-from ninja import NinjaAPI, Schema
-from main.models import Sample, Read_Pair, Sample_Metadata
+from ninja import NinjaAPI
+from ninja.security import django_auth
+from main import lookup_cache
+from main.fastq_index import read_pair_files, sequencing_dirs
+from main.models import Titer
+from main.titers import titer_summary
+from main.titer_import import TiterFormatError, TiterImporter, iter_titer_rows
+from api.async_views import router as async_router
+from api.schemas import FastqScanSchema, PathSchema, PathBatchSchema, SampleIdBatchSchema
+from api.services import cell_type_results, lookup_cell_types, upsert_read_paths
+from api.write_queue import coalescing_enabled, read_pair_writes
+from jobs.models import Job
+from jobs.queue import enqueue
 
 api = NinjaAPI()
 
-class PathSchema(Schema):
-    sample_id: str
-    read1_path: str
-    read2_path: str
+# async versions of the endpoints below, for ASGI deployments
+api.add_router("/async/", async_router)
 
 @api.post("/receive-paths/")
 def receive_paths(request, payload: PathSchema):
-    try:
-        # Extract values from the payload
-        sample_id = payload.sample_id
-        read1_path = payload.read1_path
-        read2_path = payload.read2_path
-
-        sample = Sample.objects.get(sample_id=sample_id)
-        read_pair, created = Read_Pair.objects.update_or_create(
-            sample_id=sample,
-            defaults={'read1_path': read1_path, 'read2_path': read2_path}
-        )
-        return {"success": True, "message": "Paths received and saved!"}
-    
-    except Sample.DoesNotExist:
-        return {"success": False, "message": "Sample ID not found!"}
-    
+    if coalescing_enabled():
+        # saved together with the other requests that arrive in the same few ms, see api/write_queue.py
+        result = read_pair_writes.submit(payload)
+        return {"success": result["success"], "message": result["message"]}
+
+    # the same upsert as the batch endpoint and the write queue: the sample's first read pair gets the paths
+    result = upsert_read_paths([payload])[0]
+    return {"success": result["success"], "message": result["message"]}
+
 
 @api.get("/get-cell-type/")
 def get_cell_type(request, sample_id: str):
+    # metadata is read through the lookup cache, the db is only hit on a miss (main/lookup_cache.py)
+    metadata_dict = lookup_cache.get_metadata(sample_id)
+    if metadata_dict is None:
+        return {"success": False, "message": "Sample ID not found"}
+
+    # Extract the cell type from the metadata
+    cell_type = metadata_dict.get("Cell_Line", "Unknown") 
+
+    return {"success": True, "sample_id": sample_id, "cell_type": cell_type}
+
+
+@api.get("/cache-stats/")
+def cache_stats(request):
+    """hit/miss counters of the sample lookup cache in this worker process"""
+    return lookup_cache.stats()
+
+
+"""Batch versions of the endpoints above, so the pipeline can register a whole plate in one request.
+Samples are resolved with one IN query and the read pairs are written in bulk, see api/services.py"""
+@api.post("/receive-paths/batch/")
+def receive_paths_batch(request, payload: PathBatchSchema):
+    results = upsert_read_paths(payload.paths)
+    saved = sum(1 for result in results if result["success"])
+    return {"success": saved == len(results), "saved": saved, "results": results}
+
+
+@api.post("/get-cell-type/batch/")
+def get_cell_type_batch(request, payload: SampleIdBatchSchema):
+    cell_types = lookup_cell_types(payload.sample_ids)
+    return {"results": cell_type_results(payload.sample_ids, cell_types)}
+
+
+"""Summary statistics (count, mean, min, max, stddev, median, percentiles) of the titer results,
+grouped by experiment, infection, timepoint or sequencing run. See main/titers.py"""
+@api.get("/titers/summary/")
+def titers_summary(request, group_by: str = 'experiment', metric: str = 'wri_titer', sequencing_run: str = None):
+    queryset = Titer.objects.filter(sequencing_run=sequencing_run) if sequencing_run else None
     try:
-        metadata_obj = Sample_Metadata.objects.get(sample_id__sample_id=sample_id)
-        metadata_dict = metadata_obj.metadata
+        summary = titer_summary(group_by=group_by, metric=metric, queryset=queryset)
+    except ValueError as e:
+        return api.create_response(request, {"success": False, "message": str(e)}, status=400)
+    return {"success": True, "group_by": group_by, "metric": metric, "groups": summary}
 
-        # Extract the cell type from the metadata
-        cell_type = metadata_dict.get("Cell_Line", "Unknown") 
 
-        return {"success": True, "sample_id": sample_id, "cell_type": cell_type}
-    
-    except Sample_Metadata.DoesNotExist:
-        return {"success": False, "message": "Sample ID not found"}
-    
+"""Bulk upload of the pipeline's titer results. The request body is the pipeline's TSV/CSV output,
+read line by line from the request stream and upserted by (sample, sequencing run) in batches"""
+@api.post("/titers/bulk/")
+def titers_bulk(request, sequencing_run: str = None):
+    errors = []
+    importer = TiterImporter(sequencing_run=sequencing_run, on_error=errors.append)
+    try:
+        stats = importer.run(iter_titer_rows(line.decode('utf-8') for line in request))
+    except TiterFormatError as e:
+        return api.create_response(request, {"success": False, "message": str(e)}, status=400)
+    return {"success": not errors, **stats.as_dict(), "errors": errors[:100]}
+
+
+"""Queue a rescan of the sequencing directories (SEQUENCING_DIRS) into the FASTQ index, run by the
+jobs workers. Only new and changed files are read unless full is set, see main/fastq_index.py.
+Staff only, and a scan that is already queued or running is returned instead of queueing another"""
+@api.post("/fastq/scan/", auth=django_auth)  # session auth, checks the CSRF token
+def fastq_scan(request, payload: FastqScanSchema):
+    if not request.user.is_staff:
+        return api.create_response(request, {"success": False, "message": "Staff only"}, status=403)
+    if not sequencing_dirs():
+        return api.create_response(request, {"success": False, "message": "No SEQUENCING_DIRS configured"}, status=400)
+
+    with transaction.atomic():
+        job = Job.objects.filter(kind='scan_fastq', status__in=[Job.QUEUED, Job.RUNNING]).order_by('id').first()
+        if job is None:
+            job = enqueue('scan_fastq', {'full': payload.full}, user=request.user)
+        elif payload.full and job.status == Job.QUEUED and not job.params.get('full'):
+            Job.objects.filter(id=job.id, status=Job.QUEUED).update(params={'full': True})
+    return {"success": True, "job_id": job.id}
+
+
+def fastq_file_result(path, file):
+    if file is None:
+        return {"path": path, "found": False}
+    return {"path": path, "found": True, "indexed_path": file.path, "size": file.size,
+            "read_count_estimate": file.read_count_estimate}
+
 
+"""Whether the read files of the given samples are in the FASTQ index, with their size and read count estimate"""
+@api.post("/fastq/verify/")
+def fastq_verify(request, payload: SampleIdBatchSchema):
+    files = read_pair_files(payload.sample_ids)
+    results = []
+    for sample_id in payload.sample_ids:
+        if sample_id not in files:
+            results.append({"sample_id": sample_id, "success": False, "message": "No read pair found"})
+            continue
+        read_pairs = [{"read1": fastq_file_result(pair['read1_path'], pair['read1_file']),
+                       "read2": fastq_file_result(pair['read2_path'], pair['read2_file'])}
+                      for pair in files[sample_id]]
+        results.append({"sample_id": sample_id, "success": True,
+                        "complete": all(pair['read1']['found'] and pair['read2']['found'] for pair in read_pairs),
+                        "read_pairs": read_pairs})
+    return {"results": results}
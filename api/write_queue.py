@@ -0,0 +1,103 @@
+"""Write coalescing for the single read pair endpoint.
+
+When the pipeline finishes a plate it calls /api/receive-paths/ for every sample
+at once. Instead of one write transaction per request (which SQLite runs one
+after the other), each request hands its record to a WriteCoalescer and waits:
+a background thread collects whatever arrives within `max_wait` seconds (up to
+`max_batch` records) and saves the whole burst with one upsert_read_paths() call,
+so it commits in one transaction. If that fails, the records are saved again one
+at a time, each in its own transaction, so a bad record (e.g. one that breaks a
+constraint) only fails its own request. Enabled with READ_PAIR_WRITE_COALESCING = True.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from api.services import upsert_read_paths
+
+DEFAULT_MAX_BATCH = 500
+DEFAULT_MAX_WAIT = 0.005  # seconds
+SUBMIT_TIMEOUT = 30
+
+
+class WriteCoalescer:
+    """Runs `flush(items)` -> [result per item] on a background thread for batches of submitted items.
+    `flush` must write all or nothing (one transaction), a batch it fails is retried item by item"""
+
+    def __init__(self, flush, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item, timeout=SUBMIT_TIMEOUT):
+        """Queue `item` and block until its batch is saved, returns its result (or raises the flush error)"""
+        self._start()
+        future = Future()
+        self.queue.put((item, future))
+        return future.result(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='read-pair-writes', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush_one(self, item, future):
+        try:
+            result = self.flush([item])[0]
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            close_old_connections()
+            try:
+                results = self.flush([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    # the whole batch was rolled back, retry the items alone so only the bad ones fail
+                    for item, future in batch:
+                        self._flush_one(item, future)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            finally:
+                self.batches += 1
+                close_old_connections()
+
+
+read_pair_writes = WriteCoalescer(
+    upsert_read_paths,
+    max_batch=getattr(settings, 'READ_PAIR_WRITE_MAX_BATCH', DEFAULT_MAX_BATCH),
+    max_wait=getattr(settings, 'READ_PAIR_WRITE_MAX_WAIT', DEFAULT_MAX_WAIT),
+)
+
+
+def coalescing_enabled():
+    return getattr(settings, 'READ_PAIR_WRITE_COALESCING', False)
@@ -0,0 +1,118 @@
+"""Concurrency benchmark for the pipeline API, sync (WSGI) vs async (ASGI) handlers.
+
+Start the app under both servers on the same db, then point this script at each
+(run it with the same DB_NAME as the servers, it reads the sample ids from the db):
+
+    gunicorn titerpipeline.wsgi -w 4 -b 127.0.0.1:8000
+    uvicorn titerpipeline.asgi:application --workers 4 --port 8001
+
+    python benchmarks/api_concurrency.py --base-url http://127.0.0.1:8000/api
+    python benchmarks/api_concurrency.py --base-url http://127.0.0.1:8001/api/async
+
+Each run sends the same mix of get-cell-type / receive-paths requests from
+`--concurrency` client threads and prints throughput and latency percentiles.
+Every request is for a sample drawn from `--samples` existing ones, so the reads
+miss the lookup cache and the writes go to different rows, like a pipeline run
+reporting a plate.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "titerpipeline.settings")
+django.setup()
+
+from main.models import Sample  # noqa: E402
+from main.titers import percentile  # noqa: E402
+
+
+def get_cell_type(base_url, sample_id):
+    url = f"{base_url}/get-cell-type/?{urllib.parse.urlencode({'sample_id': sample_id})}"
+    with urllib.request.urlopen(url) as response:
+        return response.status
+
+
+def receive_paths(base_url, sample_id):
+    body = json.dumps({"sample_id": sample_id,
+                       "read1_path": f"/bench/{sample_id}_R1.fastq.gz",
+                       "read2_path": f"/bench/{sample_id}_R2.fastq.gz"}).encode()
+    request = urllib.request.Request(f"{base_url}/receive-paths/", data=body,
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+def timed(call, *args):
+    started = time.perf_counter()
+    try:
+        ok = call(*args) == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, time.perf_counter() - started
+
+
+def sample_pool(size):
+    """Up to `size` existing sample ids"""
+    return list(Sample.objects.order_by('id').values_list('sample_id', flat=True)[:size])
+
+
+def run(base_url, sample_ids, requests, concurrency, write_ratio, seed=0):
+    rng = random.Random(seed)
+    writes = int(requests * write_ratio)
+    calls = [(receive_paths if i < writes else get_cell_type, base_url, rng.choice(sample_ids))
+             for i in range(requests)]
+    # spread the writes between the reads, so they actually contend with each other
+    rng.shuffle(calls)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda call: timed(*call), calls))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    return {
+        "base_url": base_url,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for ok, _ in results if not ok),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            **{f"p{pct}": round(percentile(latencies, pct) * 1000, 2) if latencies else 0.0 for pct in (50, 95, 99)},
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000/api",
+                        help="api root, add /async to benchmark the async handlers")
+    parser.add_argument("--samples", type=int, default=1000,
+                        help="number of existing samples the requests are spread over")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--write-ratio", type=float, default=0.2,
+                        help="fraction of requests that are receive-paths writes")
+    args = parser.parse_args()
+
+    sample_ids = sample_pool(args.samples)
+    if not sample_ids:
+        parser.error("no samples in the db, fill it with generate_synthetic_data first")
+    print(json.dumps(run(args.base_url.rstrip("/"), sample_ids, args.requests,
+                         args.concurrency, args.write_ratio), indent=4))
+
+
+if __name__ == "__main__":
+    main()
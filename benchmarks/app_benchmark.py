@@ -0,0 +1,216 @@
+"""Benchmark harness for the views, exports, import and pipeline API.
+
+Run it against a db filled by generate_synthetic_data, preferably a separate one:
+
+    export DB_NAME=/tmp/bench.sqlite3
+    python manage.py migrate
+    python manage.py generate_synthetic_data --samples 100000
+    python benchmarks/app_benchmark.py --output bench-100k.json
+    python benchmarks/app_benchmark.py --output bench-100k-after.json --compare bench-100k.json
+
+Every target is requested `--repeat` times through the Django test client (no
+server needed). For each one the wall time (min / median / max), the number of
+SQL queries and the peak Python memory (tracemalloc) of the slowest run are
+recorded, and the results are written to a JSON file. Writes (the batch
+receive-paths and import_json targets) are rolled back. The caches are cleared
+before every run unless --warm is given, so the numbers are for cold requests.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "titerpipeline.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from main import lookup_cache  # noqa: E402
+from main.facets import get_facets  # noqa: E402
+from main.filters import filter_results  # noqa: E402
+from main.models import Experiment, Sample, Titer  # noqa: E402
+from main.synthetic import synthetic_sheet_rows  # noqa: E402
+
+BENCHMARK_USER = "benchmark"
+
+
+class Rollback(Exception):
+    pass
+
+
+def consume(response):
+    """Read the whole body, streaming responses are only produced while they're iterated"""
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def measure(call, rollback=False):
+    """(seconds, queries, peak bytes, response bytes) for one call"""
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                size = call()
+                if rollback:
+                    raise Rollback
+        except Rollback:
+            pass
+        elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, len(queries), peak, size
+
+
+def clear_caches():
+    cache.clear()
+    lookup_cache.clear()
+    filter_results.clear()
+
+
+def targets(client, import_rows):
+    """[(name, call, writes)] for every benchmarked view / endpoint"""
+    experiment = Experiment.objects.order_by('id').first()
+    sample_ids = list(Sample.objects.order_by('id').values_list('sample_id', flat=True)[:500])
+    facets = get_facets()
+    cell_line = (facets['cell_line'] or [''])[0]
+    filter_form = {'cell_line': cell_line, 'start_date': '', 'end_date': '', 'infection_status': '',
+                   'users': '', 'plate_num': ''}
+    first_sample = sample_ids[0] if sample_ids else ''
+    paths = [{"sample_id": s, "read1_path": f"/bench/{s}_R1.fastq.gz", "read2_path": f"/bench/{s}_R2.fastq.gz"}
+             for s in sample_ids]
+
+    def get(url, **params):
+        return lambda: consume(client.get(url, params))
+
+    def post_json(url, payload):
+        return lambda: consume(client.post(url, json.dumps(payload), content_type="application/json"))
+
+    def import_json():
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            for row in synthetic_sheet_rows(import_rows, prefix='BENCH', seed=42):
+                file.write(json.dumps(row) + '\n')
+        try:
+            call_command('import_json', file.name, stdout=io.StringIO())
+        finally:
+            os.unlink(file.name)
+        return import_rows
+
+    items = [
+        ('home', get(reverse('home')), False),
+        ('samples_by_experiment', get(reverse('samples_by_experiment'), exp_selection=experiment.name if experiment else ''), False),
+        ('filter_samples', lambda: consume(client.post(reverse('filter_samples'), filter_form)), False),
+        ('export_csv_by_exp', get(reverse('export_csv_by_exp', args=[experiment.id if experiment else 0])), False),
+        ('export_csv_query', get(reverse('export_csv_query'), cell_line=cell_line), False),
+        ('export_csv_gz_by_exp', get(reverse('export_csv_by_exp', args=[experiment.id if experiment else 0]), format='csv.gz'), False),
+        ('export_parquet_by_exp', get(reverse('export_csv_by_exp', args=[experiment.id if experiment else 0]), format='parquet'), False),
+        ('export_titers_parquet', get(reverse('export_titers'), format='parquet'), False),
+        ('api_get_cell_type', get('/api/get-cell-type/', sample_id=first_sample), False),
+        ('api_get_cell_type_batch', post_json('/api/get-cell-type/batch/', {"sample_ids": sample_ids}), False),
+        ('api_receive_paths_batch', post_json('/api/receive-paths/batch/', {"paths": paths}), True),
+        ('api_titer_summary', get('/api/titers/summary/', group_by='experiment'), False),
+        ('import_json', import_json, True),
+    ]
+    return items
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(repeat, warm, only, import_rows):
+    user, _ = User.objects.get_or_create(username=BENCHMARK_USER, defaults={'is_staff': True})
+    client = Client()
+    client.force_login(user)
+
+    results = {}
+    for name, call, writes in targets(client, import_rows):
+        if only and name not in only:
+            continue
+        runs = []
+        for _ in range(repeat):
+            if not warm:
+                clear_caches()
+            runs.append(measure(call, rollback=writes))
+        times = [elapsed for elapsed, _, _, _ in runs]
+        slowest = max(runs, key=lambda r: r[0])
+        results[name] = {
+            'min_s': round(min(times), 4),
+            'median_s': round(statistics.median(times), 4),
+            'max_s': round(max(times), 4),
+            'queries': slowest[1],
+            'peak_memory_kb': round(slowest[2] / 1024, 1),
+            'response_bytes': slowest[3],
+        }
+        print(f"{name:26} median {results[name]['median_s'] * 1000:9.1f} ms  "
+              f"{results[name]['queries']:5} queries  peak {results[name]['peak_memory_kb']:10.1f} KiB")
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)['results']
+    print(f"\nchange vs {baseline_path} (median time, queries):")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        ratio = result['median_s'] / before['median_s'] if before['median_s'] else float('inf')
+        print(f"  {name:26} x{ratio:6.2f}  queries {before['queries']} -> {result['queries']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file the results are written to")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per target")
+    parser.add_argument("--warm", action="store_true", help="keep the caches between runs")
+    parser.add_argument("--only", nargs="*", help="only run these targets")
+    parser.add_argument("--import-rows", type=int, default=5000, help="rows imported by the import_json target")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.warm, set(args.only or ()), args.import_rows)
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'samples': Sample.objects.count(),
+        'titers': Titer.objects.count(),
+        'repeat': args.repeat,
+        'warm': args.warm,
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"\nresults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
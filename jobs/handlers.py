@@ -0,0 +1,90 @@
+"""What each kind of job does. A handler gets the claimed Job and returns
+{'result': {...}, 'output_file': name of the file written to JOBS_OUTPUT_DIR (optional)}.
+"""
+import csv
+
+from django.utils.text import get_valid_filename
+
+from main.columnar import EXPORT_FORMATS, SAMPLE_FIELDS, sample_batches, write_batches
+from main.exports import SAMPLE_CSV_HEADER, sample_export_rows, sample_export_rows_for_ids
+from main.fastq_index import FastqIndexer, match_read_pairs
+from main.filters import SampleFilter
+from main.importer import DEFAULT_BATCH_SIZE, BulkImporter
+from main.models import Experiment, Sample
+from main.streaming import iter_records, open_input
+
+from jobs.queue import output_dir
+
+
+def write_csv(filename, header, rows):
+    """Write `rows` to JOBS_OUTPUT_DIR/filename, returns the number of rows written"""
+    count = 0
+    with open(output_dir() / filename, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_columnar(fmt, basename, batches):
+    """Write the record batches in one of main.columnar.EXPORT_FORMATS, returns (filename, rows written)"""
+    filename = basename + EXPORT_FORMATS[fmt][1]
+    with open(output_dir() / filename, 'wb') as file:
+        return filename, write_batches(fmt, batches, SAMPLE_FIELDS, file)
+
+
+# the export jobs write the plain CSV, or with params['format'] any of the columnar formats
+def export_experiment_csv(job):
+    experiment = Experiment.objects.get(id=job.params['experiment_id'])
+    samples = Sample.objects.filter(experiment=experiment)
+    basename = get_valid_filename(f"job_{job.pk}_samples_in_exp_{experiment.name}")
+    fmt = job.params.get('format', 'csv')
+    if fmt == 'csv':
+        filename = basename + '.csv'
+        count = write_csv(filename, SAMPLE_CSV_HEADER, sample_export_rows(samples))
+    else:
+        filename, count = write_columnar(fmt, basename, sample_batches(samples))
+    return {'result': {'rows': count, 'experiment': experiment.name}, 'output_file': filename}
+
+
+def export_filter_csv(job):
+    params = dict(job.params)
+    fmt = params.pop('format', 'csv')
+    sample_filter = SampleFilter(**params)
+    basename = f"job_{job.pk}_filtered_samples"
+    if fmt == 'csv':
+        filename = basename + '.csv'
+        count = write_csv(filename, SAMPLE_CSV_HEADER, sample_export_rows_for_ids(sample_filter.sample_ids()))
+    else:
+        filename, count = write_columnar(fmt, basename, sample_batches(ids=sample_filter.sample_ids()))
+    return {'result': {'rows': count, 'filter': {k: v for k, v in sample_filter.as_dict().items() if v}},
+            'output_file': filename}
+
+
+def import_json(job):
+    errors = []
+    stream = open_input(job.params['path'])
+    try:
+        stats = BulkImporter(
+            batch_size=job.params.get('batch_size', DEFAULT_BATCH_SIZE),
+            on_error=errors.append,
+        ).run(iter_records(stream, job.params.get('format', 'auto')))
+    finally:
+        stream.close()
+    return {'result': {'summary': stats.summary_lines(), 'errors': errors[:100], 'error_count': len(errors)}}
+
+
+def scan_fastq(job):
+    """Rescan the SEQUENCING_DIRS into the FASTQ index and rematch the read pairs"""
+    stats = FastqIndexer(full=job.params.get('full', False)).scan()
+    return {'result': {'scan': stats.as_dict(), 'read_pairs': match_read_pairs()}}
+
+
+HANDLERS = {
+    'export_experiment_csv': export_experiment_csv,
+    'export_filter_csv': export_filter_csv,
+    'import_json': import_json,
+    'scan_fastq': scan_fastq,
+}
@@ -0,0 +1,25 @@
+from jobs.worker import DEFAULT_POLL_INTERVAL, run_pool
+from jobs.queue import run_pending
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Run the queued background exports/imports with a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+        parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                            help="seconds an idle worker waits before checking the queue again")
+        parser.add_argument('--burst', action='store_true', help="exit once the queue is empty")
+        parser.add_argument('--inline', action='store_true',
+                            help="run the queued jobs in this process, one after another, then exit")
+
+    def handle(self, *args, **kwargs):
+        if kwargs['inline']:
+            ran = run_pending()
+            self.stdout.write(self.style.SUCCESS(f"{ran} job(s) run"))
+            return
+
+        self.stdout.write(f"Starting {kwargs['processes'] or 'one per core'} worker process(es), ctrl-c to stop")
+        run_pool(processes=kwargs['processes'], poll_interval=kwargs['poll_interval'], burst=kwargs['burst'])
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db import models
+
+
+class Job(models.Model):
+    """One background export/import, queued in the db and run by the run_jobs worker pool"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50)  # key in jobs.handlers.HANDLERS
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # touched by the worker while the job runs
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    output_file = models.CharField(max_length=500, blank=True)  # relative to JOBS_OUTPUT_DIR
+
+    class Meta:
+        indexes = [
+            # the workers claim the oldest queued job
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
@@ -0,0 +1,143 @@
+"""DB-backed job queue.
+
+Jobs are rows in the Job table. A worker claims the oldest queued job with a
+conditional UPDATE (status queued -> running), so any number of worker
+processes can poll the same table without a broker and without two of them
+running the same job. The handler for the job's kind (jobs/handlers.py) does
+the work and returns a result dict, and optionally the name of the file it
+wrote to JOBS_OUTPUT_DIR.
+
+While a handler runs, a thread of its worker touches the job's heartbeat_at
+every HEARTBEAT_INTERVAL. A running job without a heartbeat for
+DEFAULT_STALE_AFTER lost its worker (killed, or its host went down) and
+requeue_stale() puts it back in the queue, whichever host calls it.
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Q
+from django.utils import timezone
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 30  # seconds
+# a running job without a heartbeat for this long is assumed lost (worker killed) and queued again
+DEFAULT_STALE_AFTER = timedelta(minutes=5)
+
+
+def output_dir():
+    path = Path(getattr(settings, 'JOBS_OUTPUT_DIR', settings.BASE_DIR / 'job_output'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def enqueue(kind, params=None, user=None):
+    from jobs.handlers import HANDLERS
+
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}, expected one of {', '.join(HANDLERS)}")
+    return Job.objects.create(kind=kind, params=params or {}, created_by=user if user and user.is_authenticated else None)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next(worker=None):
+    """Mark the oldest queued job as running for `worker` and return it, None if the queue is empty"""
+    worker = worker or worker_name()
+    while True:
+        pk = Job.objects.filter(status=Job.QUEUED).order_by('created_at', 'id').values_list('id', flat=True).first()
+        if pk is None:
+            return None
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now)
+        if claimed:
+            return Job.objects.get(pk=pk)
+        # another worker got it first, try the next one
+
+
+class Heartbeat:
+    """Touch the job's heartbeat_at every `interval` seconds from a thread, for as long as the block runs"""
+
+    def __init__(self, job, interval=HEARTBEAT_INTERVAL):
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, name=f"job-{job.pk}-heartbeat", daemon=True)
+
+    def beat(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    Job.objects.filter(pk=self.job.pk, status=Job.RUNNING, worker=self.job.worker).update(
+                        heartbeat_at=timezone.now())
+                except Exception:  # e.g. "database is locked" during an import, the next beat may get through
+                    logger.exception("Heartbeat of job %s failed", self.job)
+        finally:
+            connections.close_all()  # the connection this thread opened
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_job(job):
+    """Run a claimed job's handler and store the outcome on the job"""
+    from jobs.handlers import HANDLERS
+
+    try:
+        with Heartbeat(job):
+            outcome = HANDLERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Job %s failed", job)
+        job.status = Job.FAILED
+        job.error = f"{e}\n\n{traceback.format_exc()}"
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = outcome.get('result', {})
+        job.output_file = outcome.get('output_file', '')
+    job.finished_at = timezone.now()
+    fields = ['status', 'result', 'output_file', 'error', 'finished_at']
+    # only while this worker still holds the job, a job requeued in the meantime belongs to its new worker
+    saved = Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker).update(
+        **{field: getattr(job, field) for field in fields})
+    if not saved:
+        logger.warning("Job %s was requeued while %s ran it, its outcome is dropped", job.pk, job.worker)
+    return job
+
+
+def run_pending(worker=None, limit=None):
+    """Run queued jobs in this process until the queue is empty (or `limit` jobs ran), returns how many ran"""
+    ran = 0
+    while limit is None or ran < limit:
+        close_old_connections()
+        job = claim_next(worker)
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def requeue_stale(stale_after=DEFAULT_STALE_AFTER):
+    """Put running jobs without a heartbeat for `stale_after` back in the queue"""
+    cutoff = timezone.now() - stale_after
+    # jobs claimed before heartbeats existed only have started_at
+    no_heartbeat = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    return Job.objects.filter(no_heartbeat, status=Job.RUNNING).update(
+        status=Job.QUEUED, worker='', started_at=None, heartbeat_at=None)
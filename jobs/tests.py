@@ -0,0 +1,155 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from jobs.models import Job
+from jobs.queue import Heartbeat, claim_next, enqueue, requeue_stale, run_job, run_pending
+from main.importer import BulkImporter
+from main.models import Experiment, Sample
+from main.testing import sheet_row
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()  # the cached filter results outlive the rolled back generation counter
+        self.tmp = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(JOBS_OUTPUT_DIR=self.tmp.name)
+        self.settings_override.enable()
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2", **{"Cell Line": "Aa23"}), sheet_row("S3")])
+        self.user = User.objects.create_user("tester")
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp.cleanup()
+
+    def test_jobs_are_claimed_once_in_order(self):
+        first = enqueue('export_filter_csv', {'cell_line': 'JW18'})
+        second = enqueue('export_filter_csv', {'cell_line': 'Aa23'})
+
+        self.assertEqual(claim_next("w1").id, first.id)
+        self.assertEqual(claim_next("w2").id, second.id)
+        self.assertIsNone(claim_next("w3"))
+        self.assertEqual(Job.objects.get(id=first.id).worker, "w1")
+
+    def test_unknown_kinds_are_rejected(self):
+        with self.assertRaises(ValueError):
+            enqueue('rm_rf')
+
+    def test_filter_export_runs_in_the_background_and_can_be_downloaded(self):
+        response = self.client.post(reverse('job_export_filter'), {'cell_line': 'JW18', 'plate_num': ''})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job_detail', args=[job.id]))
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.id])).json()['status'], 'queued')
+
+        self.assertEqual(run_pending(), 1)
+
+        status = self.client.get(reverse('job_status', args=[job.id])).json()
+        self.assertEqual((status['status'], status['result']['rows']), ('succeeded', 2))
+        download = self.client.get(status['download_url'])
+        rows = list(csv.reader(io.StringIO(b"".join(download.streaming_content).decode())))
+        self.assertEqual([row[0] for row in rows[1:]], ["S1", "S3"])
+
+    def test_experiment_export_and_failures(self):
+        enqueue('export_experiment_csv', {'experiment_id': Experiment.objects.get().id}, user=self.user)
+        enqueue('export_experiment_csv', {'experiment_id': 999}, user=self.user)
+        with self.assertLogs('jobs.queue', 'ERROR') as logs:
+            run_pending()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("failed", logs.records[0].getMessage())
+
+        ok, failed = Job.objects.order_by('id')
+        self.assertEqual((ok.status, ok.result['rows']), (Job.SUCCEEDED, 3))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, ok.output_file)))
+        self.assertEqual(failed.status, Job.FAILED)
+        self.assertIn("does not exist", failed.error)
+        self.assertEqual(self.client.get(reverse('job_download', args=[failed.id])).status_code, 404)
+
+    def test_exports_can_be_written_in_a_columnar_format(self):
+        response = self.client.post(reverse('job_export_filter'), {'cell_line': 'JW18', 'format': 'csv.gz'})
+        self.assertEqual(response.status_code, 302)
+        run_pending()
+
+        job = Job.objects.get()
+        self.assertTrue(job.output_file.endswith('.csv.gz'))
+        with gzip.open(os.path.join(self.tmp.name, job.output_file), 'rt') as file:
+            self.assertEqual([row[0] for row in csv.reader(file)], ["sample_id", "S1", "S3"])
+
+        bad = self.client.post(reverse('job_export_experiment', args=[Experiment.objects.get().id]), {'format': 'xlsx'})
+        self.assertEqual(bad.status_code, 400)
+
+    def test_other_users_jobs_are_hidden(self):
+        job = enqueue('export_filter_csv', {}, user=User.objects.create_user("someone else"))
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.id])).status_code, 404)
+
+    def test_import_json_can_be_queued(self):
+        path = os.path.join(self.tmp.name, "rows.jsonl")
+        with open(path, 'w') as file:
+            file.write(json.dumps(sheet_row("S9")) + "\n")
+        call_command('import_json', path, background=True, stdout=io.StringIO())
+        self.assertFalse(Sample.objects.filter(sample_id="S9").exists())
+
+        call_command('run_jobs', inline=True, stdout=io.StringIO())
+        self.assertTrue(Sample.objects.filter(sample_id="S9").exists())
+        self.assertEqual(Job.objects.get().status, Job.SUCCEEDED)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = enqueue('export_filter_csv', {})
+        claim_next("dead worker")
+        Job.objects.filter(id=job.id).update(started_at="2000-01-01T00:00:00Z")
+        self.assertEqual(requeue_stale(), 0)  # started long ago, but its worker is still beating
+
+        Job.objects.filter(id=job.id).update(heartbeat_at="2000-01-01T00:00:00Z")
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.QUEUED)
+
+    def test_a_failed_heartbeat_does_not_stop_the_next_one(self):
+        enqueue('export_filter_csv', {})
+        job = claim_next("worker")
+        Job.objects.filter(id=job.id).update(heartbeat_at="2000-01-01T00:00:00Z")
+        heartbeat = Heartbeat(job, interval=0)
+        heartbeat.stopped = mock.Mock(wait=mock.Mock(side_effect=[False, False, True]))  # two beats, then stop
+        real_filter = Job.objects.filter
+
+        def filter(*args, **kwargs):
+            if not hasattr(filter, 'failed'):
+                filter.failed = True
+                raise OperationalError("database is locked")
+            return real_filter(*args, **kwargs)
+
+        # beat in this thread, its own connection would not see the test transaction
+        with mock.patch.object(Job.objects, 'filter', filter), mock.patch('jobs.queue.connections'), \
+                self.assertLogs('jobs.queue', 'ERROR') as logs:
+            heartbeat.beat()
+
+        self.assertIn("database is locked", logs.output[0])
+        self.assertGreater(Job.objects.get(id=job.id).heartbeat_at.year, 2000)
+
+    def test_outcome_of_a_requeued_job_is_dropped(self):
+        enqueue('export_filter_csv', {})
+        job = claim_next("slow worker")
+        Job.objects.filter(id=job.id).update(status=Job.QUEUED, worker='')  # requeued meanwhile
+        run_job(job)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.QUEUED)
+
+    def test_export_file_names_are_sanitized(self):
+        experiment = Experiment.objects.get()
+        experiment.name = "SI / 2024: día 3"
+        experiment.save()
+        job = enqueue('export_experiment_csv', {'experiment_id': experiment.id})
+        run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.output_file, f"job_{job.id}_samples_in_exp_SI__2024_día_3.csv")
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, job.output_file)))
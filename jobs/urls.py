@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('export/experiment/<int:experiment_id>/', views.export_experiment, name='job_export_experiment'),
+    path('export/filter/', views.export_filter, name='job_export_filter'),
+    path('<int:job_id>/', views.job_detail, name='job_detail'),
+    path('<int:job_id>/status/', views.job_status, name='job_status'),
+    path('<int:job_id>/download/', views.job_download, name='job_download'),
+]
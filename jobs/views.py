@@ -0,0 +1,88 @@
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+
+from main.columnar import ExportFormatError, check_format
+from main.filters import SampleFilter
+from main.models import Experiment
+from jobs.models import Job
+from jobs.queue import enqueue, output_dir
+
+
+def export_format(data):
+    """The requested export format, 'csv' or one of main.columnar.EXPORT_FORMATS"""
+    fmt = data.get('format') or 'csv'
+    if fmt != 'csv':
+        check_format(fmt)
+    return fmt
+
+
+def get_job(request, job_id):
+    """The job, if the user started it (staff can see every job)"""
+    job = get_object_or_404(Job, id=job_id)
+    if not request.user.is_staff and job.created_by_id != request.user.id:
+        raise Http404("No such job")
+    return job
+
+
+"""Queue the CSV export of an experiment, posted from the samples list page"""
+@login_required(login_url='login')
+@require_POST
+def export_experiment(request, experiment_id):
+    experiment = get_object_or_404(Experiment, id=experiment_id)
+    try:
+        fmt = export_format(request.POST)
+    except ExportFormatError as e:
+        return HttpResponseBadRequest(str(e))
+    job = enqueue('export_experiment_csv', {'experiment_id': experiment.id, 'format': fmt}, user=request.user)
+    return redirect('job_detail', job_id=job.id)
+
+
+"""Queue the CSV export of a custom filter, posted from the filtered samples page with the same
+hidden fields as the direct export"""
+@login_required(login_url='login')
+@require_POST
+def export_filter(request):
+    sample_filter = SampleFilter.from_querydict(request.POST)
+    try:
+        fmt = export_format(request.POST)
+    except ExportFormatError as e:
+        return HttpResponseBadRequest(str(e))
+    job = enqueue('export_filter_csv', {**sample_filter.as_dict(), 'format': fmt}, user=request.user)
+    return redirect('job_detail', job_id=job.id)
+
+
+"""Status page of a job, polls job_status until the job is done and then links the download"""
+@login_required(login_url='login')
+def job_detail(request, job_id):
+    return render(request, 'jobs/job_detail.html', {'job': get_job(request, job_id)})
+
+
+@login_required(login_url='login')
+def job_status(request, job_id):
+    job = get_job(request, job_id)
+    return JsonResponse({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'finished': job.is_finished,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'result': job.result,
+        'error': job.error.splitlines()[0] if job.error else '',
+        'download_url': reverse('job_download', args=[job.id]) if job.output_file else None,
+    })
+
+
+@login_required(login_url='login')
+def job_download(request, job_id):
+    job = get_job(request, job_id)
+    if job.status != Job.SUCCEEDED or not job.output_file:
+        raise Http404("This job has no output")
+    path = output_dir() / job.output_file
+    if not path.is_file():
+        raise Http404("The output file was removed")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=job.output_file)
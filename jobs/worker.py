@@ -0,0 +1,83 @@
+"""Worker pool for the job queue: one process per core (by default), each
+claiming and running jobs until it's told to stop. Jobs are independent, so a
+big export and an import run side by side on different cores.
+
+The workers are forked where the platform can. Elsewhere they're spawned as
+fresh interpreters, so this module doesn't import the models at the top and
+work() sets django up first."""
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+import django
+from django.apps import apps
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+def work(stop, poll_interval, burst):
+    """Loop of one worker process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles ctrl-c and sets `stop`
+    if not apps.ready:  # spawned, DJANGO_SETTINGS_MODULE is inherited from the parent
+        django.setup()
+    from jobs.queue import run_pending, worker_name
+
+    name = worker_name()
+    while not stop.is_set():
+        try:
+            ran = run_pending(worker=name)
+        except Exception:
+            logger.exception("Worker %s could not poll the job queue", name)
+            ran = 0
+        finally:
+            close_old_connections()
+        if burst and not ran:
+            return
+        if not ran:
+            stop.wait(poll_interval)
+
+
+def run_pool(processes=None, poll_interval=DEFAULT_POLL_INTERVAL, burst=False):
+    """Start `processes` workers and wait for them. With `burst` they exit once the queue is empty"""
+    from jobs.queue import HEARTBEAT_INTERVAL, requeue_stale
+
+    processes = processes or os.cpu_count() or 1
+    requeue_stale()
+
+    # the db connection of this process must not be shared with the forked workers
+    connections.close_all()
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    stop = context.Event()
+    workers = [context.Process(target=work, args=(stop, poll_interval, burst), name=f"job-worker-{i}")
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    previous = signal.signal(signal.SIGTERM, request_stop)
+    try:
+        last_check = time.monotonic()
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(0.5)
+            if time.monotonic() - last_check >= HEARTBEAT_INTERVAL:
+                # jobs of workers that died, in this pool or on another host
+                last_check = time.monotonic()
+                try:
+                    requeue_stale()
+                except Exception:
+                    logger.exception("Could not requeue the stale jobs")
+                finally:
+                    close_old_connections()
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        for worker in workers:
+            worker.join()
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        # keeps the homepage facet table in sync with single saves/deletes
+        from main import signals  # noqa: F401
+
+        # WAL mode, busy timeout and cache pragmas for every new SQLite connection
+        from django.db.backends.signals import connection_created
+        from main.sqlite import apply_pragmas
+        connection_created.connect(apply_pragmas, dispatch_uid='main.sqlite.apply_pragmas')
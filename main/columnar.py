@@ -0,0 +1,282 @@
+"""Typed, batched exports: Parquet, Arrow IPC and gzip/zstd compressed CSV.
+
+Samples (with their metadata JSON flattened into typed columns and their read
+pair) and titers are read from the db in chunks and turned into record batches
+of {column: [values]}, one batch per chunk, so memory stays bounded by the chunk
+size. write_batches() turns the batches into any of EXPORT_FORMATS: Parquet and
+Arrow files are written one record batch at a time with pyarrow, the CSV formats
+are compressed as they are streamed. pyarrow and zstandard are optional, the
+formats that need them raise ExportFormatError when they aren't installed.
+"""
+import csv
+import io
+import tempfile
+import zlib
+from datetime import date, datetime
+
+from django.http import FileResponse, StreamingHttpResponse
+
+from main.exports import EXPORT_CHUNK_SIZE, _chunks
+from main.models import Sample, Sample_Metadata, Read_Pair
+from main.titer_import import FLOAT_FIELDS, INTEGER_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed for the parquet/arrow formats
+    pa = pq = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only needed for csv.zst
+    zstandard = None
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    'csv.gz': ('application/gzip', '.csv.gz'),
+    'csv.zst': ('application/zstd', '.csv.zst'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', '.arrow'),
+}
+
+# (column, metadata key, type) for the Sample_Metadata.metadata keys written by the importer
+METADATA_COLUMNS = [
+    ('cell_line', 'Cell_Line', 'string'),
+    ('infection', 'Infection', 'string'),
+    ('initials', 'Initials', 'string'),
+    ('species', 'Species', 'string'),
+    ('split', 'Split (DDMMRep)', 'string'),
+    ('replicate', 'Replicate', 'int'),
+    ('extraction_date', 'Extraction Date', 'date'),
+    ('timepoint', 'Timepoint', 'string'),
+    ('gdna_conc', 'gDNA Conc', 'float'),
+    ('media', 'media', 'string'),
+]
+
+SAMPLE_FIELDS = [
+    ('sample_id', 'string'),
+    ('sample_label', 'string'),
+    ('experiment', 'string'),
+    ('created_date', 'date'),
+    *[(column, kind) for column, _, kind in METADATA_COLUMNS],
+    ('plate_number', 'int'),
+    ('read1_path', 'string'),
+    ('read2_path', 'string'),
+]
+
+TITER_FIELDS = [
+    ('sample_id', 'string'),
+    ('experiment', 'string'),
+    ('sequencing_run', 'string'),
+    *[(field, 'float') for field in FLOAT_FIELDS],
+    *[(field, 'int') for field in INTEGER_FIELDS],
+]
+
+
+class ExportFormatError(ValueError):
+    pass
+
+
+def check_format(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise ExportFormatError(f"Unknown export format {fmt!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    if fmt in ('parquet', 'arrow') and pa is None:
+        raise ExportFormatError(f"The {fmt} export needs pyarrow installed")
+    if fmt == 'csv.zst' and zstandard is None:
+        raise ExportFormatError("The csv.zst export needs zstandard installed")
+
+
+##########################
+# Typed values           #
+##########################
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and value.strip().upper() in ('', 'NA', 'N/A'))
+
+
+def to_string(value):
+    return None if _blank(value) else str(value)
+
+
+def to_int(value):
+    if _blank(value):
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):  # OverflowError: inf
+        return None
+
+
+def to_float(value):
+    if _blank(value):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# the sheets hold US style dates (9/4/2024, 4/17/24) next to ISO ones
+DATE_FORMATS = ('%m/%d/%Y', '%m/%d/%y')
+
+
+def to_date(value):
+    if isinstance(value, date):
+        return value
+    if _blank(value):
+        return None
+    text = str(value).strip()
+    try:
+        return date.fromisoformat(text[:10])
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+CONVERTERS = {'string': to_string, 'int': to_int, 'float': to_float, 'date': to_date}
+
+
+##########################
+# Record batches         #
+##########################
+
+def _sample_batch(chunk):
+    """{column: [values]} for a chunk of (pk, sample_id, sample_label, created_date, experiment name) tuples"""
+    pks = [row[0] for row in chunk]
+
+    metadata = dict(Sample_Metadata.objects.filter(sample_id__in=pks).values_list('sample_id', 'metadata'))
+
+    read_pairs = {}
+    for sample_pk, *pair in Read_Pair.objects.filter(sample_id__in=pks).order_by('-id').values_list('sample_id', 'plate_number', 'read1_path', 'read2_path'):
+        read_pairs[sample_pk] = pair  # ordered by -id so the lowest id wins, like the CSV export
+
+    batch = {name: [] for name, _ in SAMPLE_FIELDS}
+    for pk, sample_id, sample_label, created_date, experiment in chunk:
+        meta = metadata.get(pk) or {}
+        plate_number, read1_path, read2_path = read_pairs.get(pk, (None, None, None))
+        batch['sample_id'].append(sample_id)
+        batch['sample_label'].append(sample_label or None)
+        batch['experiment'].append(experiment)
+        batch['created_date'].append(created_date)
+        for column, key, kind in METADATA_COLUMNS:
+            batch[column].append(CONVERTERS[kind](meta.get(key)))
+        batch['plate_number'].append(plate_number)
+        batch['read1_path'].append(read1_path)
+        batch['read2_path'].append(read2_path)
+    return batch
+
+
+SAMPLE_VALUES = ('id', 'sample_id', 'sample_label', 'created_date', 'experiment__name')
+
+
+def sample_batches(samples=None, ids=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield record batches for the `samples` queryset, or for a list of Sample primary keys"""
+    if ids is not None:
+        for id_chunk in _chunks(ids, chunk_size):
+            rows = {row[0]: row for row in Sample.objects.filter(id__in=set(id_chunk)).values_list(*SAMPLE_VALUES)}
+            yield _sample_batch([rows[pk] for pk in id_chunk if pk in rows])
+        return
+
+    rows = samples.order_by('id').values_list(*SAMPLE_VALUES).iterator(chunk_size=chunk_size)
+    for chunk in _chunks(rows, chunk_size):
+        yield _sample_batch(chunk)
+
+
+def titer_batches(titers, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield record batches for the `titers` queryset"""
+    values = ('sample_id__sample_id', 'sample_id__experiment__name', 'sequencing_run', *FLOAT_FIELDS, *INTEGER_FIELDS)
+    rows = titers.order_by('id').values_list(*values).iterator(chunk_size=chunk_size)
+    names = [name for name, _ in TITER_FIELDS]
+    for chunk in _chunks(rows, chunk_size):
+        yield {name: list(column) for name, column in zip(names, zip(*chunk))}
+
+
+##########################
+# Writers                #
+##########################
+
+def arrow_schema(fields):
+    types = {'string': pa.string(), 'int': pa.int64(), 'float': pa.float64(), 'date': pa.date32()}
+    return pa.schema([(name, types[kind]) for name, kind in fields])
+
+
+def _csv_text(batch, fields, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    names = [name for name, _ in fields]
+    if header:
+        writer.writerow(names)
+    columns = [batch[name] for name in names]
+    for row in zip(*columns):
+        writer.writerow(['' if value is None else value for value in row])
+    return buffer.getvalue()
+
+
+def iter_compressed_csv(batches, fields, fmt):
+    """Yield the compressed bytes of a CSV with a header row and every batch, as the batches are read"""
+    if fmt == 'csv.gz':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    else:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    header = True
+    for batch in batches:
+        chunk = compressor.compress(_csv_text(batch, fields, header).encode('utf-8'))
+        header = False
+        if chunk:
+            yield chunk
+    if header:  # no batches at all, still write the header
+        yield compressor.compress(_csv_text({name: [] for name, _ in fields}, fields, True).encode('utf-8'))
+    yield compressor.flush()
+
+
+def write_batches(fmt, batches, fields, file):
+    """Write the record batches to the binary `file` in format `fmt`, returns the number of rows"""
+    check_format(fmt)
+    rows = 0
+
+    def counted():
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch[fields[0][0]])
+            yield batch
+
+    if fmt in ('csv.gz', 'csv.zst'):
+        for chunk in iter_compressed_csv(counted(), fields, fmt):
+            file.write(chunk)
+        return rows
+
+    schema = arrow_schema(fields)
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(file, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(file, schema)
+    try:
+        for batch in counted():
+            writer.write_batch(pa.RecordBatch.from_pydict(batch, schema=schema))
+    finally:
+        writer.close()
+    return rows
+
+
+def export_response(fmt, batches, fields, basename):
+    """Download response for the record batches. The compressed CSVs are streamed as they're
+    compressed, Parquet and Arrow files need their footer so they're spooled to a temp file first"""
+    check_format(fmt)
+    content_type, extension = EXPORT_FORMATS[fmt]
+    filename = basename + extension
+
+    if fmt in ('csv.gz', 'csv.zst'):
+        response = StreamingHttpResponse(iter_compressed_csv(batches, fields, fmt), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    file = tempfile.TemporaryFile()
+    write_batches(fmt, batches, fields, file)
+    file.seek(0)
+    return FileResponse(file, as_attachment=True, filename=filename, content_type=content_type)
@@ -0,0 +1,95 @@
+"""Shared export pipeline for the CSV downloads.
+
+The samples are read from the db in chunks with iterator(). For each chunk the
+metadata and read pairs are fetched with one IN query each (instead of two
+queries per sample), and the rows are streamed to the client as they are built,
+so memory stays constant no matter how many samples are exported.
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+
+from main.models import Sample, Sample_Metadata, Read_Pair
+
+EXPORT_CHUNK_SIZE = 2000
+
+SAMPLE_CSV_HEADER = ['Sample ID', 'Cell Line', 'Infection Status', 'Created Date', 'Plate Number', 'Read 1 Path', 'Read 2 Path']
+
+
+class Echo:
+    """Pseudo buffer for csv.writer, write() just hands the line back so it can be streamed"""
+
+    def write(self, value):
+        return value
+
+
+def _chunks(iterator, size):
+    chunk = []
+    for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _export_rows_for_chunk(chunk):
+    """CSV rows for a chunk of (pk, sample_id, created_date) tuples, with one query per related model"""
+    pks = [pk for pk, _, _ in chunk]
+
+    metadata = dict(Sample_Metadata.objects.filter(sample_id__in=pks).values_list('sample_id', 'metadata'))
+
+    read_pairs = {}
+    for sample_pk, *pair in Read_Pair.objects.filter(sample_id__in=pks).order_by('-id').values_list('sample_id', 'plate_number', 'read1_path', 'read2_path'):
+        read_pairs[sample_pk] = pair  # ordered by -id so the lowest id wins
+
+    for pk, sample_id, created_date in chunk:
+        meta = metadata.get(pk) or {}
+        plate_number, read1_path, read2_path = read_pairs.get(pk, ('', '', ''))
+        yield [sample_id, meta.get("Cell_Line", ""), meta.get("Infection", ""), created_date,
+               plate_number, read1_path, read2_path]
+
+
+def sample_export_rows(samples, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one CSV row per sample in the `samples` queryset.
+
+    Like the old per-sample .first() lookup, only the first read pair (lowest id)
+    of each sample is exported.
+    """
+    sample_rows = samples.order_by('id').values_list('id', 'sample_id', 'created_date').iterator(chunk_size=chunk_size)
+
+    for chunk in _chunks(sample_rows, chunk_size):
+        yield from _export_rows_for_chunk(chunk)
+
+
+def sample_export_rows_for_ids(ids, chunk_size=EXPORT_CHUNK_SIZE):
+    """Same as sample_export_rows, for a list of Sample primary keys (e.g. a cached filter result)"""
+    for id_chunk in _chunks(ids, chunk_size):
+        samples = dict((pk, (pk, sample_id, created_date)) for pk, sample_id, created_date in
+                       Sample.objects.filter(id__in=set(id_chunk)).values_list('id', 'sample_id', 'created_date'))
+        yield from _export_rows_for_chunk([samples[pk] for pk in id_chunk if pk in samples])
+
+
+def stream_csv_response(header, rows, filename):
+    """StreamingHttpResponse that writes `header` and then every row of `rows` as CSV"""
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def stream_samples_csv(samples, filename):
+    """CSV download of `samples` with their cell line, infection status and read pair"""
+    return stream_csv_response(SAMPLE_CSV_HEADER, sample_export_rows(samples), filename)
+
+
+def stream_sample_ids_csv(ids, filename):
+    """CSV download for a list of Sample primary keys"""
+    return stream_csv_response(SAMPLE_CSV_HEADER, sample_export_rows_for_ids(ids), filename)
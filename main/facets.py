@@ -0,0 +1,101 @@
+"""Precomputed values for the homepage filter dropdowns.
+
+The Facet table holds every distinct value (and how many rows use it) for the
+metadata keys and read pair fields the custom filter offers. Imports add the
+count changes of the rows they wrote (adjust_facets), the signals in
+main/signals.py do the same for single saves/deletes, and rebuild_facets()
+recounts everything with a few GROUP BY queries. The homepage reads it with one query.
+That query isn't cached: a per-process cache could only be cleared by the process
+that changed the table, and imports run in other processes (commands, job workers).
+"""
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Count, F
+
+# facet name -> key in Sample_Metadata.metadata
+METADATA_FACETS = {
+    'infection': 'Infection',
+    'cell_line': 'Cell_Line',
+    'initials': 'Initials',
+}
+
+# facet name -> Read_Pair field
+READ_PAIR_FACETS = {
+    'plate_number': 'plate_number',
+}
+
+FACETS = list(METADATA_FACETS) + list(READ_PAIR_FACETS)
+
+
+def _facet_value(value):
+    """Value as stored in the Facet table, None for values that shouldn't be offered in a dropdown"""
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def metadata_facet_values(metadata):
+    """(facet, value) pairs contributed by one Sample_Metadata.metadata dict"""
+    pairs = []
+    for facet, key in METADATA_FACETS.items():
+        value = _facet_value((metadata or {}).get(key))
+        if value is not None:
+            pairs.append((facet, value))
+    return pairs
+
+
+def read_pair_facet_values(read_pair):
+    pairs = []
+    for facet, field in READ_PAIR_FACETS.items():
+        value = _facet_value(getattr(read_pair, field))
+        if value is not None:
+            pairs.append((facet, value))
+    return pairs
+
+
+def rebuild_facets(apps=django_apps):
+    """Recount every facet from scratch. `apps` lets data migrations pass their historical models"""
+    Facet = apps.get_model('main', 'Facet')
+    Sample_Metadata = apps.get_model('main', 'Sample_Metadata')
+    Read_Pair = apps.get_model('main', 'Read_Pair')
+
+    counts = {}
+    for facet, key in METADATA_FACETS.items():
+        lookup = f'metadata__{key}'
+        for row in Sample_Metadata.objects.values(lookup).annotate(n=Count('id')).order_by():
+            value = _facet_value(row[lookup])
+            if value is not None:
+                counts[(facet, value)] = counts.get((facet, value), 0) + row['n']
+
+    for facet, field in READ_PAIR_FACETS.items():
+        for row in Read_Pair.objects.values(field).annotate(n=Count('id')).order_by():
+            value = _facet_value(row[field])
+            if value is not None:
+                counts[(facet, value)] = counts.get((facet, value), 0) + row['n']
+
+    with transaction.atomic():
+        Facet.objects.all().delete()
+        Facet.objects.bulk_create([Facet(facet=facet, value=value, count=n) for (facet, value), n in counts.items()])
+
+
+def adjust_facets(pairs, delta):
+    """Add `delta` to the count of every (facet, value) in `pairs`, creating rows as needed"""
+    from main.models import Facet
+
+    for facet, value in pairs:
+        updated = Facet.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+        if not updated and delta > 0:
+            Facet.objects.create(facet=facet, value=value, count=delta)
+
+
+def get_facets():
+    """{facet: [values]} for every facet, one query on the Facet table"""
+    from main.models import Facet
+
+    facets = {facet: [] for facet in FACETS}
+    for facet, value in Facet.objects.filter(count__gt=0).order_by('facet', 'value').values_list('facet', 'value'):
+        facets.setdefault(facet, []).append(value)
+
+    # plate numbers are stored as text, sort them like numbers
+    facets['plate_number'].sort(key=lambda v: (not v.lstrip('-').isdigit(), int(v) if v.lstrip('-').isdigit() else 0, v))
+    return facets
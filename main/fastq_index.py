@@ -0,0 +1,294 @@
+"""Index of the FASTQ files in the sequencing run folders, matched to the read pairs.
+
+FastqIndexer.scan() walks the SEQUENCING_DIRS with os.scandir, one directory
+per thread pool task, so the listing of large run folders on network storage
+overlaps. Every FASTQ file is stored as a FastqFile with its size, mtime and an
+estimate of its read count. The estimate is taken from the first SAMPLE_BYTES
+of the file (decompressed for .gz): bytes per read in the sample, scaled up to
+the file size. Rescans are incremental: files whose size and mtime haven't
+changed are not opened again, files that are gone are dropped from the index.
+
+match_read_pairs() then points Read_Pair.read1_file / read2_file at the indexed
+files, by exact path, or by file name when the name is unique in the index (the
+imported paths are often placeholders in the wrong directory). Pairs whose
+files can't be found are left with null.
+"""
+import logging
+import os
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from main.exports import _chunks
+from main.models import FastqFile, Read_Pair
+
+logger = logging.getLogger(__name__)
+
+FASTQ_SUFFIXES = ('.fastq', '.fq', '.fastq.gz', '.fq.gz')
+SAMPLE_BYTES = 1 << 20  # read from the start of a file for the read count estimate
+DEFAULT_WORKERS = 8
+INDEX_BATCH_SIZE = 1000
+
+
+def is_fastq(name):
+    return name.endswith(FASTQ_SUFFIXES)
+
+
+def sequencing_dirs():
+    return list(getattr(settings, 'SEQUENCING_DIRS', []))
+
+
+##########################
+# Directory walk         #
+##########################
+
+def _list_dir(path):
+    """([(path, size, mtime)] of the FASTQ files, [subdirectories]) of one directory"""
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif is_fastq(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_size, stat.st_mtime))
+                except OSError:  # broken symlink, or removed while listing
+                    continue
+    except OSError as e:
+        logger.warning("Could not list %s: %s", path, e)
+    return files, subdirs
+
+
+def walk_fastq_files(roots, pool):
+    """Yield (path, size, mtime) of every FASTQ file under `roots`, each directory is listed by a `pool` task"""
+    pending = {pool.submit(_list_dir, root) for root in roots}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, subdirs = future.result()
+            yield from files
+            pending.update(pool.submit(_list_dir, subdir) for subdir in subdirs)
+
+
+##########################
+# Read count estimate    #
+##########################
+
+def _gunzip_prefix(data):
+    """(decompressed bytes, compressed bytes used) for the start of a gzip file. Handles the
+    multi-member files written by bgzip / concatenated lanes"""
+    parts, consumed = [], 0
+    while data:
+        decompressor = zlib.decompressobj(31)
+        try:
+            parts.append(decompressor.decompress(data))
+        except zlib.error:
+            break
+        if not decompressor.eof:  # the sample ends inside this member
+            consumed += len(data)
+            break
+        consumed += len(data) - len(decompressor.unused_data)
+        data = decompressor.unused_data
+    return b"".join(parts), consumed
+
+
+def estimate_read_count(path, size, sample_bytes=SAMPLE_BYTES):
+    """Number of reads in the file, exact when it fits in the sample, otherwise estimated
+    from the bytes per read in the sample. None when the file can't be read or isn't FASTQ"""
+    try:
+        with open(path, 'rb') as file:
+            data = file.read(sample_bytes)
+    except OSError as e:
+        logger.warning("Could not read %s: %s", path, e)
+        return None
+
+    whole_file = len(data) >= size
+    if path.endswith('.gz'):
+        text, consumed = _gunzip_prefix(data)
+    else:
+        text, consumed = data, len(data)
+    if not text:
+        return 0 if whole_file else None
+    if not text.startswith(b'@'):
+        return None
+
+    lines = text.split(b'\n')
+    if whole_file:
+        return sum(1 for line in lines if line) // 4
+
+    reads = (len(lines) - 1) // 4  # the last line is cut off by the sample
+    if not reads or not consumed:
+        return None
+    read_bytes = sum(len(line) + 1 for line in lines[:reads * 4])
+    uncompressed_size = size * len(text) / consumed
+    return round(uncompressed_size * reads / read_bytes)
+
+
+##########################
+# Index                  #
+##########################
+
+class ScanStats:
+    def __init__(self):
+        self.files = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.missing_dirs = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {'files': self.files, 'added': self.added, 'updated': self.updated, 'unchanged': self.unchanged,
+                'removed': self.removed, 'missing_dirs': self.missing_dirs, 'elapsed_s': round(self.elapsed, 3)}
+
+    def summary_line(self):
+        return (f"{self.files} FASTQ files: {self.added} added, {self.updated} updated, {self.unchanged} unchanged, "
+                f"{self.removed} removed in {self.elapsed:.2f}s")
+
+
+class FastqIndexer:
+    """Scan `roots` (default SEQUENCING_DIRS) into the FastqFile index.
+    full=True re-reads every file instead of only the new and changed ones"""
+
+    def __init__(self, roots=None, workers=DEFAULT_WORKERS, full=False, batch_size=INDEX_BATCH_SIZE):
+        self.roots = [os.path.abspath(root) for root in (sequencing_dirs() if roots is None else roots)]
+        self.workers = workers
+        self.full = full
+        self.batch_size = batch_size
+
+    def indexed_files(self, roots):
+        """{path: (id, size, mtime)} of the files already indexed under `roots`"""
+        under_roots = Q()
+        for root in roots:
+            under_roots |= Q(path__startswith=root.rstrip(os.sep) + os.sep)
+        rows = FastqFile.objects.filter(under_roots).values_list('path', 'id', 'size', 'mtime')
+        return {path: (pk, size, mtime) for path, pk, size, mtime in rows.iterator(chunk_size=self.batch_size)}
+
+    def scan(self):
+        stats = ScanStats()
+        # a root that isn't there (an unmounted share) is skipped, instead of dropping its files from the index
+        roots = [root for root in self.roots if os.path.isdir(root)]
+        stats.missing_dirs = [root for root in self.roots if root not in roots]
+        for root in stats.missing_dirs:
+            logger.warning("Sequencing directory %s does not exist, skipped", root)
+
+        known = self.indexed_files(roots) if roots else {}
+        seen = set()
+        changed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for path, size, mtime in walk_fastq_files(roots, pool):
+                if path in seen:  # one root is inside another
+                    continue
+                stats.files += 1
+                seen.add(path)
+                indexed = known.get(path)
+                if indexed and not self.full and indexed[1:] == (size, mtime):
+                    stats.unchanged += 1
+                    continue
+                changed.append((path, size, mtime))
+
+            estimates = pool.map(lambda file: estimate_read_count(file[0], file[1]), changed)
+            for batch in _chunks(zip(changed, estimates), self.batch_size):
+                self.save_batch(batch, known, stats)
+
+        removed = [pk for path, (pk, _, _) in known.items() if path not in seen]
+        for chunk in _chunks(removed, self.batch_size):
+            FastqFile.objects.filter(id__in=chunk).delete()
+        stats.removed = len(removed)
+        stats.finish()
+        return stats
+
+    def save_batch(self, batch, known, stats):
+        now = timezone.now()
+        new, updated = [], []
+        for (path, size, mtime), estimate in batch:
+            file = FastqFile(path=path, name=os.path.basename(path), size=size, mtime=mtime,
+                             read_count_estimate=estimate, scanned_at=now)
+            if path in known:
+                file.id = known[path][0]
+                updated.append(file)
+            else:
+                new.append(file)
+        FastqFile.objects.bulk_create(new)
+        FastqFile.objects.bulk_update(updated, ['size', 'mtime', 'read_count_estimate', 'scanned_at'])
+        stats.added += len(new)
+        stats.updated += len(updated)
+
+
+class FileLookup:
+    """Find the indexed file of a read path: by exact path, or by file name when only one
+    indexed file has that name. `rows` are (path, name, value) tuples, resolve() returns
+    (value, 'path' / 'name') or (None, None)"""
+
+    def __init__(self, rows):
+        self.by_path = {}
+        self.by_name = {}
+        for path, name, value in rows:
+            self.by_path[path] = value
+            self.by_name[name] = None if name in self.by_name else value  # None: not unique, only exact paths match
+
+    def resolve(self, path):
+        if path in self.by_path:
+            return self.by_path[path], 'path'
+        value = self.by_name.get(os.path.basename(path))
+        return (value, 'name') if value is not None else (None, None)
+
+
+def match_read_pairs(batch_size=INDEX_BATCH_SIZE):
+    """Point every read pair at its indexed files, returns {read_pairs, complete, by_name, missing_files, changed}"""
+    lookup = FileLookup(FastqFile.objects.values_list('path', 'name', 'id').iterator(chunk_size=batch_size))
+    counts = {'read_pairs': 0, 'complete': 0, 'by_name': 0, 'missing_files': 0, 'changed': 0}
+
+    def resolve(path):
+        pk, matched_by = lookup.resolve(path)
+        if matched_by == 'name':
+            counts['by_name'] += 1
+        elif pk is None:
+            counts['missing_files'] += 1
+        return pk
+
+    read_pairs = Read_Pair.objects.order_by('id').only('id', 'read1_path', 'read2_path', 'read1_file', 'read2_file')
+    for chunk in _chunks(read_pairs.iterator(chunk_size=batch_size), batch_size):
+        changed = []
+        for read_pair in chunk:
+            counts['read_pairs'] += 1
+            read1_file, read2_file = resolve(read_pair.read1_path), resolve(read_pair.read2_path)
+            if read1_file is not None and read2_file is not None:
+                counts['complete'] += 1
+            if (read1_file, read2_file) != (read_pair.read1_file_id, read_pair.read2_file_id):
+                read_pair.read1_file_id, read_pair.read2_file_id = read1_file, read2_file
+                changed.append(read_pair)
+        Read_Pair.objects.bulk_update(changed, ['read1_file', 'read2_file'])
+        counts['changed'] += len(changed)
+    return counts
+
+
+def read_pair_files(sample_ids):
+    """{sample_id: [{read1_path, read1_file, read2_path, read2_file}]} with the indexed file (FastqFile or None)
+    of each path, looked up in the index now rather than from the last match_read_pairs()"""
+    pairs = list(Read_Pair.objects.filter(sample_id__sample_id__in=set(sample_ids)).order_by('id')
+                 .values_list('sample_id__sample_id', 'read1_path', 'read2_path'))
+    paths = {path for _, read1_path, read2_path in pairs for path in (read1_path, read2_path)}
+    names = {os.path.basename(path) for path in paths}
+    # every file with one of the names, so FileLookup can tell whether a name is unique in the index
+    files = FastqFile.objects.filter(Q(path__in=paths) | Q(name__in=names))
+    lookup = FileLookup((file.path, file.name, file) for file in files)
+
+    results = {}
+    for sample_id, read1_path, read2_path in pairs:
+        results.setdefault(sample_id, []).append({
+            'read1_path': read1_path, 'read1_file': lookup.resolve(read1_path)[0],
+            'read2_path': read2_path, 'read2_file': lookup.resolve(read2_path)[0],
+        })
+    return results
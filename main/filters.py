@@ -0,0 +1,133 @@
+"""Custom filter shared by the filtered samples page and its CSV export.
+
+SampleFilter turns the homepage form (POST) or the export link (GET) into one
+normalized spec that builds the Sample queryset. The ids a filter matched are
+kept in the Django cache keyed by the normalized spec, so the export can reuse
+the ids computed for the page instead of running the query again. The keys
+include a generation counter stored in the db: imports, signals and job workers
+bump it when samples change, which invalidates the cached results of every
+process at once.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from main.models import CacheGeneration, Sample
+
+
+class SampleFilter:
+    """Normalized custom filter criteria. Empty values mean 'no filter on this field'"""
+
+    FIELDS = ('cell_line', 'start_date', 'end_date', 'infection_status', 'users', 'plate_num')
+
+    def __init__(self, **criteria):
+        unknown = set(criteria) - set(self.FIELDS)
+        if unknown:
+            raise TypeError(f"Unknown filter fields: {', '.join(sorted(unknown))}")
+        for field in self.FIELDS:
+            value = criteria.get(field)
+            if isinstance(value, str):
+                value = value.strip()
+                if value == 'None':  # an unset field, rendered into the export forms of older pages
+                    value = None
+            setattr(self, field, value or None)
+
+    @classmethod
+    def from_querydict(cls, data):
+        """Build the filter from request.POST / request.GET"""
+        return cls(**{field: data.get(field) for field in cls.FIELDS})
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def cache_key(self):
+        return tuple((field, str(getattr(self, field))) for field in self.FIELDS if getattr(self, field) is not None)
+
+    def queryset(self):
+        samples = Sample.objects.all()
+
+        # Filtering by cell line (indexed copy of the Sample_Metadata JSON key)
+        if self.cell_line:
+            samples = samples.filter(sample_metadata__cell_line=self.cell_line)
+
+        # Filter by date range (created_date is in Sample model)
+        if self.start_date:
+            samples = samples.filter(created_date__gte=self.start_date)
+        if self.end_date:
+            samples = samples.filter(created_date__lte=self.end_date)
+
+        # Filtering by infection status (indexed copy of the Sample_Metadata JSON key)
+        if self.infection_status:
+            samples = samples.filter(sample_metadata__infection=self.infection_status)
+
+        # Filtering by user/lab member (Initials key in metadata)
+        if self.users:
+            samples = samples.filter(sample_metadata__initials=self.users)
+
+        # Filtering by plate number from Read_Pair model
+        # (a sample can have several read pairs on the plate, distinct() stops it being listed twice)
+        if self.plate_num:
+            samples = samples.filter(read_pair__plate_number=self.plate_num).distinct()
+
+        return samples
+
+    def count(self):
+        """Number of matching samples, a COUNT query cached like sample_ids()"""
+        key = ('count',) + self.cache_key()
+        generation = filter_results.generation()
+        total = filter_results.get(key, generation)
+        if total is None:
+            total = self.queryset().count()
+            filter_results.set(key, total, generation)
+        return total
+
+    def sample_ids(self):
+        """Primary keys of the matching samples, from the result cache when possible"""
+        key = self.cache_key()
+        # read before the query, so ids computed while an import commits are stored under the old generation
+        generation = filter_results.generation()
+        ids = filter_results.get(key, generation)
+        if ids is None:
+            ids = list(self.queryset().order_by('id').values_list('id', flat=True))
+            filter_results.set(key, ids, generation)
+        return ids
+
+
+class FilterResultCache:
+    """filter key -> matching sample ids in a Django cache, entries expire after `ttl` seconds.
+    clear() bumps the db generation counter instead of deleting entries, so it reaches every process"""
+
+    GENERATION = 'filter_results'
+
+    def __init__(self, ttl=300, cache_alias='default'):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def generation(self):
+        return CacheGeneration.current(self.GENERATION)
+
+    def _cache_key(self, key, generation):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return f"main:filter:{generation}:{digest}"
+
+    def get(self, key, generation=None):
+        generation = self.generation() if generation is None else generation
+        return self.cache.get(self._cache_key(key, generation))
+
+    def set(self, key, ids, generation=None):
+        generation = self.generation() if generation is None else generation
+        self.cache.set(self._cache_key(key, generation), ids, self.ttl)
+
+    def clear(self):
+        CacheGeneration.bump(self.GENERATION)
+
+
+filter_results = FilterResultCache(
+    ttl=getattr(settings, 'FILTER_RESULT_CACHE_TTL', 300),
+    cache_alias=getattr(settings, 'FILTER_RESULT_CACHE', 'default'),
+)
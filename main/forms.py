@@ -1,10 +1,10 @@
 from django import forms
-from .models import Sample_Metadata, Sample
+from main.facets import get_facets
 
 class SampleFilterForm(forms.Form):
-    # Dropdown for Cell Type
+    # Dropdown for Cell Type, the choices are filled in from the facets in __init__
     cell_type = forms.ChoiceField(
-        choices=[('', 'All')] + [(cell['metadata__cell_line'], cell['metadata__cell_line']) for cell in Sample_Metadata.objects.values('metadata__cell_line').distinct()],
+        choices=[('', 'All')],
         required=False,
         label='Cell Type'
     )
@@ -24,18 +24,19 @@ class SampleFilterForm(forms.Form):
     
     # Dropdown for Infection Status
     infection_status = forms.ChoiceField(
-        choices=[('', 'All')] + [(infection['metadata__Infection'], infection['metadata__Infection']) for infection in Sample_Metadata.objects.values('metadata__Infection').distinct()],
+        choices=[('', 'All')],
         required=False,
         label='Infection Status'
     )
 
     def __init__(self, *args, **kwargs):
         super(SampleFilterForm, self).__init__(*args, **kwargs)
-        
+
+        # One facet query per form, nothing is queried when the module is imported
+        facets = get_facets()
+
         # Populate Cell Type dropdown choices dynamically
-        cell_type_choices = [(cell['metadata__cell_line'], cell['metadata__cell_line']) for cell in Sample_Metadata.objects.values('metadata__cell_line').distinct()]
-        self.fields['cell_type'].choices = [('', 'All')] + cell_type_choices
-        
+        self.fields['cell_type'].choices = [('', 'All')] + [(value, value) for value in facets['cell_line']]
+
         # Populate Infection Status dropdown choices dynamically
-        infection_status_choices = [(infection['metadata__Infection'], infection['metadata__Infection']) for infection in Sample_Metadata.objects.values('metadata__Infection').distinct()]
-        self.fields['infection_status'].choices = [('', 'All')] + infection_status_choices
\ No newline at end of file
+        self.fields['infection_status'].choices = [('', 'All')] + [(value, value) for value in facets['infection']]
\ No newline at end of file
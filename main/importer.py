@@ -0,0 +1,326 @@
+"""Batched import engine used by the import_json management command.
+
+Rows from the pellet sheet export are processed in chunks. For every chunk the
+existing Samples / Sample_Metadata / Read_Pairs are loaded with one query per
+model, the incoming rows are diffed against them in memory, and the changes are
+written with bulk_create / bulk_update. The whole run happens in one transaction,
+or one per chunk with commit_batches (for lazy sources like the sheets sync).
+Each chunk goes through the BatchValidator (main/validation.py) first, only the
+rows that pass it are written.
+"""
+import time
+from collections import Counter
+
+from django.db import transaction
+
+from main import lookup_cache
+from main.facets import adjust_facets, metadata_facet_values, read_pair_facet_values
+from main.filters import filter_results
+from main.models import Experiment, Sample, Sample_Metadata, Read_Pair
+from main.validation import BatchValidator
+
+
+# The experiments are saved as acronyms in the sheets, but the full name is saved to the db
+EXPERIMENT_NAMES = {'SI': "Stable Infection", 'RMF': "Riv84 Merill23", 'MW': 'Mixed wMel-wWil'}
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def experiment_name_for(experiment_id):
+    """Full experiment name for a sheet acronym (falls back to the acronym itself)"""
+    return EXPERIMENT_NAMES.get(experiment_id, experiment_id)
+
+
+def build_metadata(item):
+    """JSON blob stored in Sample_Metadata for one sheet row"""
+    return {
+        "Cell_Line": item.get('Cell Line'),
+        "Infection": item.get('Infection'),
+        "Initials": item.get('Initials'),
+        "Split (DDMMRep)": item.get('Split (DDMMRep)'),
+        "Species": item.get('Species'),
+        'Replicate': item.get('Pellet Replicate'),
+        "Extraction Date": item.get('Extraction Date'),
+        "Timepoint": item.get('Timepoint'),
+        'gDNA Conc': item.get('gDNA Conc'),
+        'media': item.get('Media Type'),
+    }
+
+
+def placeholder_read_paths(sample_id):
+    """read paths written until the pipeline reports the real ones"""
+    return f"/path/to/read1_{sample_id}.fastq", f"/path/to/read2_{sample_id}.fastq"
+
+
+def parse_plate_number(value):
+    """Plate numbers come through as ints, numeric strings, '' or 'NA'. Anything unusable is plate 0"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from any iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ImportStats:
+    """created/updated/unchanged counters for each model touched by an import"""
+
+    MODELS = ('experiments', 'samples', 'metadata', 'read_pairs')
+
+    def __init__(self):
+        self.counts = {model: {'created': 0, 'updated': 0, 'unchanged': 0} for model in self.MODELS}
+        self.rows = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, model, created=0, updated=0, unchanged=0):
+        self.counts[model]['created'] += created
+        self.counts[model]['updated'] += updated
+        self.counts[model]['unchanged'] += unchanged
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def changed(self):
+        """True if the import created or updated anything"""
+        return any(c['created'] or c['updated'] for c in self.counts.values())
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary_lines(self):
+        lines = []
+        for model in self.MODELS:
+            c = self.counts[model]
+            lines.append(f"{model}: {c['created']} created, {c['updated']} updated, {c['unchanged']} unchanged")
+        lines.append(f"{self.rows} rows ({self.skipped} skipped) in {self.elapsed:.2f}s "
+                     f"({self.rows_per_second:.0f} rows/s)")
+        return lines
+
+
+class BulkImporter:
+    """Diff sheet rows against the db and apply the changes in bulk.
+
+    Usage:
+        importer = BulkImporter(batch_size=1000)
+        stats = importer.run(rows)
+
+    Rejected rows are reported through `on_error` and written to `quarantine`
+    (a main.validation.QuarantineReport) when one is given.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, on_error=None, quarantine=None):
+        self.batch_size = batch_size
+        self.on_error = on_error or (lambda message: None)
+        self.quarantine = quarantine
+        self.validator = BatchValidator()
+        self.experiments = {}  # experiment name -> Experiment, filled lazily
+        self.facet_deltas = Counter()  # (facet, value) -> change in count from the rows written so far
+        # created + updated per model when the caches were last invalidated
+        self.written = dict.fromkeys(ImportStats.MODELS, 0)
+        self.stats = ImportStats()
+
+    def run(self, rows, commit_batches=False, on_commit=None):
+        """Import every row in `rows` and return the ImportStats.
+
+        The whole run is one transaction, unless `commit_batches` is set: then every batch
+        is committed on its own and on_commit(batch) is called once it is. `rows` is only
+        read between those transactions, so a slow lazy source doesn't hold the db write
+        lock while it's read.
+        """
+        if not commit_batches:
+            with transaction.atomic():
+                for batch in chunked(rows, self.batch_size):
+                    self.import_batch(batch)
+                self._apply_facet_deltas()
+            self._invalidate_caches()
+        else:
+            for batch in chunked(rows, self.batch_size):
+                with transaction.atomic():
+                    self.import_batch(batch)
+                    self._apply_facet_deltas()
+                self._invalidate_caches()
+                if on_commit:
+                    on_commit(batch)
+        self.stats.finish()
+        return self.stats
+
+    ##########################
+    # Row normalisation      #
+    ##########################
+
+    def normalize(self, item, created_date):
+        """Turn one sheet row into the values stored in the db. The row has passed the BatchValidator,
+        which checked the required fields and parsed 'Date Collected' into `created_date`"""
+        sample_id = item['Sample ID']
+
+        read1_path, read2_path = placeholder_read_paths(sample_id)
+        return {
+            'experiment': experiment_name_for(item.get('Experiment ID')),
+            'sample_id': sample_id,
+            'sample_label': item.get('Sample Label') or "",
+            'created_date': created_date,
+            'metadata': build_metadata(item),
+            'read1_path': read1_path,
+            'read2_path': read2_path,
+            'plate_number': parse_plate_number(item.get('Plate Number', 0)),
+        }
+
+    ##########################
+    # Batch processing       #
+    ##########################
+
+    def import_batch(self, items):
+        self.stats.rows += len(items)
+        clean, rejected = self.validator.validate(items)
+        for rejection in rejected:
+            self.on_error(rejection.message())
+        if self.quarantine is not None:
+            self.quarantine.add(rejected)
+        self.stats.skipped += len(rejected)
+
+        rows = {}
+        for item, created_date in clean:
+            row = self.normalize(item, created_date)
+            rows[row['sample_id']] = row  # sample ids are unique here, the validator rejects duplicates
+
+        if not rows:
+            return
+
+        self._sync_experiments(rows.values())
+        samples = self._sync_samples(rows)
+        self._sync_metadata(rows, samples)
+        self._sync_read_pairs(rows, samples)
+
+    def _count_facets(self, old_values, new_values):
+        self.facet_deltas.subtract(old_values)
+        self.facet_deltas.update(new_values)
+
+    def _apply_facet_deltas(self):
+        # bulk writes don't send the signals that maintain the facets, so the counted changes are applied
+        # once per transaction, at a cost that scales with the changed rows rather than the table
+        for pair, delta in self.facet_deltas.items():
+            if delta:
+                adjust_facets([pair], delta)
+        self.facet_deltas.clear()
+
+    def _invalidate_caches(self):
+        """Drop the cached filter results and API lookups if anything was written since the last call"""
+        written = {model: c['created'] + c['updated'] for model, c in self.stats.counts.items()}
+        if written != self.written:
+            # new or updated samples can change the result of any cached custom filter
+            filter_results.clear()
+        if written['metadata'] != self.written['metadata']:
+            # bulk writes skip the signals too, drop the API's cached lookups
+            lookup_cache.invalidate()
+        self.written = written
+
+    def _sync_experiments(self, rows):
+        missing = {row['experiment'] for row in rows} - set(self.experiments)
+        if not missing:
+            return
+        for experiment in Experiment.objects.filter(name__in=missing):
+            self.experiments.setdefault(experiment.name, experiment)
+
+        new_names = missing - set(self.experiments)
+        Experiment.objects.bulk_create([Experiment(name=name) for name in sorted(new_names)])
+        for experiment in Experiment.objects.filter(name__in=new_names):
+            self.experiments.setdefault(experiment.name, experiment)
+
+        self.stats.add('experiments', created=len(new_names))
+
+    def _sync_samples(self, rows):
+        """Returns {sample_id: Sample pk} for every row in the batch"""
+        existing = {sample.sample_id: sample for sample in Sample.objects.filter(sample_id__in=rows.keys())}
+
+        to_create, to_update, unchanged = [], [], 0
+        for sample_id, row in rows.items():
+            experiment_pk = self.experiments[row['experiment']].pk
+            sample = existing.get(sample_id)
+            if sample is None:
+                to_create.append(Sample(sample_id=sample_id, created_date=row['created_date'],
+                                        sample_label=row['sample_label'], experiment_id=experiment_pk))
+            elif (sample.created_date, sample.sample_label, sample.experiment_id) != \
+                    (row['created_date'], row['sample_label'], experiment_pk):
+                sample.created_date = row['created_date']
+                sample.sample_label = row['sample_label']
+                sample.experiment_id = experiment_pk
+                to_update.append(sample)
+            else:
+                unchanged += 1
+
+        Sample.objects.bulk_create(to_create, batch_size=self.batch_size)
+        Sample.objects.bulk_update(to_update, ['created_date', 'sample_label', 'experiment'],
+                                   batch_size=self.batch_size)
+        self.stats.add('samples', created=len(to_create), updated=len(to_update), unchanged=unchanged)
+
+        pks = {sample_id: sample.pk for sample_id, sample in existing.items()}
+        if to_create:
+            new_ids = [sample.sample_id for sample in to_create]
+            pks.update(Sample.objects.filter(sample_id__in=new_ids).values_list('sample_id', 'id'))
+        return pks
+
+    def _sync_metadata(self, rows, samples):
+        existing = {meta.sample_id_id: meta for meta in Sample_Metadata.objects.filter(sample_id__in=samples.values())}
+
+        to_create, to_update, unchanged = [], [], 0
+        for sample_id, row in rows.items():
+            sample_pk = samples[sample_id]
+            meta = existing.get(sample_pk)
+            if meta is None:
+                meta = Sample_Metadata(sample_id_id=sample_pk, metadata=row['metadata'])
+                meta.sync_promoted_fields()
+                to_create.append(meta)
+                self._count_facets([], metadata_facet_values(row['metadata']))
+            elif meta.metadata != row['metadata']:
+                self._count_facets(metadata_facet_values(meta.metadata), metadata_facet_values(row['metadata']))
+                meta.metadata = row['metadata']
+                meta.sync_promoted_fields()
+                to_update.append(meta)
+            else:
+                unchanged += 1
+
+        # bulk writes skip Sample_Metadata.save(), so the promoted columns are synced above
+        Sample_Metadata.objects.bulk_create(to_create, batch_size=self.batch_size)
+        Sample_Metadata.objects.bulk_update(to_update, ['metadata', *Sample_Metadata.PROMOTED_KEYS],
+                                           batch_size=self.batch_size)
+        self.stats.add('metadata', created=len(to_create), updated=len(to_update), unchanged=unchanged)
+
+    def _sync_read_pairs(self, rows, samples):
+        existing = {(pair.sample_id_id, pair.read1_path): pair
+                    for pair in Read_Pair.objects.filter(sample_id__in=samples.values())}
+
+        to_create, to_update, unchanged = [], [], 0
+        for sample_id, row in rows.items():
+            sample_pk = samples[sample_id]
+            pair = existing.get((sample_pk, row['read1_path']))
+            if pair is None:
+                pair = Read_Pair(sample_id_id=sample_pk, read1_path=row['read1_path'],
+                                 read2_path=row['read2_path'], plate_number=row['plate_number'])
+                to_create.append(pair)
+                self._count_facets([], read_pair_facet_values(pair))
+            elif (pair.read2_path, pair.plate_number) != (row['read2_path'], row['plate_number']):
+                old_values = read_pair_facet_values(pair)
+                pair.read2_path = row['read2_path']
+                pair.plate_number = row['plate_number']
+                self._count_facets(old_values, read_pair_facet_values(pair))
+                to_update.append(pair)
+            else:
+                unchanged += 1
+
+        Read_Pair.objects.bulk_create(to_create, batch_size=self.batch_size)
+        Read_Pair.objects.bulk_update(to_update, ['read2_path', 'plate_number'], batch_size=self.batch_size)
+        self.stats.add('read_pairs', created=len(to_create), updated=len(to_update), unchanged=unchanged)
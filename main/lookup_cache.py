@@ -0,0 +1,108 @@
+"""Read-through cache for the sample id -> metadata lookup used by the pipeline API.
+
+Metadata hardly ever changes after import, so /api/get-cell-type/ reads it from
+the Django cache (the 'sample_lookup' alias, a bounded local-memory cache by
+default, see CACHES in settings.py) and only goes to the db on a miss.
+
+The keys carry a CacheGeneration counter, read from the db with each lookup.
+invalidate() bumps it, from the Sample_Metadata signals in main/signals.py and
+from the importer, so a change made in any process (import command, job worker,
+sheets sync) reaches the local memory caches of every web server process.
+"""
+import threading
+
+from django.core.cache import caches
+
+from main.models import CacheGeneration, Sample_Metadata
+
+CACHE_ALIAS = 'sample_lookup'
+KEY_PREFIX = 'sample_metadata:'
+GENERATION = 'sample_lookup'
+
+_counters = {'hits': 0, 'misses': 0}
+_counters_lock = threading.Lock()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _key(sample_id, generation):
+    return f"{KEY_PREFIX}{generation}:{sample_id}"
+
+
+def _count(hits=0, misses=0):
+    with _counters_lock:
+        _counters['hits'] += hits
+        _counters['misses'] += misses
+
+
+def _load_metadata(sample_ids):
+    """{sample_id: metadata} from the db, one query"""
+    rows = (Sample_Metadata.objects.filter(sample_id__sample_id__in=set(sample_ids))
+            .values_list('sample_id__sample_id', 'metadata'))
+    return {sample_id: metadata or {} for sample_id, metadata in rows}
+
+
+def get_metadata(sample_id):
+    """metadata dict for `sample_id`, or None if the sample has no metadata"""
+    return get_many_metadata([sample_id]).get(sample_id)
+
+
+def get_many_metadata(sample_ids):
+    """{sample_id: metadata} for the sample ids that have metadata. Misses are loaded with one query"""
+    sample_ids = list(dict.fromkeys(sample_ids))
+    generation = CacheGeneration.current(GENERATION)
+    keys = {sample_id: _key(sample_id, generation) for sample_id in sample_ids}
+    cached = _cache().get_many(list(keys.values()))
+    found = {sample_id: cached[key] for sample_id, key in keys.items() if key in cached}
+
+    missing = [sample_id for sample_id in sample_ids if sample_id not in found]
+    _count(hits=len(found), misses=len(missing))
+    if missing:
+        loaded = _load_metadata(missing)
+        _cache().set_many({keys[sample_id]: metadata for sample_id, metadata in loaded.items()})
+        found.update(loaded)
+    return found
+
+
+async def aget_metadata(sample_id):
+    """async version of get_metadata for the async API handlers"""
+    generation = await CacheGeneration.objects.filter(name=GENERATION).values_list('value', flat=True).afirst()
+    key = _key(sample_id, generation or 0)
+    metadata = await _cache().aget(key)
+    if metadata is not None:
+        _count(hits=1)
+        return metadata
+
+    _count(misses=1)
+    meta = await Sample_Metadata.objects.filter(sample_id__sample_id=sample_id).afirst()
+    if meta is None:
+        return None
+    await _cache().aset(key, meta.metadata or {})
+    return meta.metadata or {}
+
+
+def invalidate():
+    """Drop the cached metadata in every process. Like the rows that changed, the new generation
+    is only seen by other processes once the surrounding transaction commits"""
+    CacheGeneration.bump(GENERATION)
+
+
+def clear():
+    """Empty this process's cache, e.g. between benchmark runs"""
+    _cache().clear()
+
+
+def stats():
+    """hit/miss counters of this process since it started (or since reset_stats)"""
+    with _counters_lock:
+        hits, misses = _counters['hits'], _counters['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def reset_stats():
+    with _counters_lock:
+        _counters['hits'] = 0
+        _counters['misses'] = 0
@@ -0,0 +1,46 @@
+from main.importer import BulkImporter
+from main.synthetic import synthetic_sheet_rows, synthetic_titer_rows
+from main.titer_import import TiterImporter
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Fill the db with synthetic experiments, samples, metadata, read pairs and titers for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=1000, help="number of samples to generate (1k to 1M)")
+        parser.add_argument('--titer-runs', type=int, default=1,
+                            help="titer results per sample, one per synthetic sequencing run (0 for none)")
+        parser.add_argument('--prefix', default='SYN', help="sample ids are <prefix>_<n>, use a new prefix to add more")
+        parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed gives the same data")
+        parser.add_argument('--batch-size', type=int, default=5000, help="rows written per bulk query")
+
+    def handle(self, *args, **kwargs):
+        if kwargs['samples'] < 1:
+            raise CommandError("--samples must be at least 1")
+
+        ##############################################################
+        # Part 1: Samples, metadata and read pairs (like import_json) #
+        ##############################################################
+
+        # the rows are generated lazily and go through the same batched importer as the real sheet export,
+        # so the facets, promoted metadata columns and caches end up exactly like after a real import
+        rows = synthetic_sheet_rows(kwargs['samples'], prefix=kwargs['prefix'], seed=kwargs['seed'])
+        stats = BulkImporter(
+            batch_size=kwargs['batch_size'],
+            on_error=lambda message: self.stdout.write(self.style.ERROR(message)),
+        ).run(rows)
+        for line in stats.summary_lines():
+            self.stdout.write(line)
+
+        #############################
+        # Part 2: Titers per sample #
+        #############################
+
+        if kwargs['titer_runs'] > 0:
+            titer_rows = synthetic_titer_rows(kwargs['samples'], prefix=kwargs['prefix'],
+                                              runs=kwargs['titer_runs'], seed=kwargs['seed'])
+            titer_stats = TiterImporter(batch_size=kwargs['batch_size']).run(titer_rows)
+            self.stdout.write(titer_stats.summary_line())
+
+        self.stdout.write(self.style.SUCCESS(f"Generated {kwargs['samples']} synthetic samples"))
@@ -1,128 +1,73 @@
-import json
-import os
-from main.models import Experiment, Sample, Sample_Metadata, Read_Pair  
-from django.core.management.base import BaseCommand
-from datetime import datetime 
-
-
-class Command(BaseCommand):
-    def handle(self, *args, **kwargs):
-        #################################################
-        # Part 1: Load JSON and find correct file paths #
-        #################################################
-
-        # Determine the correct path to the JSON file
-        base_dir = os.path.dirname(os.path.abspath(__file__)) # was having trouble with the path to the json file so I used this instead of a direct path
-        json_file_path = os.path.join(base_dir, 'cleaned_migration.json')
-
-        # Load JSON data from file
-        with open(json_file_path, 'r') as file:  
-            data = json.load(file)
-
-        for item in data:
-
-        ####################################
-        # Part 2: Handle Experiments Model #
-        ####################################
-
-            '''The experiments are saved as acronyms, but I want the full exp name to be
-            saved to the db. The next few lines corelate the acronym to the exp name so that can be 
-            saved to the db instead'''
-
-            experiment_id = item.get('Experiment ID')  
-            exp_names = {'SI': "Stable Infection", 'RMF': "Riv84 Merill23", 'MW': 'Mixed wMel-wWil'} 
-
-            # Check if the experiment ID exists in the dictionary and get the full name
-            if experiment_id in exp_names:
-                experiment_name = exp_names[experiment_id]
-            else:
-                experiment_name = experiment_id  # Fallback if initials not found
-
-            #create exp
-            experiment, created = Experiment.objects.get_or_create(name=experiment_name) 
-            if created: #bool = true if exp *didnt* exist before
-                self.stdout.write(f"Created New Experiment: {experiment.name}")
-
-        ################################
-        # Part 3: Handle Samples Model #
-        ################################
-
-            #Part 3A: Sample ID and Label
-            sample_id = item.get('Sample ID')    
-            sample_label = item.get('Sample Label')  
-
-            #Part 3B: Date validation
-            created_date = item.get('Date Collected')
-
-             # Check if 'Date Collected' exists and is in a valid format
-            if created_date:
-                try:
-                    datetime.strptime(created_date, '%Y-%m-%d')  # Just to validate the format
-                except ValueError:
-                    # Throw an error if the date format is incorrect
-                    self.stdout.write(self.style.ERROR(f"Invalid date format for sample '{sample_id}': {created_date}"))
-            else:
-                # throw an error if 'Date Collected' is missing
-                self.stdout.write(self.style.ERROR(f"Missing 'Date Collected' for sample '{sample_id}'"))
-
-            #Part 3C: DB Commit
-            sample, created = Sample.objects.update_or_create(
-                sample_id=sample_id,
-                defaults={
-                    'created_date': created_date,
-                    'experiment': experiment,
-                    'sample_label': sample_label
-                })
-            # Check if a new sample was created
-            if created:
-                print(f"Created New Sample: {sample.sample_id}")
-            else:
-                print(f"Updated Sample: {sample.sample_id}")
-
-        #################################
-        # Part 4: Handle Metadata Model #
-        #################################
-
-            metadata = {
-                "Cell_Line": item.get('Cell Line'),
-                "Infection": item.get('Infection'),
-                "Initials": item.get('Initials'),
-                "Split (DDMMRep)": item.get('Split (DDMMRep)'),
-                "Species":item.get('Species'),
-                'Replicate':item.get('Pellet Replicate'),
-                "Extraction Date":item.get('Extraction Date'),
-                "Timepoint":item.get('Timepoint'),
-                'gDNA Conc':item.get('gDNA Conc'),
-                'media':item.get('Media Type'),
-            }  
-
-            # Update or create metadata
-            sample_metadata, created = Sample_Metadata.objects.update_or_create(
-                sample_id=sample,
-                defaults={'metadata': metadata})
-
-            if created:
-                self.stdout.write(f"Created New Metadata for Sample: {sample.sample_id}")
-            else:
-                self.stdout.write(f"Updated Metadata for Sample: {sample.sample_id}")
-
-
-        ##################################
-        # Part 5: Handle Read Pair Model #
-        ##################################
-
-            read1_path = f"/path/to/read1_{sample_id}.fastq" 
-            read2_path = f"/path/to/read2_{sample_id}.fastq"  
-            plate_number = item.get('Plate Number', '0') # Default to '0' if Plate Number is not found
-
-            # Create or update Read Pair Path
-            read_pair, created = Read_Pair.objects.update_or_create(
-                read1_path=read1_path,
-                sample_id=sample,
-                defaults={
-                    'read2_path': read2_path,
-                    'plate_number': plate_number
-                })
-            
-            if created:
-                self.stdout.write(f"Created New Read Pair for Sample: {sample.sample_id}")
+import os
+import sys
+from main.importer import BulkImporter, DEFAULT_BATCH_SIZE
+from main.validation import QuarantineReport
+from main.streaming import StreamFormatError, iter_records, open_input
+from django.core.management.base import BaseCommand, CommandError
+
+# was having trouble with the path to the json file so I used this instead of a direct path
+DEFAULT_JSON_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cleaned_migration.json')
+
+
+class Command(BaseCommand):
+    help = "Stream a pellet sheet export (JSON array or JSON Lines) into the db in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_JSON_FILE,
+                            help="file to import, '-' reads from stdin (default: cleaned_migration.json next to this command)")
+        parser.add_argument('--format', choices=['auto', 'json', 'jsonl'], default='auto',
+                            help="input format, 'auto' looks at the first character of the input")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="number of rows diffed and written per bulk query")
+        parser.add_argument('--quarantine', help="JSON Lines file the rejected rows are written to, with the reasons")
+        parser.add_argument('--background', action='store_true',
+                            help="queue the import as a background job (run by manage.py run_jobs) and return")
+
+    def handle(self, *args, **kwargs):
+        if kwargs['background']:
+            if kwargs['path'] == '-' or kwargs['quarantine']:
+                raise CommandError("--background can't read from stdin or write a quarantine file")
+            from jobs.queue import enqueue
+            job = enqueue('import_json', {'path': os.path.abspath(kwargs['path']), 'format': kwargs['format'],
+                                          'batch_size': kwargs['batch_size']})
+            self.stdout.write(self.style.SUCCESS(f"Queued import job #{job.id}"))
+            return
+
+        #################################
+        # Part 1: Open the input stream #
+        #################################
+
+        try:
+            stream = open_input(kwargs['path'])
+        except OSError as e:
+            raise CommandError(f"Could not open {kwargs['path']}: {e}")
+
+        #################################################
+        # Part 2: Diff against the db and write in bulk #
+        #################################################
+
+        # Records are decoded one at a time and handed to the importer, which writes them in
+        # fixed size batches, so memory stays flat no matter how big the export is.
+        # Experiments, Samples, Metadata and Read Pairs are all handled by the importer,
+        # see main/importer.py for how the rows are mapped to each model
+        quarantine = QuarantineReport(kwargs['quarantine']) if kwargs['quarantine'] else None
+        importer = BulkImporter(
+            batch_size=kwargs['batch_size'],
+            on_error=lambda message: self.stdout.write(self.style.ERROR(message)),
+            quarantine=quarantine,
+        )
+        try:
+            stats = importer.run(iter_records(stream, kwargs['format']))
+        except StreamFormatError as e:
+            raise CommandError(f"Could not read {kwargs['path']}: {e}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if quarantine:
+                quarantine.close()
+
+        for line in stats.summary_lines():
+            self.stdout.write(line)
+        if quarantine and quarantine.count:
+            self.stdout.write(self.style.WARNING(f"{quarantine.count} rejected rows written to {quarantine.path}"))
+        self.stdout.write(self.style.SUCCESS("Import finished"))
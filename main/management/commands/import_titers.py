@@ -0,0 +1,40 @@
+import sys
+from main.streaming import open_input
+from main.titer_import import DEFAULT_BATCH_SIZE, TiterFormatError, TiterImporter, iter_titer_rows
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Stream the pipeline's per-sample depth/titer results (TSV or CSV) into the Titer table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="pipeline output file, '-' reads from stdin")
+        parser.add_argument('--sequencing-run',
+                            help="sequencing run for rows that don't have a run column")
+        parser.add_argument('--delimiter', choices=['tab', 'comma'],
+                            help="column separator, detected from the header line by default")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="number of rows looked up and upserted per bulk query")
+
+    def handle(self, *args, **kwargs):
+        delimiter = {'tab': '\t', 'comma': ',', None: None}[kwargs['delimiter']]
+        try:
+            stream = open_input(kwargs['path'])
+        except OSError as e:
+            raise CommandError(f"Could not open {kwargs['path']}: {e}")
+
+        importer = TiterImporter(
+            batch_size=kwargs['batch_size'],
+            sequencing_run=kwargs['sequencing_run'],
+            on_error=lambda message: self.stdout.write(self.style.ERROR(message)),
+        )
+        try:
+            stats = importer.run(iter_titer_rows(stream, delimiter))
+        except TiterFormatError as e:
+            raise CommandError(f"Could not read {kwargs['path']}: {e}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(stats.summary_line())
+        self.stdout.write(self.style.SUCCESS("Titer import finished"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main.facets import rebuild_facets
+from main.models import Facet
+
+
+class Command(BaseCommand):
+    help = "Recount the homepage filter dropdown values (Facet table) from the samples in the db"
+
+    def handle(self, *args, **kwargs):
+        rebuild_facets()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {Facet.objects.count()} facet values"))
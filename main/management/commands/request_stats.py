@@ -0,0 +1,45 @@
+import glob
+import json
+from main.request_stats import dump_path, merge_snapshots, summarize
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Per-view latency and query percentiles from the stats files the server processes dump (REQUEST_STATS_FILE)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=getattr(settings, 'REQUEST_STATS_FILE', None),
+                            help="REQUEST_STATS_FILE the server was started with, every <file>.<pid>.json is merged")
+        parser.add_argument('--sort', default='wall_ms', choices=['wall_ms', 'db_ms', 'queries', 'duplicates', 'repeated'],
+                            help="order the views by the p90 of this field")
+        parser.add_argument('--json', action='store_true', help="print the report as JSON")
+
+    def handle(self, *args, **kwargs):
+        if not kwargs['file']:
+            raise CommandError("No stats file, pass --file or set REQUEST_STATS_FILE")
+
+        paths = sorted(glob.glob(dump_path(kwargs['file'], pid='*')))
+        if not paths:
+            raise CommandError(f"No stats dumped yet to {dump_path(kwargs['file'], pid='<pid>')}")
+        snapshots = []
+        for path in paths:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        report = summarize(merge_snapshots(snapshots))
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{len(paths)} process(es)\n")
+        self.stdout.write(f"{'view':32} {'requests':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'db p90':>9} "
+                          f"{'queries p90':>11} {'dups p90':>8}")
+        order = sorted(report.items(), key=lambda item: item[1][kwargs['sort']]['p90'] or 0, reverse=True)
+        for view, entry in order:
+            wall = entry['wall_ms']
+            self.stdout.write(f"{view[:32]:32} {entry['requests']:>8} {wall['p50']:>9} {wall['p90']:>9} {wall['p99']:>9} "
+                              f"{entry['db_ms']['p90']:>9} {entry['queries']['p90']:>11} {entry['duplicates']['p90']:>8}")
+            if 'worst_statement' in entry and entry['repeated']['max']:
+                worst = entry['worst_statement']
+                self.stdout.write(self.style.WARNING(f"    {worst['times']}x in one request: {worst['sql']}"))
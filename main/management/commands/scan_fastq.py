@@ -0,0 +1,32 @@
+from main.fastq_index import DEFAULT_WORKERS, FastqIndexer, match_read_pairs
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Index the FASTQ files in the sequencing directories and match them to the read pairs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', action='append', dest='dirs',
+                            help="directory to scan, can be given more than once. Default: settings.SEQUENCING_DIRS")
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                            help="threads listing directories and sampling files in parallel")
+        parser.add_argument('--full', action='store_true',
+                            help="re-read every file, not only the ones whose size or mtime changed")
+        parser.add_argument('--no-match', action='store_true',
+                            help="only update the index, don't match the read pairs")
+
+    def handle(self, *args, **kwargs):
+        indexer = FastqIndexer(roots=kwargs['dirs'], workers=kwargs['workers'], full=kwargs['full'])
+        if not indexer.roots:
+            raise CommandError("No directories to scan, pass --dir or set SEQUENCING_DIRS")
+
+        stats = indexer.scan()
+        for root in stats.missing_dirs:
+            self.stdout.write(self.style.WARNING(f"{root} does not exist, skipped"))
+        self.stdout.write(stats.summary_line())
+
+        if not kwargs['no_match']:
+            counts = match_read_pairs()
+            self.stdout.write(f"{counts['read_pairs']} read pairs: {counts['complete']} with both files found, "
+                              f"{counts['missing_files']} files missing, {counts['by_name']} matched by file name")
+        self.stdout.write(self.style.SUCCESS("FASTQ scan finished"))
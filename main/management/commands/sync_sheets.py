@@ -0,0 +1,70 @@
+from main.importer import BulkImporter, DEFAULT_BATCH_SIZE
+from main.validation import QuarantineReport
+from django.core.management.base import BaseCommand, CommandError
+from sheets.sync import SyncState, WorksheetFetcher, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Stream the pellet and tn5 sheet rows straight into the db, without writing cleaned_migration.json"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--state', help="sync state file, when given only rows that changed since the last sync are imported")
+        parser.add_argument('--workers', type=int, default=4, help="how many sheet tabs are fetched at once")
+        parser.add_argument('--retries', type=int, default=3, help="retries per tab when the sheets api call fails")
+        parser.add_argument('--batch-reads', action='store_true',
+                            help="read all experiment tabs with one batched range request")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="number of rows diffed and written per bulk query")
+        parser.add_argument('--quarantine', help="JSON Lines file the rejected rows are written to, with the reasons")
+
+    def get_client(self):
+        # gspread and the google auth libraries are only needed when actually talking to google
+        from sheets.load_env import authorize
+        return authorize()
+
+    def handle(self, *args, **kwargs):
+        ###############################
+        # Part 1: Read the sheet rows #
+        ###############################
+
+        try:
+            client = self.get_client()
+        except Exception as e:
+            raise CommandError(f"Could not connect to google sheets: {e}")
+
+        # the tabs are fetched (concurrently) and merged with the tn5 data as the importer asks for
+        # rows, without ever being saved to disk. Both stages are generators, so only the tab being
+        # read and the batch being written are in memory
+        fetcher = WorksheetFetcher(max_workers=kwargs['workers'], retries=kwargs['retries'],
+                                   batch_reads=kwargs['batch_reads'])
+        rows = iter_rows(client, fetcher=fetcher)
+        state = SyncState(kwargs['state']) if kwargs['state'] else None
+        if state:
+            rows = state.iter_changed(rows)
+
+        #################################################
+        # Part 2: Diff against the db and write in bulk #
+        #################################################
+
+        quarantine = QuarantineReport(kwargs['quarantine']) if kwargs['quarantine'] else None
+        importer = BulkImporter(
+            batch_size=kwargs['batch_size'],
+            on_error=lambda message: self.stdout.write(self.style.ERROR(message)),
+            quarantine=quarantine,
+        )
+        try:
+            # every batch is committed on its own, so the sheets api calls (and their retries) run between
+            # the write transactions instead of inside one. The sync state records each batch once it's
+            # committed, a failed sync resumes with the rows that weren't
+            stats = importer.run(rows, commit_batches=True, on_commit=state.commit if state else None)
+        finally:
+            if quarantine:
+                quarantine.close()
+
+        for name, seconds in fetcher.timings.items():
+            self.stdout.write(f"  fetched {name} in {seconds:.2f}s")
+        for line in stats.summary_lines():
+            self.stdout.write(line)
+        if quarantine and quarantine.count:
+            self.stdout.write(self.style.WARNING(f"{quarantine.count} rejected rows written to {quarantine.path}"))
+        self.stdout.write(self.style.SUCCESS("Sync finished"))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:47
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# frozen copy of main.facets.rebuild_facets as it was when the table was added, so later changes
+# to the live code don't change what this migration does
+METADATA_FACETS = {'infection': 'Infection', 'cell_line': 'Cell_Line', 'initials': 'Initials'}
+READ_PAIR_FACETS = {'plate_number': 'plate_number'}
+
+
+def backfill_facets(apps, schema_editor):
+    Facet = apps.get_model('main', 'Facet')
+    Sample_Metadata = apps.get_model('main', 'Sample_Metadata')
+    Read_Pair = apps.get_model('main', 'Read_Pair')
+
+    counts = {}
+    for facet, key in METADATA_FACETS.items():
+        lookup = f'metadata__{key}'
+        for row in Sample_Metadata.objects.values(lookup).annotate(n=Count('id')).order_by():
+            if row[lookup] not in (None, ""):
+                value = str(row[lookup])
+                counts[(facet, value)] = counts.get((facet, value), 0) + row['n']
+    for facet, field in READ_PAIR_FACETS.items():
+        for row in Read_Pair.objects.values(field).annotate(n=Count('id')).order_by():
+            if row[field] not in (None, ""):
+                value = str(row[field])
+                counts[(facet, value)] = counts.get((facet, value), 0) + row['n']
+
+    Facet.objects.all().delete()
+    Facet.objects.bulk_create([Facet(facet=facet, value=value, count=n) for (facet, value), n in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_titer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Facet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=50)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('facet', 'value'), name='unique_facet_value')],
+            },
+        ),
+        migrations.RunPython(backfill_facets, migrations.RunPython.noop),
+    ]
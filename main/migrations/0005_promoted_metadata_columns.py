@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+# copy of Sample_Metadata.PROMOTED_KEYS as it was when these columns were added
+PROMOTED_KEYS = {
+    'cell_line': 'Cell_Line',
+    'infection': 'Infection',
+    'initials': 'Initials',
+}
+
+
+def backfill_promoted_columns(apps, schema_editor):
+    Sample_Metadata = apps.get_model('main', 'Sample_Metadata')
+
+    batch = []
+    for meta in Sample_Metadata.objects.order_by('id').iterator(chunk_size=2000):
+        metadata = meta.metadata or {}
+        for field, key in PROMOTED_KEYS.items():
+            value = metadata.get(key)
+            setattr(meta, field, "" if value is None else str(value))
+        batch.append(meta)
+        if len(batch) >= 2000:
+            Sample_Metadata.objects.bulk_update(batch, list(PROMOTED_KEYS))
+            batch = []
+    Sample_Metadata.objects.bulk_update(batch, list(PROMOTED_KEYS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_facet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sample_metadata',
+            name='cell_line',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='sample_metadata',
+            name='infection',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='sample_metadata',
+            name='initials',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_promoted_columns, migrations.RunPython.noop),
+    ]
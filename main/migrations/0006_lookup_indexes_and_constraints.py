@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    """Make existing rows fit the new unique constraints.
+
+    Extra metadata rows and read pairs (everything but the lowest id, which is the one the
+    views and exports already used) are deleted. Duplicate experiment names or sample ids
+    can't be merged safely, so the migration stops and lists them instead.
+    """
+    Experiment = apps.get_model('main', 'Experiment')
+    Sample = apps.get_model('main', 'Sample')
+    Sample_Metadata = apps.get_model('main', 'Sample_Metadata')
+    Read_Pair = apps.get_model('main', 'Read_Pair')
+
+    for model, field in [(Experiment, 'name'), (Sample, 'sample_id')]:
+        duplicates = list(model.objects.values_list(field, flat=True).annotate(n=Count('id')).filter(n__gt=1).order_by())
+        if duplicates:
+            raise RuntimeError(f"Duplicate {model.__name__}.{field} values must be merged by hand before "
+                               f"this migration can run: {', '.join(map(str, duplicates[:20]))}")
+
+    keep = Sample_Metadata.objects.values('sample_id').annotate(first=Min('id')).values('first')
+    Sample_Metadata.objects.exclude(id__in=keep).delete()
+
+    keep = Read_Pair.objects.values('sample_id', 'read1_path').annotate(first=Min('id')).values('first')
+    Read_Pair.objects.exclude(id__in=keep).delete()
+
+
+def recount_facets(apps, schema_editor):
+    """The deleted rows were still counted in the Facet table. Frozen copy of the facet rebuild,
+    it must not follow later changes to main.facets"""
+    Facet = apps.get_model('main', 'Facet')
+    Sample_Metadata = apps.get_model('main', 'Sample_Metadata')
+    Read_Pair = apps.get_model('main', 'Read_Pair')
+
+    counts = {}
+    for facet, key in {'infection': 'Infection', 'cell_line': 'Cell_Line', 'initials': 'Initials'}.items():
+        lookup = f'metadata__{key}'
+        for row in Sample_Metadata.objects.values(lookup).annotate(n=Count('id')).order_by():
+            if row[lookup] not in (None, ""):
+                value = str(row[lookup])
+                counts[(facet, value)] = counts.get((facet, value), 0) + row['n']
+    for row in Read_Pair.objects.values('plate_number').annotate(n=Count('id')).order_by():
+        if row['plate_number'] is not None:
+            value = str(row['plate_number'])
+            counts[('plate_number', value)] = counts.get(('plate_number', value), 0) + row['n']
+
+    Facet.objects.all().delete()
+    Facet.objects.bulk_create([Facet(facet=facet, value=value, count=n) for (facet, value), n in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_promoted_metadata_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='experiment',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='read_pair',
+            name='plate_number',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='read_pair',
+            name='read1_path',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='sample',
+            name='sample_id',
+            field=models.CharField(max_length=30, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='sample_metadata',
+            name='sample_id',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='main.sample'),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(fields=['created_date', 'id'], name='sample_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(fields=['experiment', 'created_date', 'id'], name='sample_exp_created_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='read_pair',
+            constraint=models.UniqueConstraint(fields=('sample_id', 'read1_path'), name='unique_read_pair_per_sample'),
+        ),
+        migrations.RunPython(recount_facets, migrations.RunPython.noop),
+    ]
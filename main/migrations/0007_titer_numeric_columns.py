@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+CONVERTED_FIELDS = ['wri_mean_depth', 'dmel_mean_depth', 'wri_titer']
+
+
+def parse_float(value):
+    try:
+        return float(str(value).strip().replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+
+
+def copy_to_numeric(apps, schema_editor):
+    Titer = apps.get_model('main', 'Titer')
+
+    batch = []
+    for titer in Titer.objects.order_by('id').iterator(chunk_size=2000):
+        for field in CONVERTED_FIELDS:
+            setattr(titer, f'{field}_value', parse_float(getattr(titer, field)))
+        batch.append(titer)
+        if len(batch) >= 2000:
+            Titer.objects.bulk_update(batch, [f'{field}_value' for field in CONVERTED_FIELDS])
+            batch = []
+    Titer.objects.bulk_update(batch, [f'{field}_value' for field in CONVERTED_FIELDS])
+
+
+def copy_to_text(apps, schema_editor):
+    Titer = apps.get_model('main', 'Titer')
+    for titer in Titer.objects.order_by('id').iterator(chunk_size=2000):
+        for field in CONVERTED_FIELDS:
+            value = getattr(titer, f'{field}_value')
+            setattr(titer, field, '' if value is None else repr(value))
+        titer.save(update_fields=CONVERTED_FIELDS)
+
+
+class Migration(migrations.Migration):
+    """Convert the text titer/depth columns to floats. The values are parsed into temporary
+    *_value columns, which then replace the text columns. Unparseable values become null."""
+
+    dependencies = [
+        ('main', '0006_lookup_indexes_and_constraints'),
+    ]
+
+    operations = [
+        *[migrations.AddField(
+            model_name='titer',
+            name=f'{field}_value',
+            field=models.FloatField(null=True, blank=True),
+        ) for field in CONVERTED_FIELDS],
+        migrations.RunPython(copy_to_numeric, copy_to_text),
+        *[migrations.RemoveField(model_name='titer', name=field) for field in CONVERTED_FIELDS],
+        *[migrations.RenameField(model_name='titer', old_name=f'{field}_value', new_name=field)
+          for field in CONVERTED_FIELDS],
+        migrations.AlterField(
+            model_name='titer',
+            name='wri_titer',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+    ]
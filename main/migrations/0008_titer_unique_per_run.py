@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:57
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def keep_latest_titer(apps, schema_editor):
+    """Only the newest result (highest id) of a sample and run is kept"""
+    Titer = apps.get_model('main', 'Titer')
+    keep = Titer.objects.values('sample_id', 'sequencing_run').annotate(latest=Max('id')).values('latest')
+    Titer.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_titer_numeric_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_latest_titer, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='titer',
+            constraint=models.UniqueConstraint(fields=('sample_id', 'sequencing_run'), name='unique_titer_per_run'),
+        ),
+    ]
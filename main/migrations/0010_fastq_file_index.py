@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_titer_unique_per_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FastqFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('name', models.CharField(db_index=True, max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('read_count_estimate', models.BigIntegerField(blank=True, null=True)),
+                ('scanned_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='read_pair',
+            name='read1_file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.fastqfile'),
+        ),
+        migrations.AddField(
+            model_name='read_pair',
+            name='read2_file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.fastqfile'),
+        ),
+    ]
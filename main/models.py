@@ -2,30 +2,90 @@ from django.db import models
 
 
 class Experiment(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
 
 class Sample(models.Model):
-    sample_id = models.CharField(max_length=30)
+    # sample_id is the natural key used by the api, importer and exports
+    sample_id = models.CharField(max_length=30, unique=True)
     created_date = models.DateField()
     sample_label = models.CharField(max_length=150, default="")
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # date range filters and the keyset pagination order of the listing pages (main/pagination.py)
+            models.Index(fields=['created_date', 'id'], name='sample_created_id_idx'),
+            models.Index(fields=['experiment', 'created_date', 'id'], name='sample_exp_created_id_idx'),
+        ]
+
 class Sample_Metadata(models.Model):
-    sample_id = models.ForeignKey(Sample, on_delete=models.CASCADE)
+    # metadata keys that the custom filter uses are copied into their own indexed columns, since
+    # JSON lookups can't use an index on SQLite. To promote another key: add a field, add it to
+    # PROMOTED_KEYS and write a migration that backfills it (see 0005_promoted_metadata_columns)
+    PROMOTED_KEYS = {
+        'cell_line': 'Cell_Line',
+        'infection': 'Infection',
+        'initials': 'Initials',
+    }
+
+    sample_id = models.OneToOneField(Sample, on_delete=models.CASCADE)
     metadata = models.JSONField()
+    cell_line = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    infection = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    initials = models.CharField(max_length=255, blank=True, default="", db_index=True)
+
+    @classmethod
+    def promoted_values(cls, metadata):
+        """{column: value} for the promoted columns of a metadata dict"""
+        metadata = metadata or {}
+        values = {}
+        for field, key in cls.PROMOTED_KEYS.items():
+            value = metadata.get(key)
+            values[field] = "" if value is None else str(value)
+        return values
+
+    def sync_promoted_fields(self):
+        """copy the promoted metadata keys into their columns. bulk_create/bulk_update callers must call this"""
+        for field, value in self.promoted_values(self.metadata).items():
+            setattr(self, field, value)
+
+    def save(self, *args, **kwargs):
+        self.sync_promoted_fields()
+        super().save(*args, **kwargs)
+
+class FastqFile(models.Model):
+    """A FASTQ file found in one of the SEQUENCING_DIRS, indexed by main/fastq_index.py.
+    size and mtime decide whether a rescan has to read the file again"""
+    path = models.CharField(max_length=1024, unique=True)
+    name = models.CharField(max_length=255, db_index=True)  # basename, to match read pairs whose directory is wrong
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    read_count_estimate = models.BigIntegerField(null=True, blank=True)  # null when the file couldn't be read
+    scanned_at = models.DateTimeField()
 
 class Read_Pair(models.Model):
-    read1_path = models.CharField(max_length=255)
+    read1_path = models.CharField(max_length=255, db_index=True)
     read2_path = models.CharField(max_length=255)
     sample_id = models.ForeignKey(Sample, on_delete=models.CASCADE)
-    plate_number = models.IntegerField()
+    plate_number = models.IntegerField(db_index=True)
+    # the indexed files the paths point to, set by the FASTQ scan (main/fastq_index.py). null = not found
+    read1_file = models.ForeignKey(FastqFile, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    read2_file = models.ForeignKey(FastqFile, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        constraints = [
+            # the importer upserts read pairs by (sample, read1_path)
+            models.UniqueConstraint(fields=['sample_id', 'read1_path'], name='unique_read_pair_per_sample'),
+        ]
 
 class Titer(models.Model):
     sample_id = models.ForeignKey(Sample, on_delete=models.CASCADE)
     sequencing_run = models.CharField(max_length=255)
-    wri_mean_depth = models.CharField(max_length=255)
-    dmel_mean_depth = models.CharField(max_length=255)
-    wri_titer = models.CharField(max_length=255)
+    # stored as numbers so titers can be aggregated, sorted and range filtered in the db (main/titers.py).
+    # null when the pipeline didn't report a usable value
+    wri_mean_depth = models.FloatField(null=True, blank=True)
+    dmel_mean_depth = models.FloatField(null=True, blank=True)
+    wri_titer = models.FloatField(null=True, blank=True, db_index=True)
     total_reads = models.IntegerField()
     mapped_reads = models.IntegerField()
     duplicate_reads = models.IntegerField()
@@ -33,4 +93,38 @@ class Titer(models.Model):
     wwil_mean_depth = models.IntegerField()
     wmel_titer = models.IntegerField()
     wwil_titer = models.IntegerField()
-    dsim_mean_depth = models.IntegerField()
\ No newline at end of file
+    dsim_mean_depth = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            # one result per sample and run, the titer import upserts on this key (main/titer_import.py)
+            models.UniqueConstraint(fields=['sample_id', 'sequencing_run'], name='unique_titer_per_run'),
+        ]
+
+
+class Facet(models.Model):
+    """Distinct values (and how many rows use them) for each filter dropdown on the homepage.
+    Maintained by main/facets.py so the homepage doesn't have to scan every sample"""
+    facet = models.CharField(max_length=50)
+    value = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='unique_facet_value'),
+        ]
+
+class CacheGeneration(models.Model):
+    """Counter per cached result set. Cache keys include the current value, so bumping it from any
+    process (web server, import command, job worker) invalidates the entries in every process"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def current(cls, name):
+        return cls.objects.filter(name=name).values_list('value', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        if not cls.objects.filter(name=name).update(value=models.F('value') + 1):
+            cls.objects.get_or_create(name=name, defaults={'value': 1})
@@ -0,0 +1,100 @@
+"""Keyset pagination for the sample listing pages.
+
+Pages are ordered by (created_date, id) and a cursor is the (created_date, id)
+of the last (or first) sample on the current page, so fetching any page is one
+indexed range query no matter how deep into the results it is. The related
+metadata and read pair of the samples on a page are attached in bulk by
+attach_related(), which keeps rendering a page linear in the page size.
+"""
+from datetime import date
+
+from django.db.models import Q
+
+from main.models import Sample_Metadata, Read_Pair
+
+PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sample):
+    return f"{sample.created_date.isoformat()}_{sample.id}"
+
+
+def decode_cursor(cursor):
+    try:
+        created_date, pk = cursor.split('_', 1)
+        return date.fromisoformat(created_date), int(pk)
+    except (AttributeError, ValueError) as e:
+        raise InvalidCursor(f"Invalid page cursor: {cursor!r}") from e
+
+
+class Page:
+    def __init__(self, samples, next_cursor=None, previous_cursor=None):
+        self.samples = samples
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.samples)
+
+    def __len__(self):
+        return len(self.samples)
+
+
+def keyset_page(queryset, after=None, before=None, page_size=PAGE_SIZE):
+    """One page of `queryset` ordered by (created_date, id).
+
+    `after` returns the page following that cursor, `before` the page preceding it,
+    neither returns the first page.
+    """
+    if before:
+        created_date, pk = decode_cursor(before)
+        rows = list(queryset.filter(Q(created_date__lt=created_date) | Q(created_date=created_date, id__lt=pk))
+                    .order_by('-created_date', '-id')[:page_size + 1])
+        has_more_before = len(rows) > page_size
+        samples = list(reversed(rows[:page_size]))
+        return Page(
+            samples,
+            next_cursor=encode_cursor(samples[-1]) if samples else None,
+            previous_cursor=encode_cursor(samples[0]) if has_more_before else None,
+        )
+
+    if after:
+        created_date, pk = decode_cursor(after)
+        queryset = queryset.filter(Q(created_date__gt=created_date) | Q(created_date=created_date, id__gt=pk))
+
+    rows = list(queryset.order_by('created_date', 'id')[:page_size + 1])
+    samples = rows[:page_size]
+    return Page(
+        samples,
+        next_cursor=encode_cursor(samples[-1]) if len(rows) > page_size else None,
+        previous_cursor=encode_cursor(samples[0]) if after and samples else None,
+    )
+
+
+def attach_related(samples):
+    """Set sample.meta (metadata dict) and sample.read_pair on every sample with one query per model.
+    Like the exports, the first read pair (lowest id) of a sample is used"""
+    pks = [sample.id for sample in samples]
+
+    metadata = dict(Sample_Metadata.objects.filter(sample_id__in=pks).values_list('sample_id', 'metadata'))
+
+    read_pairs = {}
+    for pair in Read_Pair.objects.filter(sample_id__in=pks).order_by('-id'):
+        read_pairs[pair.sample_id_id] = pair
+
+    for sample in samples:
+        sample.meta = metadata.get(sample.id) or {}
+        sample.read_pair = read_pairs.get(sample.id)
+    return samples
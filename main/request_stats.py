@@ -0,0 +1,205 @@
+"""Opt-in per-view timing and query instrumentation.
+
+RequestStatsMiddleware (enabled with REQUEST_STATS_ENABLED = True, the env var
+REQUEST_STATS=1) wraps every query of a request with connection.execute_wrapper,
+so it works without DEBUG, and records per view:
+
+    wall time, db time, query count,
+    duplicate queries (same SQL and params run again in one request) and
+    repeated statements (same SQL, different params: usually an N+1 loop)
+
+The last REQUEST_STATS_WINDOW requests of each view are kept in memory, per
+process, and summarized as rolling percentiles by /request-stats/ (staff only).
+With REQUEST_STATS_FILE set each process also dumps its window to
+<file>.<pid>.json every REQUEST_STATS_DUMP_INTERVAL seconds, which the
+request_stats command merges into one report. When disabled the middleware
+raises MiddlewareNotUsed and is dropped from the chain, so it costs nothing.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from main.titers import percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 1000
+DEFAULT_DUMP_INTERVAL = 60
+DUPLICATE_WARNING_THRESHOLD = 10  # repeats of one statement before the request is logged as a likely N+1
+PERCENTILES = (50, 90, 99)
+SQL_PREVIEW_LENGTH = 200
+
+
+class QueryRecorder:
+    """execute_wrapper that times every query of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.statements = Counter()  # sql -> times run
+        self.executions = Counter()  # (sql, params) -> times run
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+            self.executions[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        """queries that were exact repeats of an earlier query in the request"""
+        return sum(n - 1 for n in self.executions.values() if n > 1)
+
+    @property
+    def repeated(self):
+        """queries whose SQL had already run in the request with other params"""
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    def most_repeated(self):
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+
+class RequestStats:
+    """Rolling window of request measurements per view"""
+
+    FIELDS = ('wall_ms', 'db_ms', 'queries', 'duplicates', 'repeated')
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}  # view -> deque of tuples in FIELDS order
+            self.totals = Counter()  # view -> requests seen
+            self.worst_statement = {}  # view -> (times run in one request, sql)
+
+    def record(self, view, wall, recorder):
+        sample = (wall * 1000, recorder.db_time * 1000, recorder.count, recorder.duplicates, recorder.repeated)
+        sql, times = recorder.most_repeated()
+        with self._lock:
+            self.samples.setdefault(view, deque(maxlen=self.window)).append(sample)
+            self.totals[view] += 1
+            if times > 1 and times >= self.worst_statement.get(view, (0, ''))[0]:
+                self.worst_statement[view] = (times, sql[:SQL_PREVIEW_LENGTH])
+
+    def snapshot(self):
+        """Raw windows, JSON serializable, for dumping and merging"""
+        with self._lock:
+            return {view: {'samples': [list(sample) for sample in samples],
+                           'total': self.totals[view],
+                           'worst_statement': self.worst_statement.get(view)}
+                    for view, samples in self.samples.items()}
+
+    def report(self):
+        return summarize(self.snapshot())
+
+
+def summarize(snapshot):
+    """{view: {requests, window, <field>: {mean, p50, p90, p99, max}, worst_statement}} from snapshot()s"""
+    report = {}
+    for view, data in snapshot.items():
+        samples = data['samples']
+        entry = {'requests': data['total'], 'window': len(samples)}
+        for i, field in enumerate(RequestStats.FIELDS):
+            values = sorted(sample[i] for sample in samples)
+            stats = {'mean': round(sum(values) / len(values), 2) if values else None,
+                     'max': round(values[-1], 2) if values else None}
+            for pct in PERCENTILES:
+                value = percentile(values, pct)
+                stats[f'p{pct}'] = round(value, 2) if value is not None else None
+            entry[field] = stats
+        if data.get('worst_statement'):
+            times, sql = data['worst_statement']
+            entry['worst_statement'] = {'times': times, 'sql': sql}
+        report[view] = entry
+    return report
+
+
+def merge_snapshots(snapshots):
+    """Combine the snapshots of several processes into one"""
+    merged = {}
+    for snapshot in snapshots:
+        for view, data in snapshot.items():
+            entry = merged.setdefault(view, {'samples': [], 'total': 0, 'worst_statement': None})
+            entry['samples'].extend(data['samples'])
+            entry['total'] += data['total']
+            worst = data.get('worst_statement')
+            if worst and (entry['worst_statement'] is None or worst[0] > entry['worst_statement'][0]):
+                entry['worst_statement'] = worst
+    return merged
+
+
+def dump_path(base, pid=None):
+    return f"{base}.{pid or os.getpid()}.json"
+
+
+request_stats = RequestStats(window=getattr(settings, 'REQUEST_STATS_WINDOW', DEFAULT_WINDOW))
+
+
+class RequestStatsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_STATS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.dump_file = getattr(settings, 'REQUEST_STATS_FILE', None)
+        self.dump_interval = getattr(settings, 'REQUEST_STATS_DUMP_INTERVAL', DEFAULT_DUMP_INTERVAL)
+        self.last_dump = time.monotonic()
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        if response.streaming:
+            # the CSV exports run most of their queries while the body is streamed, keep recording until it's done
+            response.streaming_content = self.streamed(response.streaming_content, request, recorder, started)
+        else:
+            self.finish(request, recorder, started)
+        return response
+
+    def streamed(self, content, request, recorder, started):
+        try:
+            with connection.execute_wrapper(recorder):
+                yield from content
+        finally:
+            self.finish(request, recorder, started)
+
+    def finish(self, request, recorder, started):
+        wall = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else request.path
+        request_stats.record(view, wall, recorder)
+
+        sql, times = recorder.most_repeated()
+        if times >= DUPLICATE_WARNING_THRESHOLD:
+            logger.warning("%s ran the same statement %d times (%d queries in total): %s",
+                           view, times, recorder.count, sql[:SQL_PREVIEW_LENGTH])
+
+        if self.dump_file and time.monotonic() - self.last_dump >= self.dump_interval:
+            self.last_dump = time.monotonic()
+            self.dump()
+
+    def dump(self):
+        path = dump_path(self.dump_file)
+        try:
+            with open(f"{path}.tmp", 'w') as file:
+                json.dump(request_stats.snapshot(), file)
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            logger.exception("Could not write request stats to %s", path)
@@ -0,0 +1,73 @@
+"""Signal handlers that keep the Facet table, the filter result cache and the API
+lookup cache in sync with single saves and deletes.
+
+Bulk writes (bulk_create / bulk_update / queryset.update) don't send these signals,
+so the importer adjusts the facets and invalidates the caches itself.
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from main import lookup_cache
+from main.filters import filter_results
+from main.facets import adjust_facets, metadata_facet_values, read_pair_facet_values
+from main.models import Sample, Sample_Metadata, Read_Pair
+
+
+@receiver(pre_save, sender=Sample_Metadata)
+def remember_old_metadata_facets(sender, instance, **kwargs):
+    instance._old_facets = []
+    if instance.pk:
+        old = sender.objects.filter(pk=instance.pk).values_list('metadata', flat=True).first()
+        instance._old_facets = metadata_facet_values(old)
+
+
+@receiver(post_save, sender=Sample_Metadata)
+def update_metadata_facets(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    adjust_facets(getattr(instance, '_old_facets', []), -1)
+    adjust_facets(metadata_facet_values(instance.metadata), 1)
+
+
+@receiver(post_delete, sender=Sample_Metadata)
+def remove_metadata_facets(sender, instance, **kwargs):
+    adjust_facets(metadata_facet_values(instance.metadata), -1)
+
+
+@receiver(post_save, sender=Sample_Metadata)
+@receiver(post_delete, sender=Sample_Metadata)
+def invalidate_lookup_cache(sender, instance, **kwargs):
+    lookup_cache.invalidate()
+
+
+@receiver(pre_save, sender=Read_Pair)
+def remember_old_read_pair_facets(sender, instance, **kwargs):
+    instance._old_facets = []
+    if instance.pk:
+        old = sender.objects.filter(pk=instance.pk).first()
+        if old is not None:
+            instance._old_facets = read_pair_facet_values(old)
+
+
+@receiver(post_save, sender=Read_Pair)
+def update_read_pair_facets(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    adjust_facets(getattr(instance, '_old_facets', []), -1)
+    adjust_facets(read_pair_facet_values(instance), 1)
+
+
+@receiver(post_delete, sender=Read_Pair)
+def remove_read_pair_facets(sender, instance, **kwargs):
+    adjust_facets(read_pair_facet_values(instance), -1)
+
+
+@receiver(post_save, sender=Sample)
+@receiver(post_save, sender=Sample_Metadata)
+@receiver(post_save, sender=Read_Pair)
+@receiver(post_delete, sender=Sample)
+@receiver(post_delete, sender=Sample_Metadata)
+@receiver(post_delete, sender=Read_Pair)
+def clear_filter_results(sender, **kwargs):
+    # any change can add or remove a sample from a cached filter result
+    filter_results.clear()
@@ -0,0 +1,37 @@
+"""Connection tuning for SQLite deployments.
+
+Every new SQLite connection gets the pragmas below through the
+connection_created signal (connected in MainConfig.ready). WAL lets readers work
+while one writer commits, synchronous=NORMAL only fsyncs at checkpoints (still
+safe against corruption in WAL mode), mmap_size/cache_size keep the hot pages in
+memory. Override any of them with the SQLITE_PRAGMAS setting, a value of None
+leaves that pragma at SQLite's default.
+
+The busy timeout (a writer waits for the lock instead of failing with "database
+is locked") isn't one of them: it's the 'timeout' connect option set in
+titerpipeline/database.py, which also covers the queries run before this signal.
+"""
+from django.conf import settings
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'cache_size': -64 * 1024,  # negative = KiB, so 64MB
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_pragmas():
+    pragmas = dict(DEFAULT_PRAGMAS)
+    pragmas.update(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,141 @@
+"""Incremental readers for sample exports.
+
+Both readers yield one record (dict) at a time while only holding the current
+read chunk plus the record being decoded in memory, so the importer can write
+fixed-size batches while the rest of the file is still being read.
+
+Supported inputs:
+    - a JSON array of objects, e.g. cleaned_migration.json
+    - JSON Lines, one object per line (blank lines are ignored)
+"""
+import json
+import sys
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_SIZE = 16 * 1024 * 1024  # characters one array element may span before the input is rejected
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+
+
+class StreamFormatError(ValueError):
+    pass
+
+
+def open_input(path):
+    """File object for `path`, '-' means stdin"""
+    if path == '-':
+        return sys.stdin
+    return open(path, 'r', encoding='utf-8')
+
+
+def detect_format(stream):
+    """'json' if the stream starts with '[' otherwise 'jsonl'. Returns (format, already read text)"""
+    head = ''
+    while True:
+        chunk = stream.read(1)
+        if not chunk:
+            return 'jsonl', head
+        head += chunk
+        if chunk not in _WHITESPACE:
+            return ('json' if chunk == '[' else 'jsonl'), head
+
+
+def iter_records(stream, fmt='auto', chunk_size=READ_CHUNK_SIZE):
+    """Yield the records in `stream` one by one. fmt is 'json', 'jsonl' or 'auto'"""
+    head = ''
+    if fmt == 'auto':
+        fmt, head = detect_format(stream)
+
+    if fmt == 'json':
+        return _iter_json_array(stream, head, chunk_size)
+    if fmt == 'jsonl':
+        return _iter_json_lines(stream, head)
+    raise StreamFormatError(f"Unknown input format: {fmt}")
+
+
+def _iter_json_lines(stream, head=''):
+    first = True
+    for line_number, line in enumerate(stream, start=1):
+        if first:
+            line = head + line
+            first = False
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise StreamFormatError(f"Invalid JSON on line {line_number}: {e}") from e
+    if first and head.strip():
+        # the stream ended right after the first character
+        raise StreamFormatError(f"Truncated JSON Lines input: {head!r}")
+
+
+def _iter_json_array(stream, head='', chunk_size=READ_CHUNK_SIZE, max_record_size=MAX_RECORD_SIZE):
+    """Decode the elements of a top level JSON array without loading the whole array.
+
+    The buffer is read from an offset and only compacted when the next chunk is appended, so
+    every record costs one raw_decode and not a copy of the rest of the buffer"""
+    buf = head
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        if len(buf) - pos > max_record_size:
+            # malformed input would otherwise keep being refilled until the whole file is in memory
+            raise StreamFormatError(f"JSON array element longer than {max_record_size} characters")
+        chunk = stream.read(chunk_size)
+        if chunk:
+            buf = buf[pos:] + chunk
+            pos = 0
+        else:
+            eof = True
+
+    def skip_whitespace():
+        nonlocal pos
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+
+    skip_whitespace()
+    while pos == len(buf) and not eof:
+        fill()
+        skip_whitespace()
+    if not buf.startswith('[', pos):
+        raise StreamFormatError("Expected a JSON array")
+    pos += 1
+
+    expect_value = True  # False once a value was read and we are waiting for ',' or ']'
+    while True:
+        skip_whitespace()
+        if pos == len(buf):
+            if eof:
+                raise StreamFormatError("Unexpected end of input inside JSON array")
+            fill()
+            continue
+
+        if buf[pos] == ']':
+            return
+        if not expect_value:
+            if buf[pos] != ',':
+                raise StreamFormatError(f"Expected ',' or ']' in JSON array, got {buf[pos]!r}")
+            pos += 1
+            expect_value = True
+            continue
+
+        try:
+            record, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise StreamFormatError(f"Invalid JSON in array: {e}") from e
+            fill()  # the record is split across reads
+            continue
+        if end == len(buf) and not eof:
+            # a scalar could continue in the next chunk, read more before trusting it
+            fill()
+            continue
+
+        yield record
+        pos = end
+        expect_value = False
@@ -0,0 +1,73 @@
+"""Synthetic pellet sheet rows and pipeline titer rows, for load testing.
+
+The rows look like the real exports (same keys, same value shapes) and are
+generated lazily from a seed, so any scale can be streamed into BulkImporter /
+TiterImporter without building it in memory first. Used by the
+generate_synthetic_data command and the benchmarks.
+"""
+import random
+from datetime import date, timedelta
+
+EXPERIMENT_IDS = ['SI', 'RMF', 'MW']
+CELL_LINES = ['JW18', 'Aa23', 'S2', 'Dsim-wRi', 'C6/36']
+INFECTIONS = ['wMel', 'wWil', 'wRi', 'wMel + wWil', 'Uninfected']
+INITIALS = ['EG', 'LS', 'SR', 'WS', 'MR', 'JD']
+SPECIES = ['DMel', 'DSim', 'AAlb']
+TIMEPOINTS = ['0h', '24h', '48h', '72h', '1wk']
+MEDIA = ['Schneider', 'SFX', 'S2 + FBS']
+START_DATE = date(2022, 1, 1)
+
+
+def synthetic_sample_id(prefix, n):
+    return f"{prefix}_{n}"
+
+
+def synthetic_sheet_rows(count, prefix='SYN', seed=0, experiment_ids=EXPERIMENT_IDS):
+    """Yield `count` pellet sheet rows, sample ids {prefix}_0 .. {prefix}_{count - 1}"""
+    rng = random.Random(seed)
+    for n in range(count):
+        collected = START_DATE + timedelta(days=rng.randrange(1000))
+        yield {
+            "Experiment ID": rng.choice(experiment_ids),
+            "Sample ID": synthetic_sample_id(prefix, n),
+            "Sample Label": f"{prefix}-{n:07d}",
+            "Initials": rng.choice(INITIALS),
+            "Date Collected": collected.isoformat(),
+            "Species": rng.choice(SPECIES),
+            "Infection": rng.choice(INFECTIONS),
+            "Cell Line": rng.choice(CELL_LINES),
+            "Split (DDMMRep)": f"{collected.day:02d}{collected.month:02d}{rng.randrange(1, 4)}",
+            "Pellet Replicate": rng.randrange(1, 4),
+            "Extraction Date": (collected + timedelta(days=rng.randrange(1, 30))).isoformat(),
+            "Timepoint": rng.choice(TIMEPOINTS),
+            "gDNA Conc": round(rng.uniform(0.5, 60), 2),
+            "Media Type": rng.choice(MEDIA),
+            "Plate Number": rng.randrange(1, 80),
+        }
+
+
+def synthetic_titer_rows(count, prefix='SYN', runs=1, seed=0):
+    """Yield `runs` titer rows (one per sequencing run) for each of the `count` synthetic samples,
+    with the column names of the pipeline output"""
+    rng = random.Random(seed + 1)
+    for run in range(runs):
+        for n in range(count):
+            total = rng.randrange(500_000, 5_000_000)
+            mapped = int(total * rng.uniform(0.6, 0.98))
+            dmel_depth = rng.uniform(5, 80)
+            wri_depth = dmel_depth * rng.lognormvariate(0, 1)
+            yield {
+                'sample_id': synthetic_sample_id(prefix, n),
+                'sequencing_run': f"{prefix}_run_{run + 1}",
+                'total_reads': str(total),
+                'mapped_reads': str(mapped),
+                'duplicate_reads': str(int(mapped * rng.uniform(0.01, 0.2))),
+                'wri_mean_depth': f"{wri_depth:.3f}",
+                'dmel_mean_depth': f"{dmel_depth:.3f}",
+                'wri_titer': f"{wri_depth / dmel_depth:.4f}",
+                'wmel_mean_depth': str(rng.randrange(0, 100)),
+                'wwil_mean_depth': str(rng.randrange(0, 100)),
+                'wmel_titer': str(rng.randrange(0, 10)),
+                'wwil_titer': str(rng.randrange(0, 10)),
+                'dsim_mean_depth': str(rng.randrange(0, 100)),
+            }
@@ -0,0 +1,19 @@
+"""Factories shared by the test modules of the apps."""
+
+
+def sheet_row(sample_id, **overrides):
+    """One row the way it comes out of the pellet sheet export"""
+    row = {
+        "Experiment ID": "SI",
+        "Sample ID": sample_id,
+        "Initials": "EG",
+        "Date Collected": "2024-07-10",
+        "Species": "DSim",
+        "Infection": "wMel",
+        "Cell Line": "JW18",
+        "Sample Label": f"{sample_id} label",
+        "gDNA Conc": 6.98,
+        "Plate Number": 27,
+    }
+    row.update(overrides)
+    return row
@@ -1,3 +1,675 @@
-from django.test import TestCase
-
-# Create your tests here.
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import date
+from pathlib import Path
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.core.exceptions import MiddlewareNotUsed
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main import columnar
+from main.exports import SAMPLE_CSV_HEADER
+from main.facets import get_facets, rebuild_facets
+from main.fastq_index import FastqIndexer, estimate_read_count, match_read_pairs
+from main.forms import SampleFilterForm
+from main.filters import FilterResultCache, SampleFilter, filter_results
+from main.importer import BulkImporter
+from main.pagination import keyset_page
+from main.request_stats import QueryRecorder, RequestStatsMiddleware, dump_path, request_stats
+from main.streaming import StreamFormatError, _iter_json_array, iter_records
+from main.models import Experiment, FastqFile, Facet, Sample, Sample_Metadata, Read_Pair, Titer
+from main.titer_import import TiterFormatError, TiterImporter, iter_titer_rows
+from main.titers import percentile, titer_summary
+from main.validation import BatchValidator, QuarantineReport
+from main.testing import sheet_row
+from titerpipeline.database import database_config
+
+
+def make_titer(sample, **overrides):
+    values = dict(sample_id=sample, sequencing_run="run_1", wri_mean_depth=10.0, dmel_mean_depth=20.0, wri_titer=0.5,
+                  total_reads=1000, mapped_reads=900, duplicate_reads=10, wmel_mean_depth=0, wwil_mean_depth=0,
+                  wmel_titer=0, wwil_titer=0, dsim_mean_depth=0)
+    values.update(overrides)
+    return Titer.objects.create(**values)
+
+
+class BulkImporterTests(TestCase):
+    def test_creates_all_models(self):
+        stats = BulkImporter(batch_size=2).run([sheet_row("S1"), sheet_row("S2"), sheet_row("S3")])
+
+        self.assertEqual(Experiment.objects.get().name, "Stable Infection")
+        self.assertEqual(Sample.objects.count(), 3)
+        self.assertEqual(Sample_Metadata.objects.count(), 3)
+        self.assertEqual(Read_Pair.objects.filter(plate_number=27).count(), 3)
+        self.assertEqual(stats.counts['samples']['created'], 3)
+        self.assertEqual(stats.rows, 3)
+
+    def test_reimport_diffs_against_existing_rows(self):
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2")])
+        stats = BulkImporter().run([sheet_row("S1"), sheet_row("S2", **{"Cell Line": "Aa23", "Plate Number": "NA"})])
+
+        self.assertEqual(stats.counts['samples'], {'created': 0, 'updated': 0, 'unchanged': 2})
+        self.assertEqual(stats.counts['metadata'], {'created': 0, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(stats.counts['read_pairs'], {'created': 0, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(Sample_Metadata.objects.get(sample_id__sample_id="S2").metadata["Cell_Line"], "Aa23")
+        self.assertEqual(Read_Pair.objects.get(sample_id__sample_id="S2").plate_number, 0)
+
+    def test_rows_with_bad_dates_are_skipped(self):
+        errors = []
+        stats = BulkImporter(on_error=errors.append).run([sheet_row("S1", **{"Date Collected": "7/10/2024"}),
+                                                          sheet_row("S2")])
+
+        self.assertEqual(stats.skipped, 1)
+        self.assertEqual(list(Sample.objects.values_list('sample_id', flat=True)), ["S2"])
+        self.assertIn("Invalid date format", errors[0])
+
+
+class ImportValidationTests(TestCase):
+    def test_rejects_each_kind_of_bad_row(self):
+        clean, rejected = BatchValidator().validate([
+            sheet_row("S1"),
+            sheet_row("S2", **{"Date Collected": "2024-02-30"}),
+            sheet_row("S3", **{"Plate Number": "plate 4"}),
+            sheet_row("S4", **{"gDNA Conc": "low"}),
+            sheet_row("", **{"Experiment ID": ""}),
+            sheet_row("S1"),
+            sheet_row("S5", **{"Plate Number": "NA", "gDNA Conc": ""}),
+        ])
+
+        self.assertEqual([row["Sample ID"] for row, _ in clean], ["S1", "S5"])
+        self.assertEqual(clean[0][1].isoformat(), "2024-07-10")
+        self.assertEqual([r.row_number for r in rejected], [2, 3, 4, 5, 6])
+        self.assertIn("Invalid date format", rejected[0].reasons[0])
+        self.assertIn("Invalid plate number", rejected[1].reasons[0])
+        self.assertIn("Invalid gDNA concentration", rejected[2].reasons[0])
+        self.assertEqual(rejected[3].reasons, ["Missing 'Sample ID'", "Missing 'Experiment ID'"])
+        self.assertIn("Duplicate sample id", rejected[4].reasons[0])
+
+    def test_rejected_rows_are_quarantined_and_not_saved(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "quarantine.jsonl")
+            quarantine = QuarantineReport(path)
+            stats = BulkImporter(batch_size=2, quarantine=quarantine).run(
+                [sheet_row("S1"), sheet_row("S2", **{"Plate Number": "x"}), sheet_row("S1"), sheet_row("S3")])
+            quarantine.close()
+            with open(path) as file:
+                report = [json.loads(line) for line in file]
+
+        self.assertEqual(stats.skipped, 2)
+        self.assertEqual(set(Sample.objects.values_list('sample_id', flat=True)), {"S1", "S3"})
+        self.assertEqual([(entry["row_number"], entry["sample_id"]) for entry in report], [(2, "S2"), (3, "S1")])
+        self.assertEqual(report[0]["row"]["Plate Number"], "x")
+
+
+class SyntheticDataTests(TestCase):
+    def test_generate_synthetic_data_fills_every_model(self):
+        call_command('generate_synthetic_data', samples=50, titer_runs=2, batch_size=20, stdout=io.StringIO())
+
+        self.assertEqual(Sample.objects.filter(sample_id__startswith="SYN_").count(), 50)
+        self.assertEqual(Sample_Metadata.objects.count(), 50)
+        self.assertEqual(Read_Pair.objects.count(), 50)
+        self.assertEqual(Titer.objects.count(), 100)
+        self.assertTrue(get_facets()['cell_line'])
+
+
+class StreamingReaderTests(TestCase):
+    def test_json_array_is_read_incrementally(self):
+        rows = [sheet_row(f"S{i}") for i in range(50)]
+        stream = io.StringIO(json.dumps(rows, indent=4))
+
+        records = list(iter_records(stream, chunk_size=64))
+
+        self.assertEqual(records, rows)
+
+    def test_json_lines(self):
+        stream = io.StringIO('{"Sample ID": "S1"}\n\n{"Sample ID": "S2"}\n')
+
+        self.assertEqual([r["Sample ID"] for r in iter_records(stream)], ["S1", "S2"])
+
+    def test_malformed_array_is_not_buffered_to_the_end(self):
+        stream = io.StringIO('[{"Sample ID": "S1"}, {"Sample ID" "S2"}, ' + '{"Sample ID": "S3"}, ' * 1000 + ']')
+
+        with self.assertRaises(StreamFormatError):
+            list(_iter_json_array(stream, chunk_size=16, max_record_size=256))
+        self.assertLess(stream.tell(), 1024)
+
+    def test_truncated_array_raises(self):
+        stream = io.StringIO('[{"Sample ID": "S1"}, {"Sample')
+
+        with self.assertRaises(StreamFormatError):
+            list(iter_records(stream, chunk_size=8))
+
+
+class CsvExportTests(TestCase):
+    def setUp(self):
+        cache.clear()  # the cached filter results outlive the rolled back generation counter
+        BulkImporter().run([sheet_row(f"S{i}") for i in range(30)])
+        self.user = User.objects.create_user("tester", password="pw")
+        self.client.force_login(self.user)
+
+    def test_export_by_experiment_streams_every_sample(self):
+        experiment = Experiment.objects.get()
+        with self.assertNumQueries(6):  # session, user, experiment, samples, then metadata + read pairs for the one chunk
+            response = self.client.get(reverse('export_csv_by_exp', args=[experiment.id]))
+            lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(lines[0], ",".join(SAMPLE_CSV_HEADER))
+        self.assertEqual(len(lines), 31)
+        self.assertEqual(lines[1], "S0,JW18,wMel,2024-07-10,27,/path/to/read1_S0.fastq,/path/to/read2_S0.fastq")
+
+    def test_export_query_applies_filters(self):
+        BulkImporter().run([sheet_row("OTHER", **{"Cell Line": "Aa23"})])
+
+        response = self.client.get(reverse('export_csv_query'), {'cell_line': 'Aa23'})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(lines[1:], ["OTHER,Aa23,wMel,2024-07-10,27,/path/to/read1_OTHER.fastq,/path/to/read2_OTHER.fastq"])
+
+
+class ColumnarExportTests(TestCase):
+    def setUp(self):
+        cache.clear()  # the cached filter results outlive the rolled back generation counter
+        BulkImporter().run([sheet_row(f"S{i}", **{"Pellet Replicate": 2, "Extraction Date": "2024-07-12"})
+                            for i in range(5)])
+        self.experiment = Experiment.objects.get()
+        self.user = User.objects.create_user("tester")
+        self.client.force_login(self.user)
+
+    def test_metadata_is_flattened_into_typed_columns(self):
+        batches = list(columnar.sample_batches(Sample.objects.all(), chunk_size=2))
+
+        self.assertEqual([len(batch['sample_id']) for batch in batches], [2, 2, 1])
+        first = batches[0]
+        self.assertEqual(first['sample_id'][0], "S0")
+        self.assertEqual(first['cell_line'][0], "JW18")
+        self.assertEqual(first['replicate'][0], 2)
+        self.assertEqual(first['extraction_date'][0].isoformat(), "2024-07-12")
+        self.assertEqual(first['gdna_conc'][0], 6.98)
+        self.assertEqual(first['plate_number'][0], 27)
+        self.assertIsNone(first['media'][0])
+
+    def test_sheet_values_are_converted(self):
+        self.assertEqual([columnar.to_date(value) for value in ("2024-09-04", "9/4/2024", "4/17/24", "17/4/24", "NA")],
+                         [date(2024, 9, 4), date(2024, 9, 4), date(2024, 4, 17), None, None])
+        self.assertEqual([columnar.to_int(value) for value in ("3", "3.0", "inf", "nan", "x")], [3, 3, None, None, None])
+
+    def test_gzip_csv_export(self):
+        response = self.client.get(reverse('export_csv_by_exp', args=[self.experiment.id]), {'format': 'csv.gz'})
+        lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.csv.gz"', response['Content-Disposition'])
+        self.assertEqual(lines[0], ",".join(name for name, _ in columnar.SAMPLE_FIELDS))
+        self.assertEqual(len(lines), 6)
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(reverse('export_csv_query'), {'format': 'xlsx'})
+
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(columnar.zstandard, "zstandard is not installed")
+    def test_zstd_csv_export(self):
+        response = self.client.get(reverse('export_csv_query'), {'cell_line': 'JW18', 'format': 'csv.zst'})
+        data = columnar.zstandard.ZstdDecompressor().stream_reader(io.BytesIO(b"".join(response.streaming_content)))
+
+        self.assertEqual(len(data.read().decode().splitlines()), 6)
+
+    @skipUnless(columnar.pa, "pyarrow is not installed")
+    def test_parquet_export_has_typed_columns(self):
+        response = self.client.get(reverse('export_csv_by_exp', args=[self.experiment.id]), {'format': 'parquet'})
+        table = columnar.pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(str(table.schema.field('replicate').type), 'int64')
+        self.assertEqual(str(table.schema.field('created_date').type), 'date32[day]')
+        self.assertEqual(table.column('sample_id').to_pylist(), [f"S{i}" for i in range(5)])
+
+    @skipUnless(columnar.pa, "pyarrow is not installed")
+    def test_titer_arrow_export(self):
+        for sample in Sample.objects.all():
+            make_titer(sample)
+
+        response = self.client.get(reverse('export_titers'), {'experiment': self.experiment.name, 'format': 'arrow'})
+        table = columnar.pa.ipc.open_file(io.BytesIO(b"".join(response.streaming_content))).read_all()
+
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.column('wri_titer').to_pylist(), [0.5] * 5)
+        self.assertEqual(str(table.schema.field('total_reads').type), 'int64')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2", **{"Cell Line": "Aa23", "Plate Number": 3})])
+
+    def test_import_counts_facets(self):
+        facets = get_facets()
+
+        self.assertEqual(facets['cell_line'], ["Aa23", "JW18"])
+        self.assertEqual(facets['plate_number'], ["3", "27"])
+        self.assertEqual(Facet.objects.get(facet='infection', value='wMel').count, 2)
+
+    def test_reimport_only_adjusts_the_changed_values(self):
+        with CaptureQueriesContext(connection) as queries:
+            BulkImporter().run([sheet_row("S1"), sheet_row("S2", **{"Plate Number": 3})])
+
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql']])  # no full recount
+        self.assertEqual(get_facets()['cell_line'], ["JW18"])
+        self.assertEqual(Facet.objects.get(facet='cell_line', value='JW18').count, 2)
+        self.assertEqual(Facet.objects.get(facet='plate_number', value='3').count, 1)
+
+        counted = set(Facet.objects.filter(count__gt=0).values_list('facet', 'value', 'count'))
+        rebuild_facets()
+        self.assertEqual(set(Facet.objects.values_list('facet', 'value', 'count')), counted)
+
+    def test_single_saves_and_deletes_update_counts(self):
+        meta = Sample_Metadata.objects.get(sample_id__sample_id="S2")
+        meta.metadata = dict(meta.metadata, Cell_Line="JW18")
+        meta.save()
+
+        self.assertEqual(get_facets()['cell_line'], ["JW18"])
+        self.assertEqual(Facet.objects.get(facet='cell_line', value='JW18').count, 2)
+
+        Sample.objects.get(sample_id="S1").delete()
+        self.assertEqual(Facet.objects.get(facet='cell_line', value='JW18').count, 1)
+
+    def test_home_reads_facets_in_one_query(self):
+        self.client.force_login(User.objects.create_user("tester", password="pw"))
+
+        with self.assertNumQueries(4):  # session, user, experiments, facets
+            response = self.client.get(reverse('home'))
+
+        self.assertEqual(response.context['cell_lines'], ["Aa23", "JW18"])
+
+    def test_filter_form_choices_come_from_the_facet_table(self):
+        with self.assertNumQueries(1):
+            form = SampleFilterForm()
+        self.assertEqual(form.fields['cell_type'].choices, [('', 'All'), ("Aa23", "Aa23"), ("JW18", "JW18")])
+        self.assertEqual(form.fields['infection_status'].choices, [('', 'All'), ("wMel", "wMel")])
+
+        BulkImporter().run([sheet_row("S3", **{"Cell Line": "S2R+"})])
+        self.assertIn(("S2R+", "S2R+"), SampleFilterForm().fields['cell_type'].choices)
+
+
+class PromotedMetadataColumnTests(TestCase):
+    def test_columns_follow_metadata_on_save_and_import(self):
+        BulkImporter().run([sheet_row("S1", Initials=None)])
+        meta = Sample_Metadata.objects.get()
+        self.assertEqual((meta.cell_line, meta.infection, meta.initials), ("JW18", "wMel", ""))
+
+        meta.metadata = dict(meta.metadata, Cell_Line="Aa23")
+        meta.save()
+
+        self.assertEqual(Sample.objects.filter(sample_metadata__cell_line="Aa23").count(), 1)
+
+
+class FilterResultCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()  # the cached filter results outlive the rolled back generation counter
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2", **{"Cell Line": "Aa23"})])
+        self.client.force_login(User.objects.create_user("tester", password="pw"))
+
+    def test_filtered_page_only_counts(self):
+        with self.assertNumQueries(2):  # generation counter, COUNT
+            self.assertEqual(SampleFilter(cell_line="JW18").count(), 1)
+        with self.assertNumQueries(1):  # just the generation counter
+            self.assertEqual(SampleFilter(cell_line="JW18").count(), 1)
+
+    def test_export_reuses_cached_ids(self):
+        self.client.get(reverse('export_csv_query'), {'cell_line': 'JW18', 'users': ''})
+
+        with self.assertNumQueries(4):  # no filter query, just the generation counter, then samples, metadata and read pairs
+            response = self.client.get(reverse('export_csv_query'), {'cell_line': 'JW18', 'users': ''})
+            lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["S1"])
+
+    def test_export_forms_carry_the_filter_of_the_page(self):
+        page = self.client.post(reverse('filter_samples'), {'cell_line': 'JW18'}).content.decode()
+        start = page.index(reverse('export_csv_query'))
+        export_form = page[start:page.index('</form>', start)]
+        fields = dict(re.findall(r'<input type="hidden" name="(\w+)" value="([^"]*)">', export_form))
+
+        self.assertEqual(fields, {'cell_line': 'JW18', 'infection_status': '', 'start_date': '', 'end_date': '',
+                                  'users': '', 'plate_num': ''})
+        response = self.client.get(reverse('export_csv_query'), fields)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["S1"])
+        self.assertEqual(SampleFilter(start_date="None", users="None").as_dict(), SampleFilter().as_dict())
+
+    def test_import_invalidates_cached_results(self):
+        self.assertEqual(len(SampleFilter(cell_line="JW18").sample_ids()), 1)
+        generation = filter_results.generation()
+
+        BulkImporter().run([sheet_row("S3")])
+
+        self.assertEqual(filter_results.generation(), generation + 1)
+        self.assertEqual(len(SampleFilter(cell_line="JW18").sample_ids()), 2)
+
+    def test_clear_reaches_other_processes(self):
+        # another process has its own FilterResultCache, only the db counter is shared
+        other = FilterResultCache(ttl=60)
+        other.set('a', [1])
+
+        filter_results.clear()
+
+        self.assertIsNone(other.get('a'))
+
+    def test_entries_expire(self):
+        cache = FilterResultCache(ttl=60)
+        cache.set('a', [1])
+        self.assertEqual(cache.get('a'), [1])
+
+        cache.ttl = -1
+        cache.set('d', [4])
+        self.assertIsNone(cache.get('d'))
+
+
+@override_settings(REQUEST_STATS_ENABLED=True)
+class RequestStatsTests(TestCase):
+    def setUp(self):
+        request_stats.reset()
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2")])
+        self.staff = User.objects.create_user("staff", is_staff=True)
+        self.client.force_login(self.staff)
+
+    def test_middleware_is_dropped_when_disabled(self):
+        with override_settings(REQUEST_STATS_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                RequestStatsMiddleware(lambda request: None)
+
+    def test_records_views_including_streamed_exports(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        response = self.client.get(reverse('export_csv_by_exp', args=[Experiment.objects.get().id]))
+        b"".join(response.streaming_content)
+
+        report = request_stats.report()
+        self.assertEqual(report['home']['requests'], 2)
+        self.assertEqual(report['home']['queries']['max'], 4)  # the second request reads the facets from the cache
+        self.assertGreaterEqual(report['export_csv_by_exp']['queries']['max'], 4)  # includes the queries run while streaming
+        self.assertGreater(report['home']['wall_ms']['p90'], 0)
+
+    def test_duplicate_queries_are_counted(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for _ in range(3):
+                list(Sample.objects.filter(sample_id="S1"))
+            list(Sample.objects.filter(sample_id="S2"))
+        self.assertEqual((recorder.count, recorder.duplicates, recorder.repeated), (4, 2, 3))
+
+    def test_report_endpoint_is_staff_only(self):
+        self.client.get(reverse('home'))
+        self.assertIn('home', self.client.get(reverse('request_stats')).json()['views'])
+
+        self.client.force_login(User.objects.create_user("member"))
+        self.assertEqual(self.client.get(reverse('request_stats')).status_code, 302)
+
+    def test_command_merges_process_dumps(self):
+        self.client.get(reverse('home'))
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, "stats")
+            for pid in (1, 2):
+                with open(dump_path(base, pid), 'w') as file:
+                    json.dump(request_stats.snapshot(), file)
+            out = io.StringIO()
+            call_command('request_stats', file=base, json=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['home']['requests'], 2)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()  # the cached filter results outlive the rolled back generation counter
+        BulkImporter().run([sheet_row(f"S{i}", **{"Date Collected": f"2024-07-{i + 1:02d}"}) for i in range(25)])
+        self.client.force_login(User.objects.create_user("tester", password="pw"))
+
+    def test_keyset_pages_cover_every_sample_once(self):
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(Sample.objects.all(), after=cursor, page_size=10)
+            seen.extend(sample.sample_id for sample in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        self.assertEqual(seen, [f"S{i}" for i in range(25)])
+
+        previous = keyset_page(Sample.objects.all(), before=page.previous_cursor, page_size=10)
+        self.assertEqual([s.sample_id for s in previous], [f"S{i}" for i in range(10, 20)])
+
+    def test_experiment_page_renders_in_constant_queries(self):
+        with self.assertNumQueries(6):  # session, user, experiment, one page of samples, metadata, read pairs
+            response = self.client.post(reverse('samples_by_experiment'), {'exp_selection': 'Stable Infection'})
+
+        self.assertEqual(len(response.context['samples']), 25)
+        self.assertContains(response, "JW18")
+
+    def test_filter_page_links_carry_the_filter(self):
+        response = self.client.post(reverse('filter_samples'), {'cell_line': 'JW18'})
+        page = response.context['page']
+        self.assertFalse(page.has_next)
+        self.assertEqual(response.context['page_query'], "cell_line=JW18")
+        self.assertEqual(response.context['total'], 25)
+
+        response = self.client.get(reverse('filter_samples'), {'cell_line': 'JW18', 'after': 'not-a-cursor'})
+        self.assertRedirects(response, reverse('home'))
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def test_sqlite_is_the_default(self):
+        config = database_config(Path("/srv/titer"), environ={})
+        self.assertEqual(config['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(config['NAME'], Path("/srv/titer/db.sqlite3"))
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+    def test_postgres_with_persistent_connections_or_a_pool(self):
+        environ = {'DB_ENGINE': 'postgres', 'DB_NAME': 'titer', 'DB_HOST': 'db', 'DB_CONN_MAX_AGE': '300'}
+        config = database_config(Path("."), environ=environ)
+        self.assertEqual((config['ENGINE'], config['NAME'], config['HOST']), ('django.db.backends.postgresql', 'titer', 'db'))
+        self.assertEqual(config['CONN_MAX_AGE'], 300)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+
+        config = database_config(Path("."), environ=dict(environ, DB_POOL='1', DB_POOL_MAX_SIZE='20'))
+        self.assertEqual(config['OPTIONS']['pool']['max_size'], 20)
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', "pragmas are only set on SQLite connections")
+class SqlitePragmaTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), 20000)  # from the 'timeout' connect option
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+
+
+@skipUnless(connection.vendor == 'sqlite', "query plans are checked with SQLite's EXPLAIN QUERY PLAN")
+class QueryPlanTests(TestCase):
+    """The hot lookups of the views, api and importer must be answered from an index, not a full table scan"""
+
+    def setUp(self):
+        BulkImporter().run([sheet_row(f"S{i}") for i in range(20)])
+
+    def assertUsesIndex(self, queryset, index=None):
+        """Every table in the plan is read with a SEARCH (any SCAN, with or without an index, walks
+        the whole table or index), and `index` is one of the indexes used"""
+        plan = queryset.explain()
+        table_reads = [line for line in plan.splitlines() if re.search(r'\b(SCAN|SEARCH)\b', line)]
+        self.assertTrue(table_reads, f"no table access in query plan:\n{plan}")
+        scans = [line for line in table_reads if 'SEARCH' not in line]
+        self.assertFalse(scans, f"scan in query plan:\n{plan}")
+        if index:
+            self.assertIn(f"INDEX {index} ", plan)
+
+    def test_sample_natural_key(self):
+        self.assertUsesIndex(Sample.objects.filter(sample_id="S1"))
+        self.assertUsesIndex(Sample.objects.filter(sample_id__in=["S1", "S2"]))
+
+    def test_api_metadata_lookup(self):
+        self.assertUsesIndex(Sample_Metadata.objects.filter(sample_id__sample_id="S1"))
+
+    def test_listing_pages(self):
+        experiment = Experiment.objects.get()
+        self.assertUsesIndex(Sample.objects.filter(experiment=experiment).order_by('created_date', 'id')[:101],
+                             index='sample_exp_created_id_idx')
+        self.assertUsesIndex(Sample.objects.filter(created_date__gte="2024-01-01", created_date__lte="2024-12-31"),
+                             index='sample_created_id_idx')
+
+    def test_custom_filters(self):
+        self.assertUsesIndex(SampleFilter(cell_line="JW18").queryset())
+        self.assertUsesIndex(SampleFilter(infection_status="wMel", users="EG").queryset())
+        self.assertUsesIndex(SampleFilter(plate_num="27").queryset())
+
+    def test_read_pair_lookups(self):
+        self.assertUsesIndex(Read_Pair.objects.filter(read1_path="/path/to/read1_S1.fastq"))
+        self.assertUsesIndex(Read_Pair.objects.filter(sample_id__in=[1, 2, 3]))
+
+
+class TiterSummaryTests(TestCase):
+    def setUp(self):
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2"), sheet_row("S3", Infection="wRi")])
+        for run, sample_id, wri_titer in [(1, "S1", 1.0), (2, "S1", 3.0), (1, "S2", 2.0), (1, "S3", 10.0), (2, "S3", None)]:
+            make_titer(Sample.objects.get(sample_id=sample_id), sequencing_run=f"run_{run}", wri_titer=wri_titer)
+
+    def test_summary_by_infection(self):
+        summary = titer_summary(group_by='infection')
+
+        self.assertEqual([entry['group'] for entry in summary], ["wMel", "wRi"])
+        wmel = summary[0]
+        self.assertEqual(wmel['count'], 3)
+        self.assertAlmostEqual(wmel['mean'], 2.0)
+        self.assertEqual((wmel['min'], wmel['max'], wmel['median']), (1.0, 3.0, 2.0))
+        self.assertAlmostEqual(wmel['p25'], 1.5)
+        self.assertEqual(summary[1]['count'], 1)
+
+    def test_percentile_matches_linear_interpolation(self):
+        self.assertEqual(percentile([1.0, 2.0, 3.0, 4.0], 50), 2.5)
+        self.assertIsNone(percentile([], 50))
+
+    def test_unknown_grouping(self):
+        with self.assertRaises(ValueError):
+            titer_summary(group_by='colour')
+
+
+class TiterImportTests(TestCase):
+    def setUp(self):
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2")])
+
+    def test_tsv_rows_are_upserted_by_sample_and_run(self):
+        tsv = ("Sample\twri_mean_depth\tdmel_mean_depth\twri_titer\ttotal_reads\tmapped_reads\n"
+               "S1\t12.5\t25\t0.5\t1000\t900\n"
+               "S2\tNA\t30\t0.25\t2000\t1800\n"
+               "MISSING\t1\t1\t1\t1\t1\n")
+        stats = TiterImporter(sequencing_run="run_1").run(iter_titer_rows(io.StringIO(tsv)))
+
+        self.assertEqual((stats.saved, stats.skipped), (2, 1))
+        self.assertIsNone(Titer.objects.get(sample_id__sample_id="S2").wri_mean_depth)
+
+        csv_text = "sample_id,sequencing_run,wri_titer,total_reads\nS1,run_1,0.75,1100\nS1,run_2,0.1,10\n"
+        TiterImporter().run(iter_titer_rows(io.StringIO(csv_text)))
+
+        self.assertEqual(Titer.objects.count(), 3)
+        titer = Titer.objects.get(sample_id__sample_id="S1", sequencing_run="run_1")
+        self.assertEqual((titer.wri_titer, titer.total_reads), (0.75, 1100))
+        # columns the second file doesn't have keep the values of the first import
+        self.assertEqual((titer.mapped_reads, titer.dmel_mean_depth), (900, 25.0))
+
+    def test_bad_numbers_and_duplicates_are_counted(self):
+        csv_text = ("sample_id,sequencing_run,wri_titer,total_reads\n"
+                    "S1,run_1,0.5,inf\nS2,run_1,0.5,10\nS2,run_1,0.6,11\n")
+        errors = []
+        stats = TiterImporter(on_error=errors.append).run(iter_titer_rows(io.StringIO(csv_text)))
+
+        self.assertEqual((stats.rows, stats.saved, stats.skipped, stats.duplicates), (3, 1, 1, 1))
+        self.assertIn("Invalid number", errors[0])
+        self.assertEqual(Titer.objects.get().total_reads, 11)
+
+    def test_file_without_sample_column_is_rejected(self):
+        with self.assertRaises(TiterFormatError):
+            list(iter_titer_rows(io.StringIO("a,b\n1,2\n")))
+
+
+def write_fastq(path, reads, compress=False):
+    """FASTQ file with `reads` 50bp reads, gzipped if `compress`"""
+    records = "".join(f"@read{n}\n{'ACGT' * 12}AC\n+\n{'I' * 50}\n" for n in range(reads))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with (gzip.open(path, 'wt') if compress else open(path, 'w')) as file:
+        file.write(records)
+
+
+class FastqIndexTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        write_fastq(os.path.join(self.root, "run1", "S1_R1.fastq.gz"), 100, compress=True)
+        write_fastq(os.path.join(self.root, "run1", "S1_R2.fastq.gz"), 100, compress=True)
+        write_fastq(os.path.join(self.root, "run2", "lane1", "S2_R1.fastq"), 10)
+        with open(os.path.join(self.root, "run1", "SampleSheet.csv"), 'w') as file:
+            file.write("not a fastq")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_count_estimate(self):
+        path = os.path.join(self.root, "big.fastq.gz")
+        write_fastq(path, 20000, compress=True)
+        size = os.path.getsize(path)
+
+        self.assertEqual(estimate_read_count(path, size), 20000)  # fits in the sample, counted exactly
+        estimate = estimate_read_count(path, size, sample_bytes=size // 4)
+        self.assertAlmostEqual(estimate, 20000, delta=2000)
+
+    def test_rescans_only_read_changed_files(self):
+        stats = FastqIndexer([self.root], workers=2).scan()
+        self.assertEqual((stats.files, stats.added), (3, 3))
+        self.assertEqual(FastqFile.objects.get(name="S2_R1.fastq").read_count_estimate, 10)
+
+        write_fastq(os.path.join(self.root, "run2", "lane1", "S2_R1.fastq"), 20)
+        os.remove(os.path.join(self.root, "run1", "S1_R2.fastq.gz"))
+        stats = FastqIndexer([self.root], workers=2).scan()
+
+        self.assertEqual((stats.unchanged, stats.updated, stats.removed, stats.added), (1, 1, 1, 0))
+        self.assertEqual(FastqFile.objects.get(name="S2_R1.fastq").read_count_estimate, 20)
+
+    def test_missing_directory_keeps_its_files(self):
+        FastqIndexer([self.root]).scan()
+        with self.assertLogs('main.fastq_index', 'WARNING'):
+            stats = FastqIndexer([os.path.join(self.root, "gone"), self.root + "_unmounted"]).scan()
+
+        self.assertEqual(len(stats.missing_dirs), 2)
+        self.assertEqual(FastqFile.objects.count(), 3)
+
+    def test_read_pairs_are_matched_by_path_or_unique_name(self):
+        BulkImporter().run([sheet_row("S1"), sheet_row("S2"), sheet_row("S3")])
+        Read_Pair.objects.filter(sample_id__sample_id="S1").update(
+            read1_path=os.path.join(self.root, "run1", "S1_R1.fastq.gz"), read2_path="/old/place/S1_R2.fastq.gz")
+        Read_Pair.objects.filter(sample_id__sample_id="S2").update(read1_path="/x/S2_R1.fastq", read2_path="/x/S2_R2.fastq")
+        FastqIndexer([self.root]).scan()
+
+        with self.assertNumQueries(3):  # the index, the read pairs, one bulk update
+            counts = match_read_pairs()
+
+        self.assertEqual((counts['read_pairs'], counts['complete'], counts['by_name'], counts['missing_files']), (3, 1, 2, 3))
+        s1 = Read_Pair.objects.get(sample_id__sample_id="S1")
+        self.assertEqual(s1.read2_file.path, os.path.join(self.root, "run1", "S1_R2.fastq.gz"))
+        self.assertIsNone(Read_Pair.objects.get(sample_id__sample_id="S2").read2_file)
+
+    def test_scan_command(self):
+        out = io.StringIO()
+        call_command('scan_fastq', '--dir', self.root, stdout=out)
+
+        self.assertIn("3 FASTQ files: 3 added", out.getvalue())
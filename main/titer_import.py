@@ -0,0 +1,181 @@
+"""Bulk loader for the pipeline's per-sample depth/titer results.
+
+The pipeline writes one row per sample and sequencing run to a TSV (or CSV)
+file. Rows are read one at a time from the stream, mapped to samples with one IN
+query per batch and saved with a single upserting bulk_create per batch, keyed by
+(sample, sequencing_run). Used by the import_titers command and /api/titers/bulk/.
+"""
+import csv
+import math
+import time
+
+from django.db import transaction
+
+from main.importer import chunked
+from main.models import Sample, Titer
+
+DEFAULT_BATCH_SIZE = 2000
+
+FLOAT_FIELDS = ('wri_mean_depth', 'dmel_mean_depth', 'wri_titer')
+INTEGER_FIELDS = ('total_reads', 'mapped_reads', 'duplicate_reads', 'wmel_mean_depth', 'wwil_mean_depth',
+                  'wmel_titer', 'wwil_titer', 'dsim_mean_depth')
+NUMBER_FIELDS = (*FLOAT_FIELDS, *INTEGER_FIELDS)
+
+# header names the pipeline output may use for the key columns, compared lowercased with spaces as '_'
+COLUMN_ALIASES = {
+    'sample': 'sample_id',
+    'sample_id': 'sample_id',
+    'sample_name': 'sample_id',
+    'run': 'sequencing_run',
+    'sequencing_run': 'sequencing_run',
+    'run_id': 'sequencing_run',
+}
+
+MISSING_VALUES = {'', 'na', 'n/a', 'nan', 'none', 'null', '-'}
+
+
+class TiterFormatError(ValueError):
+    pass
+
+
+def _column_name(header):
+    name = header.strip().lower().replace(' ', '_').replace('-', '_')
+    return COLUMN_ALIASES.get(name, name)
+
+
+def iter_titer_rows(lines, delimiter=None):
+    """Yield one {column: value} dict per line of a TSV/CSV file (or any iterable of text lines).
+    The delimiter is taken from the header line (tab if it has one, otherwise comma) unless given"""
+    lines = iter(lines)
+    header_line = next(lines, '')
+    if not header_line.strip():
+        raise TiterFormatError("Titer file is empty")
+    if delimiter is None:
+        delimiter = '\t' if '\t' in header_line else ','
+
+    columns = [_column_name(name) for name in next(csv.reader([header_line], delimiter=delimiter))]
+    if 'sample_id' not in columns:
+        raise TiterFormatError(f"Titer file has no sample column, found: {', '.join(columns)}")
+
+    for values in csv.reader(lines, delimiter=delimiter):
+        if not any(value.strip() for value in values):
+            continue
+        yield dict(zip(columns, values))
+
+
+def parse_number(value, cast=float):
+    """Number from a pipeline cell, None for empty/NA values. Raises ValueError for anything else,
+    including inf and nan spelled out in other ways than the MISSING_VALUES"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value.lower() in MISSING_VALUES:
+        return None
+    number = float(value.replace(',', ''))
+    if not math.isfinite(number):
+        raise ValueError(f"Not a finite number: {value!r}")
+    return round(number) if cast is int else number
+
+
+class TiterImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.saved = 0
+        self.skipped = 0
+        self.duplicates = 0  # rows replaced by a later row for the same sample and run in the same batch
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {'rows': self.rows, 'saved': self.saved, 'skipped': self.skipped, 'duplicates': self.duplicates,
+                'elapsed_s': round(self.elapsed, 3), 'rows_per_s': round(self.rows_per_second, 1)}
+
+    def summary_line(self):
+        return (f"{self.rows} rows: {self.saved} titers saved, {self.skipped} skipped, "
+                f"{self.duplicates} duplicates in {self.elapsed:.2f}s "
+                f"({self.rows_per_second:.0f} rows/s)")
+
+
+class TiterImporter:
+    """Upsert titer rows by (sample, sequencing_run) in batches.
+
+    `sequencing_run` is used for rows that don't have their own sequencing run column.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, sequencing_run=None, on_error=None):
+        self.batch_size = batch_size
+        self.sequencing_run = sequencing_run
+        self.on_error = on_error or (lambda message: None)
+        self.stats = TiterImportStats()
+
+    def run(self, rows):
+        with transaction.atomic():
+            for batch in chunked(rows, self.batch_size):
+                self.import_batch(batch)
+        self.stats.finish()
+        return self.stats
+
+    def normalize(self, row):
+        """Model field values for one row, or None if it can't be saved"""
+        sample_id = (row.get('sample_id') or '').strip()
+        sequencing_run = (row.get('sequencing_run') or self.sequencing_run or '').strip()
+        if not sample_id:
+            self.on_error(f"Missing sample id in titer row: {row}")
+            return None
+        if not sequencing_run:
+            self.on_error(f"Missing sequencing run for sample '{sample_id}'")
+            return None
+
+        values = {'sample_id': sample_id, 'sequencing_run': sequencing_run}
+        try:
+            for field in FLOAT_FIELDS:
+                values[field] = parse_number(row.get(field))
+            for field in INTEGER_FIELDS:
+                values[field] = parse_number(row.get(field), int) or 0  # these columns aren't nullable
+        except ValueError:
+            self.on_error(f"Invalid number in titer row for sample '{sample_id}': {row}")
+            return None
+        return values
+
+    def import_batch(self, rows):
+        titers = {}
+        for row in rows:
+            self.stats.rows += 1
+            values = self.normalize(row)
+            if values is None:
+                self.stats.skipped += 1
+                continue
+            key = (values['sample_id'], values['sequencing_run'])
+            if key in titers:
+                self.stats.duplicates += 1
+            # existing titers only get the columns the file has, the others keep their values
+            titers[key] = (values, tuple(field for field in NUMBER_FIELDS if field in row))  # later rows win
+
+        samples = dict(Sample.objects.filter(sample_id__in={sample_id for sample_id, _ in titers})
+                       .values_list('sample_id', 'id'))
+
+        objects = {}  # columns in the file -> Titers
+        for (sample_id, _), (values, columns) in titers.items():
+            sample_pk = samples.get(sample_id)
+            if sample_pk is None:
+                self.on_error(f"Sample ID not found: {sample_id}")
+                self.stats.skipped += 1
+                continue
+            values = dict(values, sample_id_id=sample_pk)
+            del values['sample_id']
+            objects.setdefault(columns, []).append(Titer(**values))
+
+        for columns, group in objects.items():
+            if columns:
+                Titer.objects.bulk_create(group, batch_size=self.batch_size, update_conflicts=True,
+                                          unique_fields=['sample_id', 'sequencing_run'], update_fields=list(columns))
+            else:
+                Titer.objects.bulk_create(group, batch_size=self.batch_size, ignore_conflicts=True)
+            self.stats.saved += len(group)
@@ -0,0 +1,129 @@
+"""Summary statistics of titer results, grouped by experiment, infection or timepoint.
+
+Count, mean, min and max are always computed in SQL. On PostgreSQL the standard
+deviation, median and percentiles are computed in SQL too (STDDEV_SAMP,
+PERCENTILE_CONT). SQLite has no percentile aggregate (and Django's Python
+STDDEV_SAMP fails on one-value groups), so there the values of each group are
+streamed back sorted and those statistics are computed with NumPy, or plain
+Python when NumPy isn't installed.
+"""
+import statistics
+
+from django.db import connection
+from django.db.models import Aggregate, Avg, Count, FloatField, Max, Min, StdDev
+
+from main.models import Titer
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the statistics fall back to plain python
+    np = None
+
+# group name -> lookup from Titer
+GROUPINGS = {
+    'experiment': 'sample_id__experiment__name',
+    'infection': 'sample_id__sample_metadata__infection',
+    'timepoint': 'sample_id__sample_metadata__metadata__Timepoint',
+    'sequencing_run': 'sequencing_run',
+}
+
+METRICS = (
+    'wri_titer', 'wri_mean_depth', 'dmel_mean_depth',
+    'wmel_titer', 'wwil_titer', 'wmel_mean_depth', 'wwil_mean_depth', 'dsim_mean_depth',
+    'total_reads', 'mapped_reads', 'duplicate_reads',
+)
+
+DEFAULT_PERCENTILES = (25, 50, 75, 90)
+
+
+class PercentileCont(Aggregate):
+    """PostgreSQL's PERCENTILE_CONT(fraction) WITHIN GROUP (ORDER BY expression)"""
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, fraction, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def percentile(sorted_values, pct):
+    """pct-th percentile of already sorted values, linear interpolation like numpy's default"""
+    if not sorted_values:
+        return None
+    if np is not None:
+        return float(np.percentile(np.asarray(sorted_values, dtype=float), pct))
+    position = (len(sorted_values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def titer_summary(group_by='experiment', metric='wri_titer', queryset=None, percentiles=DEFAULT_PERCENTILES):
+    """One dict of summary statistics per group, ordered by group.
+
+    Rows where `metric` is null are ignored. `queryset` can narrow the titers first,
+    e.g. Titer.objects.filter(sequencing_run='run_12').
+    """
+    if group_by not in GROUPINGS:
+        raise ValueError(f"Unknown grouping {group_by!r}, expected one of {', '.join(GROUPINGS)}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}, expected one of {', '.join(METRICS)}")
+
+    group = GROUPINGS[group_by]
+    titers = (Titer.objects.all() if queryset is None else queryset).filter(**{f'{metric}__isnull': False})
+
+    aggregates = {
+        'count': Count(metric),
+        'mean': Avg(metric),
+        'min': Min(metric),
+        'max': Max(metric),
+    }
+    in_sql = connection.vendor == 'postgresql'
+    if in_sql:
+        aggregates['stddev'] = StdDev(metric, sample=True)
+        for pct in percentiles:
+            aggregates[f'p{pct}'] = PercentileCont(metric, pct / 100)
+
+    rows = titers.values(group).annotate(**aggregates).order_by(group)
+    summary = []
+    for row in rows:
+        entry = {'group': row[group]}
+        entry.update({name: row[name] for name in aggregates})
+        summary.append(entry)
+
+    if not in_sql:
+        _add_value_statistics(summary, titers, group, metric, percentiles)
+
+    for entry in summary:
+        entry['median'] = entry.get('p50') if 50 in percentiles else None
+    return summary
+
+
+def stddev(values):
+    """sample standard deviation, None for fewer than two values"""
+    if len(values) < 2:
+        return None
+    if np is not None:
+        return float(np.std(np.asarray(values, dtype=float), ddof=1))
+    return statistics.stdev(values)
+
+
+def _add_value_statistics(summary, titers, group, metric, percentiles):
+    """Fill in stddev and the pNN keys by streaming each group's values back in sorted order"""
+    by_group = {entry['group']: entry for entry in summary}
+    values, current = [], object()
+
+    def flush():
+        entry = by_group.get(current)
+        if entry is not None:
+            entry['stddev'] = stddev(values)
+            for pct in percentiles:
+                entry[f'p{pct}'] = percentile(values, pct)
+
+    rows = titers.order_by(group, metric).values_list(group, metric).iterator(chunk_size=5000)
+    for group_value, value in rows:
+        if group_value != current:
+            flush()
+            values, current = [], group_value
+        values.append(value)
+    flush()
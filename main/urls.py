@@ -7,4 +7,6 @@ urlpatterns = [
     path('/filtered-samples', views.filter_samples, name='filter_samples'),
     path('export-csv-query/', views.export_csv_query, name='export_csv_query'),
     path('export-csv/<int:experiment_id>/', views.export_csv_by_exp, name='export_csv_by_exp'),
+    path('export-titers/', views.export_titers, name='export_titers'),
+    path('request-stats/', views.request_stats_report, name='request_stats'),
 ]
\ No newline at end of file
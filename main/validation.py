@@ -0,0 +1,147 @@
+"""Validation stage between the sheet rows and the bulk importer.
+
+Each check runs over the whole batch in its own plain Python loop (one pass
+per column, not vectorized): the required fields, the dates (each distinct date
+string is parsed once per run, sheet exports repeat the same few collection
+dates thousands of times), plate numbers, gDNA concentrations and sample ids
+that already appeared earlier in the run. The importer relies on these checks
+and the parsed dates, it doesn't check the rows again. Clean rows go on to BulkImporter with their parsed date, rejected rows are
+reported through on_error and, when a QuarantineReport is given, written to a
+JSON Lines file with the reasons so they can be fixed in the sheet.
+"""
+import json
+import re
+from datetime import date
+
+REQUIRED_FIELDS = ('Sample ID', 'Experiment ID', 'Date Collected')
+
+# values the sheets use for "not measured yet", imported as plate 0 / no concentration
+BLANK_VALUES = {'', 'na', 'n/a'}
+
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def parse_date(value):
+    """date for a 'YYYY-MM-DD' string, None for anything else"""
+    if not isinstance(value, str) or not ISO_DATE.fullmatch(value):
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:  # e.g. 2024-02-30
+        return None
+
+
+def is_blank(value):
+    return value is None or str(value).strip().lower() in BLANK_VALUES
+
+
+def valid_plate_number(value):
+    if is_blank(value):
+        return True
+    if isinstance(value, bool):
+        return False
+    try:
+        return int(str(value).strip()) >= 0
+    except ValueError:
+        return False
+
+
+def valid_concentration(value):
+    if is_blank(value):
+        return True
+    try:
+        float(str(value).strip())
+    except ValueError:
+        return False
+    return True
+
+
+class Rejection:
+    def __init__(self, row_number, row, reasons):
+        self.row_number = row_number
+        self.row = row
+        self.reasons = reasons
+
+    @property
+    def sample_id(self):
+        return self.row.get('Sample ID')
+
+    def message(self):
+        return f"Row {self.row_number} (sample '{self.sample_id}') rejected: {'; '.join(self.reasons)}"
+
+    def as_dict(self):
+        return {'row_number': self.row_number, 'sample_id': self.sample_id, 'reasons': self.reasons, 'row': self.row}
+
+
+class BatchValidator:
+    """Checks batches of sheet rows, keeping the state that spans batches (seen sample ids, parsed dates).
+
+    validate(batch) returns ([(row, created_date), ...], [Rejection, ...]).
+    """
+
+    def __init__(self):
+        self.row_count = 0
+        self.seen_sample_ids = set()
+        self.dates = {}  # date string -> date or None
+
+    def validate(self, batch):
+        first_row = self.row_count + 1
+        self.row_count += len(batch)
+        reasons = [[] for _ in batch]
+
+        for field in REQUIRED_FIELDS:
+            for i, row in enumerate(batch):
+                if row.get(field) in (None, ''):
+                    reasons[i].append(f"Missing '{field}'")
+
+        date_values = [row.get('Date Collected') for row in batch]
+        for value in {value for value in date_values if isinstance(value, str)} - self.dates.keys():
+            self.dates[value] = parse_date(value)
+        created_dates = [self.dates[value] if isinstance(value, str) else None for value in date_values]
+        for i, (value, created_date) in enumerate(zip(date_values, created_dates)):
+            if value not in (None, '') and created_date is None:
+                reasons[i].append(f"Invalid date format: {value!r}, expected YYYY-MM-DD")
+
+        for i, row in enumerate(batch):
+            if not valid_plate_number(row.get('Plate Number')):
+                reasons[i].append(f"Invalid plate number: {row.get('Plate Number')!r}")
+            if not valid_concentration(row.get('gDNA Conc')):
+                reasons[i].append(f"Invalid gDNA concentration: {row.get('gDNA Conc')!r}")
+
+        for i, row in enumerate(batch):
+            sample_id = row.get('Sample ID')
+            if sample_id in (None, ''):
+                continue
+            if sample_id in self.seen_sample_ids:
+                reasons[i].append(f"Duplicate sample id '{sample_id}'")
+            elif not reasons[i]:
+                self.seen_sample_ids.add(sample_id)  # a rejected row doesn't make a later fixed copy a duplicate
+
+        clean, rejected = [], []
+        for i, row in enumerate(batch):
+            if reasons[i]:
+                rejected.append(Rejection(first_row + i, row, reasons[i]))
+            else:
+                clean.append((row, created_dates[i]))
+        return clean, rejected
+
+
+class QuarantineReport:
+    """JSON Lines file with one rejected row per line, created when the first row is rejected"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.file = None
+
+    def add(self, rejections):
+        for rejection in rejections:
+            if self.file is None:
+                self.file = open(self.path, 'w', encoding='utf-8')
+            self.file.write(json.dumps(rejection.as_dict(), default=str) + '\n')
+            self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,8 +1,15 @@
+import os
 from django.shortcuts import render, redirect,  get_object_or_404
-from main.models import Experiment, Sample, Sample_Metadata, Read_Pair
-import csv
-from django.http import HttpResponse
-from django.contrib.auth.decorators import login_required
+from main.models import Experiment, Sample, Titer
+from main.columnar import ExportFormatError, SAMPLE_FIELDS, TITER_FIELDS, export_response, sample_batches, titer_batches
+from main.exports import stream_samples_csv, stream_sample_ids_csv
+from main.facets import get_facets
+from main.filters import SampleFilter
+from main.pagination import InvalidCursor, attach_related, keyset_page
+from urllib.parse import urlencode
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import HttpResponseBadRequest, JsonResponse
+from main.request_stats import request_stats
 
 
 """home page that contains the form for selecting samples associated 
@@ -15,43 +22,17 @@ def home(request):
     experiments_value = [exp['name'] for exp in experiments_dict]
 
     """Code below this is for populating the custom query/filter form. 
-    I need each value saved in its own variable so that they can be passed to the html pg"""
-    #get all meta data so that I can extract the obj I want
-    metadata = Sample_Metadata.objects.all()
-    
-    # Collect unique infection values from metadata
-    unique_infections = set()
-    for meta in metadata:
-        for key, value in meta.metadata.items():
-            if key == 'Infection':
-                unique_infections.add(value)
-    
-     # Collect unique Cell Lines values from metadata
-    unique_cell_lines = set()
-    for meta in metadata:
-        for key, value in meta.metadata.items():
-            if key == 'Cell_Line':
-                unique_cell_lines.add(value)
-    
-     # Collect unique Users from metadata
-    unique_users = set()
-    for meta in metadata:
-        for key, value in meta.metadata.items():
-            if key == 'Initials':
-                unique_users.add(value)
-
-    #holds plate numbers in data
-    plate_num_dict = Read_Pair.objects.values("plate_number")
-    plate_num_value = [num['plate_number'] for num in plate_num_dict] 
-    unique_plate_num_value = list(set(plate_num_value)) #filters so each num is only represented once
-    
+    The distinct values for each dropdown are precomputed in the Facet table (see main/facets.py),
+    so this is one small query no matter how many samples there are"""
+    facets = get_facets()
+
     #passed to html form
     vars = {
         "experiments":experiments_value,
-        'infections':unique_infections, 
-        'cell_lines':unique_cell_lines,
-        "users":unique_users,
-        "plate_num":unique_plate_num_value }
+        'infections':facets['infection'], 
+        'cell_lines':facets['cell_line'],
+        "users":facets['initials'],
+        "plate_num":facets['plate_number'] }
 
     return render(request, "home.html", vars)
 
@@ -60,16 +41,28 @@ def home(request):
 samples associated with that experiment"""
 @login_required(login_url='login')  # Redirect to the login page if not authenticated
 def samples_by_experiment(request):
-    if request.method == 'POST':
-        experiment_ID = request.POST.get('exp_selection') #get form selection from homepage
-        experiment = get_object_or_404(Experiment, name=experiment_ID) #get experiment obj from db
-
-        samples = Sample.objects.filter(experiment=experiment) #get samples associated with that exp
-        metadata = Sample_Metadata.objects.filter(sample_id__in=samples)
-
-        return render(request, "samples_list.html", {'experiment': experiment, 'samples': samples, 'metadata':metadata})
-    else:
-            return redirect('home')
+    # the homepage form POSTs the selection, the next/previous page links send it back as GET
+    data = request.POST if request.method == 'POST' else request.GET
+    experiment_ID = data.get('exp_selection') #get form selection from homepage
+    if not experiment_ID:
+        return redirect('home')
+    experiment = get_object_or_404(Experiment, name=experiment_ID) #get experiment obj from db
+
+    samples = Sample.objects.filter(experiment=experiment) #get samples associated with that exp
+
+    # only one page of samples is loaded, with its metadata attached to each sample (see main/pagination.py)
+    try:
+        page = keyset_page(samples, after=data.get('after'), before=data.get('before'))
+    except InvalidCursor:
+        return redirect('home')
+    attach_related(page.samples)
+
+    return render(request, "samples_list.html", {
+        'experiment': experiment,
+        'samples': page.samples,
+        'page': page,
+        'page_query': urlencode({'exp_selection': experiment.name}),
+    })
     
     
 """route to handel csv export for the *Samples-by-Experiment* fxn on the homepage. This is
@@ -82,98 +75,53 @@ def export_csv_by_exp(request, experiment_id):
     # Get the samples associated with the experiment
     samples = Sample.objects.filter(experiment=experiment)
 
-    # Get all related metadata and read pairs for the filtered samples
-    sample_ids = samples.values_list('id', flat=True)
-    metadata = Sample_Metadata.objects.filter(sample_id__in=sample_ids)
-    read_pairs = Read_Pair.objects.filter(sample_id__in=sample_ids)
-
-    # Create the CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="samples_in_exp_{}.csv"'.format(experiment.name)
-
-    writer = csv.writer(response)
-    writer.writerow(['Sample ID', 'Cell Line', 'Infection Status', 'Created Date', 'Plate Number', 'Read 1 Path', 'Read 2 Path'])
-
-    # Write each row of data
-    for sample in samples:
-        # Accessing metadata and related read pair info for the sample
-        metadata_instance = metadata.filter(sample_id=sample.id).first()
-        read_pair_instance = read_pairs.filter(sample_id=sample.id).first()
-
-        # Extracting the JSON fields from the metadata object
-        cell_line = metadata_instance.metadata.get("Cell_Line", "") if metadata_instance else ""
-        infection = metadata_instance.metadata.get("Infection", "") if metadata_instance else ""
-
-        # Extracting read pair information
-        plate_number = read_pair_instance.plate_number if read_pair_instance else ''
-        read1_path = read_pair_instance.read1_path if read_pair_instance else ''
-        read2_path = read_pair_instance.read2_path if read_pair_instance else ''
-
-        writer.writerow([sample.sample_id, cell_line, infection, sample.created_date, plate_number, read1_path, read2_path])
+    # ?format=parquet / arrow / csv.gz / csv.zst exports every metadata field as a typed column, see main/columnar.py
+    fmt = request.GET.get('format', 'csv')
+    if fmt != 'csv':
+        try:
+            return export_response(fmt, sample_batches(samples), SAMPLE_FIELDS, "samples_in_exp_{}".format(experiment.name))
+        except ExportFormatError as e:
+            return HttpResponseBadRequest(str(e))
 
-    return response
+    # metadata and read pairs are fetched in chunks alongside the samples and streamed, see main/exports.py
+    return stream_samples_csv(samples, "samples_in_exp_{}.csv".format(experiment.name))
     
     
 """If a user wants to create a custom filter, they can do so on the homepage. This route lists out 
 the information of the filtered samples"""
 @login_required(login_url='login')  # Redirect to the login page if not authenticated
 def filter_samples(request):
-    # Initialize an empty queryset for the Sample model
-    samples = Sample.objects.all()  
+    # Access the form data from the homepage POST (or the GET from the next/previous page links).
+    # The filter logic is shared with the export, see main/filters.py
+    data = request.POST if request.method == 'POST' else request.GET
+    sample_filter = SampleFilter.from_querydict(data)
 
-    # Access the form data from POST request
-    cell_line = request.POST.get('cell_line', None)
-    start_date = request.POST.get('start_date', None)
-    end_date = request.POST.get('end_date', None)
-    infection_status = request.POST.get('infection_status', None)
-    users = request.POST.get('users', None)
-    plate_num = request.POST.get('plate_num', None)
+    # a cached COUNT, the ids themselves are only loaded by the export
+    total = sample_filter.count()
 
-
-    # Filtering by cell line from Sample_Metadata JSON field
-    if cell_line:
-        samples = samples.filter(sample_metadata__metadata__Cell_Line=cell_line) 
-
-    # Filter by date range (assuming created_date is in Sample model)
-    if start_date:
-        samples = samples.filter(created_date__gte=start_date)
-
-    if end_date:
-        samples = samples.filter(created_date__lte=end_date)
-
-    # Filtering by infection status from Sample_Metadata JSON field
-    if infection_status:
-        samples = samples.filter(sample_metadata__metadata__Infection=infection_status)
-
-    # Filtering by user/lab member
-    if users:
-        samples = samples.filter(sample_metadata__metadata__Initials=users)
-
-    # Filtering by plate number from Read_Pair model
-    if plate_num:
-        samples = samples.filter(read_pair__plate_number=plate_num)
-
-    # Get all related metadata and read pairs for the filtered samples
-    #have to filter the models by sample_id since that is the foreign key in the models
-    sample_ids = samples.values_list('id', flat=True) 
-    metadata = Sample_Metadata.objects.filter(sample_id__in=sample_ids) 
-    read_pairs = Read_Pair.objects.filter(sample_id__in=sample_ids)
+    # only one page of samples is loaded, with its metadata and read pair attached to each sample
+    try:
+        page = keyset_page(sample_filter.queryset(), after=data.get('after'), before=data.get('before'))
+    except InvalidCursor:
+        return redirect('home')
+    attach_related(page.samples)
 
     #passed to html form
     vars = {
         #holds sample information from the filter that was created on homepage
-        "samples": samples,
-        "metadata": metadata,  
-        "read_pairs": read_pairs,
+        "samples": page.samples,
+        "page": page,
+        "total": total,
+        "page_query": urlencode({field: value for field, value in sample_filter.as_dict().items() if value}),
         
         #copy the filter criteria from the homepage and post it to the hidden form. 
         #this is needed for the export_csv route, so that it can reapply the same filter for the csv file
-        'cell_line':cell_line, 
-        'start_date':start_date,
-        'end_date':end_date,
-        "infection":infection_status,
-        "users":users,
-        "plate_num":plate_num,
+        'cell_line':sample_filter.cell_line, 
+        'start_date':sample_filter.start_date,
+        'end_date':sample_filter.end_date,
+        "infection":sample_filter.infection_status,
+        "users":sample_filter.users,
+        "plate_num":sample_filter.plate_num,
 
         }
 
@@ -183,68 +131,43 @@ def filter_samples(request):
 """CSV export for the *Custom Query/Filter* part of the application"""
 
 def export_csv_query(request):
-    # Get filter criteria from the GET request
-    cell_line = request.GET.get('cell_line', None)
-    infection_status = request.GET.get('infection_status', None)
-    start_date = request.GET.get('start_date', None)
-    end_date = request.GET.get('end_date', None)
-    users = request.GET.get('users', None)
-    plate_num = request.GET.get('plate_num', None)
-
-    """Repeating filter that was applied on homepage"""
-    # Initialize the samples QuerySet
-    samples = Sample.objects.all()
-
-    # Filtering by cell line from Sample_Metadata JSON field
-    if cell_line:
-        samples = samples.filter(sample_metadata__metadata__Cell_Line=cell_line)
-
-    # Filter by date range (assuming created_date is in Sample model)
-    if start_date:
-        samples = samples.filter(created_date__gte=start_date)
-
-    if end_date:
-        samples = samples.filter(created_date__lte=end_date)
-
-    # Filtering by infection status from Sample_Metadata JSON field
-    if infection_status:
-        samples = samples.filter(sample_metadata__metadata__Infection=infection_status)
-
-    # Filtering by user/lab member (Initials field in metadata)
-    if users:
-        samples = samples.filter(sample_metadata__metadata__Initials=users)
-
-    # Filtering by plate number from Read_Pair model
-    if plate_num:
-        samples = samples.filter(read_pair__plate_number=plate_num)
-
-    # Get all related metadata and read pairs for the filtered samples
-    sample_ids = samples.values_list('id', flat=True)
-    metadata = Sample_Metadata.objects.filter(sample_id__in=sample_ids)
-    read_pairs = Read_Pair.objects.filter(sample_id__in=sample_ids)
-
-    # Create the CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="filtered_samples.csv"'
-
-    writer = csv.writer(response)
-    writer.writerow(['Sample ID', 'Cell Line', 'Infection Status', 'Created Date', 'Plate Number', 'Read 1 Path', 'Read 2 Path'])
-
-    # Write each row of data
-    for sample in samples:
-        # Accessing metadata and related read pair info for the sample
-        metadata_instance = metadata.filter(sample_id=sample.id).first()
-        read_pair_instance = read_pairs.filter(sample_id=sample.id).first()
-
-        # Extracting the JSON fields from the metadata object
-        cell_line = metadata_instance.metadata.get("Cell_Line", "") if metadata_instance else ""
-        infection = metadata_instance.metadata.get("Infection", "") if metadata_instance else ""
-
-        # Extracting read pair information
-        plate_number = read_pair_instance.plate_number if read_pair_instance else ''
-        read1_path = read_pair_instance.read1_path if read_pair_instance else ''
-        read2_path = read_pair_instance.read2_path if read_pair_instance else ''
-
-        writer.writerow([sample.sample_id, cell_line, infection, sample.created_date, plate_number, read1_path, read2_path])
-
-    return response
\ No newline at end of file
+    # Get filter criteria from the GET request, this is the same filter that was applied on the filtered samples page
+    sample_filter = SampleFilter.from_querydict(request.GET)
+
+    # the ids are normally still cached from rendering the page, otherwise the filter is run again
+    sample_ids = sample_filter.sample_ids()
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt != 'csv':
+        try:
+            return export_response(fmt, sample_batches(ids=sample_ids), SAMPLE_FIELDS, "filtered_samples")
+        except ExportFormatError as e:
+            return HttpResponseBadRequest(str(e))
+
+    # metadata and read pairs are fetched in chunks alongside the samples and streamed, see main/exports.py
+    return stream_sample_ids_csv(sample_ids, "filtered_samples.csv")
+
+
+"""Titer export, optionally limited to one experiment (?experiment=<name>) and/or sequencing run
+(?sequencing_run=). ?format= is any of main.columnar.EXPORT_FORMATS, gzip compressed CSV by default"""
+@login_required(login_url='login')  # Redirect to the login page if not authenticated
+def export_titers(request):
+    titers = Titer.objects.all()
+    if request.GET.get('experiment'):
+        titers = titers.filter(sample_id__experiment__name=request.GET['experiment'])
+    if request.GET.get('sequencing_run'):
+        titers = titers.filter(sequencing_run=request.GET['sequencing_run'])
+
+    try:
+        return export_response(request.GET.get('format', 'csv.gz'), titer_batches(titers), TITER_FIELDS, "titers")
+    except ExportFormatError as e:
+        return HttpResponseBadRequest(str(e))
+
+
+"""Rolling per-view timings and query counts of this server process, recorded by the opt-in
+RequestStatsMiddleware (see main/request_stats.py). ?reset=1 starts a new window"""
+@user_passes_test(lambda user: user.is_staff, login_url='login')
+def request_stats_report(request):
+    if request.GET.get('reset'):
+        request_stats.reset()
+    return JsonResponse({'pid': os.getpid(), 'views': request_stats.report()})
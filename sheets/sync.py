@@ -0,0 +1,275 @@
+"""Reading the pellet and tn5 Google Sheets into import rows.
+
+Everything here works on any client with the gspread interface used below
+(open_by_key -> spreadsheet, .worksheets(), .worksheet(name).get_all_records()),
+so it can be run against a local fake client without network access.
+
+The experiment tabs are fetched by WorksheetFetcher, on a bounded thread pool
+with retries, or with one batched range read for all of them. The tn5 "gDNA
+concentrations" records are joined to the pellet rows through a
+dict index on Sample ID / Sample Label / Original Sample Name, which is linear in
+the number of rows. For incremental syncs SyncState keeps a content hash per row
+between runs, so only new or changed rows are emitted.
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+except ImportError:  # requests comes with gspread, the fakes in the tests don't need it
+    RequestsConnectionError = RequestsTimeout = ConnectionError
+
+SHEET_ID_PELLETS = '12Cy2HZpVzzzu_erg2XMXCAd19XY88hfhDKUOA5MIDGs' #replace with real id once testing is done!!
+SHEET_ID_TN5 = '13VX6wxF4RHhlJwSEei8kdpTNyGBrq3sgOliiDDZWDsc'
+TN5_WORKSHEET = 'gDNA concentrations'
+
+# tabs in the pellet sheet that aren't experiments
+EXCLUDED_TABS = ["Instructions", "Experiment Template", "Experiments Summary", "Needs Extraction"]
+
+# pellet row columns a tn5 'Sample' value can refer to
+TN5_MATCH_KEYS = ("Sample ID", "Sample Label", "Original Sample Name")
+
+
+def experiment_tab_names(spreadsheet):
+    """titles of the experiment tabs in the pellet sheet"""
+    return [worksheet.title for worksheet in spreadsheet.worksheets() if worksheet.title not in EXCLUDED_TABS]
+
+
+def collected_rows(records):
+    """Filter out rows where Column E ('Date Collected') is empty"""
+    return [row for row in records if row.get('Date Collected')]
+
+
+def numericise(value):
+    """Cell string -> int/float where it looks like one, like get_all_records() does"""
+    if not isinstance(value, str) or value == '':
+        return value
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def records_from_values(values):
+    """get_all_records()-style dicts from a tab's rows of cell values, the first row being the header"""
+    if not values:
+        return []
+    header, *rows = values
+    return [{key: numericise(row[i]) if i < len(row) else '' for i, key in enumerate(header)} for row in rows]
+
+
+def a1_tab_range(title):
+    """A1 range covering a whole tab"""
+    return "'{}'".format(title.replace("'", "''"))
+
+
+# http statuses of a sheets api error (gspread.exceptions.APIError.response) worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error):
+    """True for errors a retry can fix: rate limits, server errors, dropped connections and timeouts.
+    A missing tab, bad credentials or a bug fail straight away"""
+    if isinstance(error, (ConnectionError, TimeoutError, RequestsConnectionError, RequestsTimeout)):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status in TRANSIENT_STATUS_CODES
+
+
+class WorksheetFetcher:
+    """Reads the records of many tabs of a spreadsheet concurrently.
+
+    Each tab is read with get_all_records() on a pool of at most `max_workers` threads, a failed
+    read is retried `retries` times with exponential backoff (`backoff`, 2 * `backoff`, ...) when
+    `retry_if(error)` says the error is transient.
+    With `batch_reads` all tabs are read with one values_batch_get() call instead. How long
+    each tab took is kept in `timings` ({tab: seconds}).
+    """
+
+    def __init__(self, max_workers=4, retries=3, backoff=1.0, batch_reads=False, retry_if=is_transient, sleep=time.sleep):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_reads = batch_reads
+        self.retry_if = retry_if
+        self.sleep = sleep
+        self.timings = {}
+
+    def call(self, function, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return function(*args)
+            except Exception as e:
+                if attempt == self.retries or not self.retry_if(e):
+                    raise
+                self.sleep(self.backoff * 2 ** attempt)
+
+    def fetch_tab(self, spreadsheet, name):
+        started = time.perf_counter()
+        records = self.call(lambda: spreadsheet.worksheet(name).get_all_records())
+        self.timings[name] = time.perf_counter() - started
+        return records
+
+    def fetch(self, spreadsheet, tab_names):
+        """[records of each tab], in the order of `tab_names`"""
+        return list(self.iter_fetch(spreadsheet, tab_names))
+
+    def iter_fetch(self, spreadsheet, tab_names):
+        """Yield the records of each tab in the order of `tab_names` as they become available"""
+        if not tab_names:
+            return
+        if self.batch_reads:
+            started = time.perf_counter()
+            response = self.call(spreadsheet.values_batch_get, [a1_tab_range(name) for name in tab_names])
+            elapsed = time.perf_counter() - started
+            self.timings.update({name: elapsed for name in tab_names})  # one request for all of them
+            for value_range in response['valueRanges']:
+                yield records_from_values(value_range.get('values', []))
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tab_names))) as pool:
+            yield from pool.map(lambda name: self.fetch_tab(spreadsheet, name), tab_names)
+
+
+def iter_pellet_rows(spreadsheet, tab_names=None, fetcher=None):
+    """Yield the collected rows of every experiment tab, in tab order"""
+    fetcher = fetcher or WorksheetFetcher()
+    for records in fetcher.iter_fetch(spreadsheet, tab_names or experiment_tab_names(spreadsheet)):
+        yield from collected_rows(records)
+
+
+def read_pellet_rows(spreadsheet, tab_names=None, fetcher=None):
+    """All collected rows of every experiment tab, in tab order"""
+    return list(iter_pellet_rows(spreadsheet, tab_names, fetcher))
+
+
+def index_tn5_records(tn5_records):
+    """{sample name: [(position, record), ...]} for the tn5 records, in sheet order"""
+    index = {}
+    for position, record in enumerate(tn5_records):
+        name = record.get('Sample')
+        if name not in (None, ''):
+            index.setdefault(name, []).append((position, record))
+    return index
+
+
+def merge_tn5(rows, tn5_records):
+    """Copy gDNA concentration and plate number from the tn5 records onto the matching pellet rows.
+
+    A tn5 record matches a row when its 'Sample' equals the row's Sample ID, Sample Label or
+    Original Sample Name. When several records match, they are applied in sheet order, so the
+    last one wins (a plate number of 'NA' never overwrites one that was already set).
+    """
+    index = index_tn5_records(tn5_records)
+    for row in rows:
+        merge_tn5_row(row, index)
+    return rows
+
+
+def merge_tn5_row(row, index):
+    """merge_tn5 for a single row, `index` being the index_tn5_records() of the tn5 records"""
+    matches = {}
+    for key in TN5_MATCH_KEYS:
+        value = row.get(key)
+        if value in (None, ''):
+            continue
+        for position, record in index.get(value, ()):
+            matches[position] = record
+
+    for position in sorted(matches):
+        record = matches[position]
+        row["gDNA Conc"] = record.get('gDNA Concentration (ng/ul)', '')  #save to json obj
+
+        plate_number = record.get('Plate #')
+        if plate_number != 'NA':# Skip if Plate Number is 'NA'
+            row["Plate Number"] = plate_number
+    return row
+
+
+def iter_rows(client, pellet_key=SHEET_ID_PELLETS, tn5_key=SHEET_ID_TN5, fetcher=None):
+    """Yield every pellet row with its tn5 data merged in, the same rows cleaned_migration.json holds.
+    The tn5 sheet is read (and indexed) first, then the pellet rows are merged and yielded tab by tab"""
+    fetcher = fetcher or WorksheetFetcher()
+    pellet_sheet = client.open_by_key(pellet_key)
+    tn5_sheet = client.open_by_key(tn5_key)
+
+    tn5_records = fetcher.call(lambda: tn5_sheet.worksheet(TN5_WORKSHEET).get_all_records())
+    index = index_tn5_records(tn5_records)
+    for row in iter_pellet_rows(pellet_sheet, fetcher=fetcher):
+        yield merge_tn5_row(row, index)
+
+
+def collect_rows(client, pellet_key=SHEET_ID_PELLETS, tn5_key=SHEET_ID_TN5, fetcher=None):
+    """iter_rows() as a list"""
+    return list(iter_rows(client, pellet_key, tn5_key, fetcher))
+
+
+def row_key(row):
+    return str(row.get("Sample ID") or row.get("Sample Label") or "")
+
+
+def row_hash(row):
+    return hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class SyncState:
+    """Content hash and last-seen time of every row emitted by earlier syncs, stored as JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}
+        self.pending = {}  # key -> entry of the changed rows emitted since the last commit()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.rows = json.load(file).get('rows', {})
+
+    def changed_rows(self, rows):
+        """The rows that are new or differ from the last sync. Call commit() with them once they're stored"""
+        return list(self.iter_changed(rows))
+
+    def iter_changed(self, rows):
+        """changed_rows() as a generator, for streaming rows straight into the importer"""
+        now = datetime.now(timezone.utc).isoformat()
+        for row in rows:
+            key, digest = row_key(row), row_hash(row)
+            previous = self.rows.get(key)
+            entry = {'hash': digest, 'last_seen': now}
+            if previous is None or previous['hash'] != digest:
+                self.pending[key] = entry  # kept by commit(), a row that never gets stored is emitted again
+                yield row
+            else:
+                self.rows[key] = entry
+
+    def commit(self, rows):
+        """Record emitted `rows` as stored and save the state file"""
+        for row in rows:
+            entry = self.pending.pop(row_key(row), None)
+            if entry is not None:
+                self.rows[row_key(row)] = entry
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'rows': self.rows}, file)
+        os.replace(tmp_path, self.path)
+
+
+def sync(client, output_file, state_file=None, fetcher=None):
+    """Write the sheet rows to `output_file` as a JSON array. With a `state_file` only the rows that
+    changed since the last sync are written. Returns (rows read, rows written)"""
+    rows = collect_rows(client, fetcher=fetcher)
+    state = SyncState(state_file) if state_file else None
+    emitted = state.changed_rows(rows) if state else rows
+
+    with open(output_file, 'w', encoding='utf-8') as json_file:
+        json.dump(emitted, json_file, indent=4)
+    if state:
+        state.commit(emitted)  # only after the output was written, so a failed run is retried in full
+    return len(rows), len(emitted)
@@ -0,0 +1,241 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import TestCase, mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase as DbTestCase
+
+from main.importer import BulkImporter
+from main.management.commands.sync_sheets import Command as SyncSheetsCommand
+from main.models import Read_Pair, Sample
+
+from sheets.sync import (SHEET_ID_PELLETS, SHEET_ID_TN5, TN5_WORKSHEET, SyncState, WorksheetFetcher, collect_rows,
+                         merge_tn5, merge_tn5_row, sync)
+
+
+class FakeWorksheet:
+    def __init__(self, title, records, failures=0):
+        self.title = title
+        self.records = records
+        self.failures = failures
+
+    def get_all_records(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("quota exceeded")
+        return [dict(record) for record in self.records]
+
+    def values(self):
+        header = list(self.records[0]) if self.records else []
+        return [header] + [[str(record[key]) for key in header] for record in self.records]
+
+
+class FakeSpreadsheet:
+    def __init__(self, tabs):
+        self.tabs = {title: FakeWorksheet(title, records) for title, records in tabs.items()}
+        self.batch_requests = 0
+
+    def values_batch_get(self, ranges):
+        self.batch_requests += 1
+        return {'valueRanges': [{'range': name, 'values': self.tabs[name.strip("'")].values()} for name in ranges]}
+
+    def worksheets(self):
+        return list(self.tabs.values())
+
+    def worksheet(self, title):
+        return self.tabs[title]
+
+
+class FakeClient:
+    """Stands in for the gspread client, {sheet key: {tab title: records}}"""
+
+    def __init__(self, sheets):
+        self.sheets = {key: FakeSpreadsheet(tabs) for key, tabs in sheets.items()}
+
+    def open_by_key(self, key):
+        return self.sheets[key]
+
+
+def fake_client(pellet_rows, tn5_records):
+    return FakeClient({
+        SHEET_ID_PELLETS: {"Instructions": [{"Sample ID": "ignored", "Date Collected": "x"}], "SI": pellet_rows},
+        SHEET_ID_TN5: {TN5_WORKSHEET: tn5_records},
+    })
+
+
+class MergeTn5Tests(TestCase):
+    def test_matches_on_any_sample_name_and_keeps_sheet_order(self):
+        rows = [
+            {"Sample ID": "SI_1", "Sample Label": "L1"},
+            {"Sample ID": "SI_2", "Original Sample Name": "orig2"},
+            {"Sample ID": "SI_3"},
+        ]
+        tn5 = [
+            {"Sample": "L1", "gDNA Concentration (ng/ul)": 1.5, "Plate #": 4},
+            {"Sample": "orig2", "gDNA Concentration (ng/ul)": 2.0, "Plate #": 5},
+            {"Sample": "SI_2", "gDNA Concentration (ng/ul)": 2.5, "Plate #": "NA"},
+            {"Sample": "", "gDNA Concentration (ng/ul)": 9, "Plate #": 9},
+        ]
+        merge_tn5(rows, tn5)
+
+        self.assertEqual(rows[0]["gDNA Conc"], 1.5)
+        self.assertEqual(rows[0]["Plate Number"], 4)
+        self.assertEqual(rows[1]["gDNA Conc"], 2.5)  # last matching record wins
+        self.assertEqual(rows[1]["Plate Number"], 5)  # 'NA' doesn't overwrite the plate
+        self.assertNotIn("gDNA Conc", rows[2])
+
+
+class SheetSyncTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.dir.name, "out.json")
+        self.state = os.path.join(self.dir.name, "state.json")
+        self.rows = [
+            {"Sample ID": "SI_1", "Date Collected": "2024-07-10"},
+            {"Sample ID": "SI_2", "Date Collected": "2024-07-11"},
+            {"Sample ID": "SI_3", "Date Collected": ""},
+        ]
+        self.tn5 = [{"Sample": "SI_1", "gDNA Concentration (ng/ul)": 3.1, "Plate #": 7}]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read_output(self):
+        with open(self.output) as file:
+            return json.load(file)
+
+    def test_collect_rows_skips_excluded_tabs_and_uncollected_rows(self):
+        rows = collect_rows(fake_client(self.rows, self.tn5))
+        self.assertEqual([row["Sample ID"] for row in rows], ["SI_1", "SI_2"])
+        self.assertEqual(rows[0]["Plate Number"], 7)
+
+    def test_full_sync_writes_every_row(self):
+        self.assertEqual(sync(fake_client(self.rows, self.tn5), self.output), (2, 2))
+        self.assertEqual(len(self.read_output()), 2)
+
+    def test_incremental_sync_only_writes_new_and_changed_rows(self):
+        self.assertEqual(sync(fake_client(self.rows, self.tn5), self.output, self.state), (2, 2))
+        self.assertEqual(sync(fake_client(self.rows, self.tn5), self.output, self.state), (2, 0))
+        self.assertEqual(self.read_output(), [])
+
+        self.tn5[0]["gDNA Concentration (ng/ul)"] = 4.2
+        self.rows.append({"Sample ID": "SI_4", "Date Collected": "2024-07-12"})
+        self.assertEqual(sync(fake_client(self.rows, self.tn5), self.output, self.state), (3, 2))
+        self.assertEqual([row["Sample ID"] for row in self.read_output()], ["SI_1", "SI_4"])
+        self.assertEqual(set(SyncState(self.state).rows), {"SI_1", "SI_2", "SI_4"})
+
+
+class WorksheetFetcherTests(TestCase):
+    def setUp(self):
+        self.spreadsheet = FakeSpreadsheet({
+            f"EXP{i}": [{"Sample ID": f"EXP{i}_1", "Plate Number": i, "Date Collected": "2024-07-10"}] for i in range(6)
+        })
+        self.sleeps = []
+
+    def fetcher(self, **kwargs):
+        return WorksheetFetcher(sleep=self.sleeps.append, **kwargs)
+
+    def test_fetches_every_tab_in_order_with_timings(self):
+        fetcher = self.fetcher(max_workers=3)
+        results = fetcher.fetch(self.spreadsheet, list(self.spreadsheet.tabs))
+        self.assertEqual([records[0]["Sample ID"] for records in results], [f"EXP{i}_1" for i in range(6)])
+        self.assertEqual(set(fetcher.timings), set(self.spreadsheet.tabs))
+
+    def test_retries_with_backoff(self):
+        self.spreadsheet.tabs["EXP2"].failures = 2
+        results = self.fetcher(retries=3, backoff=0.5).fetch(self.spreadsheet, ["EXP2"])
+        self.assertEqual(results[0][0]["Sample ID"], "EXP2_1")
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+
+    def test_gives_up_after_the_last_retry(self):
+        self.spreadsheet.tabs["EXP2"].failures = 5
+        with self.assertRaises(ConnectionError):
+            self.fetcher(retries=2).fetch(self.spreadsheet, ["EXP1", "EXP2"])
+
+    def test_only_transient_errors_are_retried(self):
+        class APIError(Exception):  # shaped like gspread's, with the http response attached
+            def __init__(self, status_code):
+                self.response = mock.Mock(status_code=status_code)
+
+        fetcher = self.fetcher(retries=3)
+        worksheet = mock.Mock()
+        worksheet.get_all_records.side_effect = [APIError(503), [{"Sample ID": "A"}]]
+        self.assertEqual(fetcher.call(worksheet.get_all_records), [{"Sample ID": "A"}])
+
+        for error in (KeyError("EXP9"), APIError(403)):
+            worksheet.get_all_records.side_effect = error
+            with self.assertRaises(type(error)):
+                fetcher.call(worksheet.get_all_records)
+        self.assertEqual(self.sleeps, [1.0])
+
+    def test_batch_reads_match_per_tab_reads(self):
+        names = list(self.spreadsheet.tabs)
+        per_tab = self.fetcher().fetch(self.spreadsheet, names)
+        batched = self.fetcher(batch_reads=True).fetch(self.spreadsheet, names)
+        self.assertEqual(batched, per_tab)
+        self.assertEqual(self.spreadsheet.batch_requests, 1)
+
+
+class SyncSheetsCommandTests(DbTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self.dir.name, "state.json")
+        self.rows = [
+            {"Experiment ID": "SI", "Sample ID": "SI_1", "Date Collected": "2024-07-10", "Cell Line": "JW18"},
+            {"Experiment ID": "SI", "Sample ID": "SI_2", "Date Collected": "2024-07-11", "Cell Line": "JW18"},
+        ]
+        self.tn5 = [{"Sample": "SI_2", "gDNA Concentration (ng/ul)": 3.1, "Plate #": 7}]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def sync(self, *args):
+        out = StringIO()
+        client = fake_client(self.rows, self.tn5)
+        with mock.patch.object(SyncSheetsCommand, "get_client", return_value=client):
+            call_command("sync_sheets", "--state", self.state, *args, stdout=out)
+        return out.getvalue()
+
+    def test_streams_sheet_rows_into_the_db(self):
+        self.sync()
+        self.assertEqual(set(Sample.objects.values_list("sample_id", flat=True)), {"SI_1", "SI_2"})
+        self.assertEqual(Read_Pair.objects.get(sample_id__sample_id="SI_2").plate_number, 7)
+
+    def test_second_sync_only_imports_changed_rows(self):
+        self.sync()
+        self.rows[0]["Cell Line"] = "Aa23"
+        output = self.sync("--batch-reads")
+        self.assertIn("\n1 rows (0 skipped)", output)
+        self.assertEqual(Sample.objects.get(sample_id="SI_1").sample_metadata.cell_line, "Aa23")
+
+    def test_sheets_are_read_between_the_import_transactions(self):
+        depth = len(connection.savepoint_ids)  # the test case's own transaction
+        depths = []
+
+        def recording_merge(row, index):
+            depths.append(len(connection.savepoint_ids))
+            return merge_tn5_row(row, index)
+
+        with mock.patch("sheets.sync.merge_tn5_row", recording_merge):
+            self.sync("--batch-size", "1")
+
+        self.assertEqual(depths, [depth, depth])
+
+    def test_committed_batches_are_kept_when_a_later_one_fails(self):
+        import_batch = BulkImporter.import_batch
+
+        def failing_second_batch(importer, items):
+            if items[0]["Sample ID"] == "SI_2":
+                raise RuntimeError("db went away")
+            return import_batch(importer, items)
+
+        with mock.patch.object(BulkImporter, "import_batch", failing_second_batch), self.assertRaises(RuntimeError):
+            self.sync("--batch-size", "1")
+        self.assertEqual(list(Sample.objects.values_list("sample_id", flat=True)), ["SI_1"])
+        self.assertEqual(set(SyncState(self.state).rows), {"SI_1"})
+
+        output = self.sync("--batch-size", "1")
+        self.assertIn("\n1 rows (0 skipped)", output)  # only the row that wasn't stored
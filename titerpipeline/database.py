@@ -0,0 +1,56 @@
+"""DATABASES['default'] built from environment variables.
+
+DB_ENGINE=postgres selects PostgreSQL (psycopg 3):
+
+    DB_NAME, DB_USER, DB_PASSWORD, DB_HOST (localhost), DB_PORT (5432)
+    DB_CONN_MAX_AGE       seconds a connection is kept open between requests (60)
+    DB_POOL=1             use psycopg's connection pool instead of persistent connections
+    DB_POOL_MIN_SIZE (2), DB_POOL_MAX_SIZE (10), DB_POOL_TIMEOUT (10)
+
+e.g. against a local container:
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=titer -e POSTGRES_DB=titer postgres:16
+    DB_ENGINE=postgres DB_NAME=titer DB_USER=postgres DB_PASSWORD=titer python manage.py migrate
+
+Anything else (the default) is SQLite, DB_NAME overrides the file path. Its
+connections are tuned (WAL mode, busy timeout, ...) by main/sqlite.py.
+"""
+import os
+
+
+def env_flag(name, environ=os.environ):
+    return environ.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_config(base_dir, environ=os.environ):
+    engine = environ.get('DB_ENGINE', 'sqlite').strip().lower()
+
+    if engine in ('postgres', 'postgresql'):
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': environ.get('DB_NAME', 'titerpipeline'),
+            'USER': environ.get('DB_USER', ''),
+            'PASSWORD': environ.get('DB_PASSWORD', ''),
+            'HOST': environ.get('DB_HOST', 'localhost'),
+            'PORT': environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,  # a connection dropped by the server is replaced instead of failing a request
+            'OPTIONS': {},
+        }
+        if env_flag('DB_POOL', environ):
+            config['OPTIONS']['pool'] = {
+                'min_size': int(environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(environ.get('DB_POOL_MAX_SIZE', 10)),
+                'timeout': int(environ.get('DB_POOL_TIMEOUT', 10)),
+            }
+            config['CONN_MAX_AGE'] = 0  # the pool keeps the connections, django can't also persist them
+        return config
+
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': environ.get('DB_NAME') or base_dir / 'db.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',  # take the write lock up front instead of failing mid transaction
+            'timeout': 20,
+        },
+    }
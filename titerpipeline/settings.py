@@ -1,5 +1,7 @@
+import os
 from pathlib import Path
 from django.contrib.messages import constants as message_constants
+from titerpipeline.database import database_config, env_flag
 
 ####
 #Login for Admin Page = {User Name:russell, Password:wolbachia}. all lowercase.
@@ -40,10 +42,14 @@ INSTALLED_APPS = [
     'main',
     'members',
     'ninja',
-    'api'
+    'api',
+    'jobs',
 ]
 
 MIDDLEWARE = [
+    # per-view timing and query stats, first so it times the whole request.
+    # Removes itself unless REQUEST_STATS_ENABLED, see main/request_stats.py
+    'main.request_stats.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +59,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+REQUEST_STATS_ENABLED = env_flag('REQUEST_STATS')
+REQUEST_STATS_FILE = os.environ.get('REQUEST_STATS_FILE')  # each process dumps its stats to <file>.<pid>.json
+
+# files written by the background export jobs (jobs app, run with manage.py run_jobs)
+JOBS_OUTPUT_DIR = Path(os.environ.get('JOBS_OUTPUT_DIR', BASE_DIR / 'job_output'))
+
+# run folders searched for FASTQ files by manage.py scan_fastq (main/fastq_index.py), separated by ':'
+SEQUENCING_DIRS = [path for path in os.environ.get('SEQUENCING_DIRS', '').split(os.pathsep) if path]
+
 MESSAGE_TAGS = {
     message_constants.DEBUG: 'debug',
     message_constants.INFO: 'info',
@@ -84,12 +99,35 @@ WSGI_APPLICATION = 'titerpipeline.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# SQLite (WAL mode) unless DB_ENGINE=postgres is set, see titerpipeline/database.py for the variables
 
 DATABASES = {
+    'default': database_config(BASE_DIR),
+}
+
+# Concurrent /api/receive-paths/ writes are saved together in one transaction (api/write_queue.py)
+READ_PAIR_WRITE_COALESCING = env_flag('READ_PAIR_WRITE_COALESCING')
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# 'sample_lookup' holds the sample id -> metadata lookups of the pipeline API (main/lookup_cache.py).
+# Local memory is per process and bounded by MAX_ENTRIES, the oldest entries are culled first.
+# Its keys carry a generation counter from the db, so invalidation still reaches every process
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sample_lookup': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sample-lookup',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
 }
 
 